@@ -0,0 +1,24 @@
+BEGIN;
+
+CREATE TABLE access_log_hourly (
+  hour          TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
+  token         CHARACTER VARYING        NOT NULL, -- PK
+  supporter_id  INTEGER,
+  request_count INTEGER                  NOT NULL
+);
+
+ALTER TABLE access_log_hourly ADD CONSTRAINT access_log_hourly_pkey PRIMARY KEY (hour, token);
+
+ALTER TABLE access_log_hourly
+  ADD CONSTRAINT access_log_hourly_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+ALTER TABLE access_log_hourly
+  ADD CONSTRAINT access_log_hourly_supporter_id_fkey FOREIGN KEY (supporter_id)
+  REFERENCES supporter (id) MATCH SIMPLE
+  ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX access_log_hourly_supporter_id_idx ON access_log_hourly (supporter_id, hour);
+
+COMMIT;
@@ -0,0 +1,6 @@
+BEGIN;
+
+ALTER TABLE access_log ADD COLUMN bytes_sent BIGINT;
+ALTER TABLE access_log ADD COLUMN status SMALLINT;
+
+COMMIT;
@@ -0,0 +1,18 @@
+BEGIN;
+
+CREATE TABLE signed_url_log (
+  token       CHARACTER VARYING        NOT NULL, -- PK
+  "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
+  url_count   INTEGER                  NOT NULL
+);
+
+ALTER TABLE signed_url_log ADD CONSTRAINT signed_url_log_pkey PRIMARY KEY (token, "timestamp");
+
+ALTER TABLE signed_url_log
+  ADD CONSTRAINT signed_url_log_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+CREATE INDEX signed_url_log_timestamp_idx ON signed_url_log ("timestamp");
+
+COMMIT;
@@ -0,0 +1,6 @@
+BEGIN;
+
+ALTER TABLE tier ADD COLUMN api_rate_limit INTEGER;
+ALTER TABLE tier ADD COLUMN api_rate_limit_burst INTEGER;
+
+COMMIT;
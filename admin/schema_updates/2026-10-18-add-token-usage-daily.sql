@@ -0,0 +1,30 @@
+BEGIN;
+
+CREATE TABLE token_usage_daily (
+  day           DATE              NOT NULL, -- PK
+  token         CHARACTER VARYING NOT NULL, -- PK
+  supporter_id  INTEGER,
+  request_count INTEGER           NOT NULL
+);
+
+ALTER TABLE token_usage_daily ADD CONSTRAINT token_usage_daily_pkey PRIMARY KEY (day, token);
+
+ALTER TABLE token_usage_daily
+  ADD CONSTRAINT token_usage_daily_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+ALTER TABLE token_usage_daily
+  ADD CONSTRAINT token_usage_daily_supporter_id_fkey FOREIGN KEY (supporter_id)
+  REFERENCES supporter (id) MATCH SIMPLE
+  ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX token_usage_daily_supporter_id_idx ON token_usage_daily (supporter_id, day);
+
+-- Filled from the existing hourly usage, `manage.py update-hourly-usage` keeps it up to date.
+INSERT INTO token_usage_daily (day, token, supporter_id, request_count)
+     SELECT CAST(hour AT TIME ZONE 'UTC' AS DATE), token, max(supporter_id), sum(request_count)
+       FROM access_log_hourly
+   GROUP BY CAST(hour AT TIME ZONE 'UTC' AS DATE), token;
+
+COMMIT;
@@ -0,0 +1,34 @@
+BEGIN;
+
+-- Existing access log becomes a single partition that holds everything up to
+-- the start of tomorrow (UTC). Daily partitions after that are created by
+-- `manage.py partition-access-log`, which should be run right after this.
+ALTER TABLE access_log RENAME TO access_log_legacy;
+ALTER TABLE access_log_legacy RENAME CONSTRAINT access_log_pkey TO access_log_legacy_pkey;
+ALTER TABLE access_log_legacy DROP CONSTRAINT access_log_token_fkey;
+
+CREATE TABLE access_log (
+  token       CHARACTER VARYING        NOT NULL, -- PK
+  "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
+  ip_address  INET
+) PARTITION BY RANGE ("timestamp");
+
+ALTER TABLE access_log ADD CONSTRAINT access_log_pkey PRIMARY KEY (token, "timestamp");
+
+ALTER TABLE access_log
+  ADD CONSTRAINT access_log_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+DO $$
+BEGIN
+  EXECUTE format(
+    'ALTER TABLE access_log ATTACH PARTITION access_log_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+    date_trunc('day', now() AT TIME ZONE 'UTC') + interval '1 day' || '+00'
+  );
+END
+$$;
+
+CREATE TABLE access_log_default PARTITION OF access_log DEFAULT;
+
+COMMIT;
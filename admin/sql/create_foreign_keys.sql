@@ -35,6 +35,31 @@ ALTER TABLE access_log
   REFERENCES token (value) MATCH SIMPLE
   ON UPDATE NO ACTION ON DELETE NO ACTION;
 
+ALTER TABLE access_log_hourly
+  ADD CONSTRAINT access_log_hourly_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+ALTER TABLE access_log_hourly
+  ADD CONSTRAINT access_log_hourly_supporter_id_fkey FOREIGN KEY (supporter_id)
+  REFERENCES supporter (id) MATCH SIMPLE
+  ON UPDATE CASCADE ON DELETE SET NULL;
+
+ALTER TABLE token_usage_daily
+  ADD CONSTRAINT token_usage_daily_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
+ALTER TABLE token_usage_daily
+  ADD CONSTRAINT token_usage_daily_supporter_id_fkey FOREIGN KEY (supporter_id)
+  REFERENCES supporter (id) MATCH SIMPLE
+  ON UPDATE CASCADE ON DELETE SET NULL;
+
+ALTER TABLE signed_url_log
+  ADD CONSTRAINT signed_url_log_token_fkey FOREIGN KEY (token)
+  REFERENCES token (value) MATCH SIMPLE
+  ON UPDATE NO ACTION ON DELETE NO ACTION;
+
 ALTER TABLE payment
   ADD CONSTRAINT payment_supporter_id_fkey FOREIGN KEY (supporter_id)
   REFERENCES supporter (id) MATCH SIMPLE
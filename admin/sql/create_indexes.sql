@@ -1,5 +1,8 @@
 BEGIN;
 
 CREATE INDEX payment_supporter_id_idx ON payment (supporter_id);
+CREATE INDEX access_log_hourly_supporter_id_idx ON access_log_hourly (supporter_id, hour);
+CREATE INDEX token_usage_daily_supporter_id_idx ON token_usage_daily (supporter_id, day);
+CREATE INDEX signed_url_log_timestamp_idx ON signed_url_log ("timestamp");
 
 COMMIT;
@@ -5,6 +5,9 @@ ALTER TABLE supporter ADD CONSTRAINT supporter_pkey PRIMARY KEY (id);
 ALTER TABLE token ADD CONSTRAINT token_pkey PRIMARY KEY (value);
 ALTER TABLE token_log ADD CONSTRAINT token_log_pkey PRIMARY KEY (token_value, "timestamp", action);
 ALTER TABLE access_log ADD CONSTRAINT access_log_pkey PRIMARY KEY (token, "timestamp");
+ALTER TABLE access_log_hourly ADD CONSTRAINT access_log_hourly_pkey PRIMARY KEY (hour, token);
+ALTER TABLE token_usage_daily ADD CONSTRAINT token_usage_daily_pkey PRIMARY KEY (day, token);
+ALTER TABLE signed_url_log ADD CONSTRAINT signed_url_log_pkey PRIMARY KEY (token, "timestamp");
 ALTER TABLE payment ADD CONSTRAINT payment_pkey PRIMARY KEY (id);
 ALTER TABLE dataset ADD CONSTRAINT dataset_pkey PRIMARY KEY (id);
 ALTER TABLE dataset_supporter ADD CONSTRAINT dataset_supporter_pkey PRIMARY KEY (id);
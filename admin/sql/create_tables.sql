@@ -7,7 +7,9 @@ CREATE TABLE tier (
   long_desc  TEXT,
   price      NUMERIC(11, 2)    NOT NULL,
   available  BOOLEAN           NOT NULL,
-  "primary"  BOOLEAN           NOT NULL
+  "primary"  BOOLEAN           NOT NULL,
+  api_rate_limit       INTEGER, -- requests per minute
+  api_rate_limit_burst INTEGER
 );
 
 CREATE TABLE dataset (
@@ -65,10 +67,44 @@ CREATE TABLE token_log (
   supporter_id  INTEGER
 );
 
+-- bytes_sent and status are only known for records ingested from nginx logs
+-- (see `manage.py ingest-nginx-logs`).
 CREATE TABLE access_log (
   token       CHARACTER VARYING        NOT NULL, -- PK
   "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
-  ip_address  INET
+  ip_address  INET,
+  bytes_sent  BIGINT,
+  status      SMALLINT
+) PARTITION BY RANGE ("timestamp");
+
+-- Daily partitions are created ahead of time by `manage.py partition-access-log`,
+-- the default partition only catches rows that don't fit into any of them.
+CREATE TABLE access_log_default PARTITION OF access_log DEFAULT;
+
+-- Number of requests made with each token every hour, maintained from the
+-- access log by `manage.py update-hourly-usage`.
+CREATE TABLE access_log_hourly (
+  hour          TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
+  token         CHARACTER VARYING        NOT NULL, -- PK
+  supporter_id  INTEGER,
+  request_count INTEGER                  NOT NULL
+);
+
+-- Number of requests made with each token every day (in UTC), maintained
+-- from access_log_hourly together with it.
+CREATE TABLE token_usage_daily (
+  day           DATE              NOT NULL, -- PK
+  token         CHARACTER VARYING NOT NULL, -- PK
+  supporter_id  INTEGER,
+  request_count INTEGER           NOT NULL
+);
+
+-- Batches of signed download URLs issued to each token. Downloads through
+-- signed URLs don't reach the app, so each issued URL is counted as a request.
+CREATE TABLE signed_url_log (
+  token       CHARACTER VARYING        NOT NULL, -- PK
+  "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL, -- PK
+  url_count   INTEGER                  NOT NULL
 );
 
 CREATE TABLE payment (
@@ -4,6 +4,9 @@ DROP TABLE IF EXISTS payment            CASCADE;
 DROP TABLE IF EXISTS oauth_grant        CASCADE;
 DROP TABLE IF EXISTS oauth_token        CASCADE;
 DROP TABLE IF EXISTS oauth_client       CASCADE;
+DROP TABLE IF EXISTS signed_url_log     CASCADE;
+DROP TABLE IF EXISTS token_usage_daily  CASCADE;
+DROP TABLE IF EXISTS access_log_hourly  CASCADE;
 DROP TABLE IF EXISTS access_log         CASCADE;
 DROP TABLE IF EXISTS token_log          CASCADE;
 DROP TABLE IF EXISTS token              CASCADE;
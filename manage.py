@@ -5,8 +5,11 @@ from metabrainz.model.access_log import AccessLog
 from metabrainz.invoices.send_invoices import QuickBooksInvoiceSender
 import urllib.parse
 import subprocess
+import time
+import json
 import os
 import click
+import pytz
 
 import logging
 
@@ -96,9 +99,172 @@ def compile_translations():
 
 
 @cli.command()
-def cleanup_logs():
+@click.option("--full", is_flag=True, help="Check the whole access log, not only the last day.")
+def cleanup_logs(full=False):
     with create_app().app_context():
-        AccessLog.remove_old_ip_addr_records()
+        AccessLog.remove_old_ip_addr_records(full=full)
+
+
+@cli.command()
+@click.option("--days-ahead", default=7, show_default=True, help="Number of future daily partitions to create.")
+@click.option("--detach-older-than", type=int, help="Detach partitions older than this number of days.")
+@click.option("--drop", is_flag=True, help="Drop detached partitions instead of keeping them as tables.")
+def partition_access_log(days_ahead, detach_older_than=None, drop=False):
+    """Create upcoming access log partitions and detach old ones."""
+    from metabrainz.db import access_log as db_access_log
+    with create_app().app_context():
+        for name in db_access_log.create_partitions(days_ahead=days_ahead):
+            click.echo("Created partition %s" % name)
+        if detach_older_than is not None:
+            for name in db_access_log.detach_partitions(detach_older_than, drop=drop):
+                click.echo("%s partition %s" % ("Dropped" if drop else "Detached", name))
+
+
+@cli.command()
+@click.option("--full", is_flag=True, help="Rebuild hourly usage from the whole access log.")
+@click.option("--since", type=click.DateTime(), help="Recalculate hourly usage starting from this time (UTC).")
+def update_hourly_usage(full=False, since=None):
+    """Update hourly API usage statistics from the access log."""
+    from metabrainz.db import access_log as db_access_log
+    with create_app().app_context():
+        db_access_log.update_hourly_usage(since=since.replace(tzinfo=pytz.utc) if since else None, full=full)
+
+
+@cli.command()
+@click.option("--days", "-d", multiple=True, type=int, default=[1, 7, 30], show_default=True,
+              help="Numbers of days to compute the statistics for.")
+def update_usage_stats(days):
+    """Update cached top IP addresses and tokens shown in the admin interface."""
+    from metabrainz import usage_stats
+    with create_app().app_context():
+        usage_stats.update(days)
+
+
+@cli.command()
+@click.option("--supporter-id", type=int, help="Export records of tokens of this supporter.")
+@click.option("--token", help="Export records of this token.")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), help="First day to export (defaults to a week ago).")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), help="Last day to export (defaults to today).")
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default="csv", show_default=True)
+@click.option("--output", "-o", type=click.File("w"), default="-", help="File to write to (defaults to stdout).")
+def export_access_log(supporter_id=None, token=None, start=None, end=None, fmt="csv", output=None):
+    """Export raw access log records of a supporter or a token."""
+    from metabrainz import access_log_export
+    if supporter_id is None and token is None:
+        raise click.UsageError("Either --supporter-id or --token is required.")
+    start, end = access_log_export.date_range(start.date() if start else None, end.date() if end else None)
+    with create_app().app_context():
+        for chunk in access_log_export.export(fmt, start, end, supporter_id=supporter_id, access_token=token):
+            output.write(chunk)
+
+
+@cli.command()
+@click.option("--interval", default=30, show_default=True, help="Seconds between reads of the access log.")
+def detect_abuse(interval=30):
+    """Detect abuse of access tokens from the access log."""
+    from metabrainz import abuse_detection
+    app = create_app()
+    with app.app_context():
+        abuse_detection.run(abuse_detection.create_engine(app), interval)
+
+
+@cli.command()
+@click.option("--watch", is_flag=True, help="Keep watching directories for new files.")
+@click.option("--interval", default=60, show_default=True, help="Seconds between scans when watching.")
+@click.option("--workers", type=int, help="Number of hashing processes (defaults to the number of CPUs).")
+def index_checksums(watch=False, interval=60, workers=None):
+    """Update SHA-256 manifests of replication packets and JSON dumps."""
+    from metabrainz.api import checksums, packets
+    app = create_app()
+    directories = [
+        (app.config['REPLICATION_PACKETS_DIR'], packets.PACKET_PATTERN),
+        (app.config['JSON_DUMPS_DIR'], checksums.JSON_DUMP_PATTERN),
+    ]
+    checksums.run_indexer(directories, interval=interval if watch else None, workers=workers)
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--state-file", required=True, type=click.Path(dir_okay=False),
+              help="File to keep positions reached in the logs in.")
+@click.option("--follow", is_flag=True, help="Keep loading new requests from the logs.")
+@click.option("--interval", default=10, show_default=True, help="Seconds between reads when following.")
+@click.option("--batch-size", default=10000, show_default=True, help="Number of records loaded at once.")
+def ingest_nginx_logs(paths, state_file, follow=False, interval=10, batch_size=10000):
+    """Load API requests from nginx access logs into the access log."""
+    from metabrainz.api import nginx_log
+    app = create_app()
+    with app.app_context():
+        if follow:
+            nginx_log.follow(app, paths, state_file, interval, batch_size)
+        else:
+            inserted, earliest = nginx_log.ingest(app, paths, state_file, batch_size)
+            click.echo("Loaded %d access log records." % inserted)
+            if nginx_log.update_hourly_usage(earliest):
+                click.echo("Recalculated hourly usage since %s." % earliest)
+
+
+@cli.command()
+@click.option("--interval", default=5, show_default=True, help="Seconds between checks for new packets.")
+def watch_replication_packets(interval=5):
+    """Announce new replication packets to clients waiting for them."""
+    from metabrainz.api import packet_events
+    app = create_app()
+    packet_events.watch(app.config['REPLICATION_PACKETS_DIR'], interval)
+
+
+@cli.command()
+@click.option("--interval", default=10, show_default=True, help="Seconds between checks for new files.")
+def warm_page_cache(interval=10):
+    """Keep the newest replication packets and JSON dumps in the page cache."""
+    from metabrainz.api import page_cache
+    app = create_app()
+    with app.app_context():
+        page_cache.create_warmer(app).run(interval)
+
+
+@cli.command()
+@click.option("--count", default=24, show_default=True, help="Number of latest packets to compress.")
+@click.option("--watch", is_flag=True, help="Keep compressing new packets.")
+@click.option("--interval", default=60, show_default=True, help="Seconds between checks for new packets.")
+def compress_packets_zstd(count=24, watch=False, interval=60):
+    """Create zstd copies of the latest and of requested replication packets."""
+    from metabrainz.api import zstd_cache
+    app = create_app()
+    packets_dir = app.config['REPLICATION_PACKETS_DIR']
+    level = app.config.get('ZSTD_LEVEL', zstd_cache.DEFAULT_LEVEL)
+    max_size = app.config.get('ZSTD_CACHE_MAX_SIZE', zstd_cache.DEFAULT_MAX_SIZE)
+    while True:
+        try:
+            created = zstd_cache.compress_latest(packets_dir, count, level=level, max_size=max_size)
+            created += zstd_cache.compress_requested(packets_dir, level=level, max_size=max_size)
+            if created:
+                click.echo("Created %d zstd copies of replication packets." % created)
+        except Exception:
+            if not watch:
+                raise
+            logging.exception("Failed to compress replication packets with zstd")
+        if not watch:
+            break
+        time.sleep(interval)
+
+
+@cli.command()
+@click.option("--packets", default=20000, show_default=True, help="Number of replication packets in the directory.")
+@click.option("--tokens", default=100, show_default=True, help="Number of tokens making requests.")
+@click.option("--access-log-rows", default=100000, show_default=True, help="Number of access log rows in the last hour.")
+@click.option("--requests", default=500, show_default=True, help="Number of requests to each endpoint.")
+@click.option("--processes", default=4, show_default=True, help="Number of processes generating load.")
+@click.option("--output", "-o", type=click.File("w"), help="File to write results to, as JSON.")
+def benchmark_api(packets, tokens, access_log_rows, requests, processes, output=None):
+    """Measure throughput and latency of API endpoints (development databases only)."""
+    from metabrainz.benchmarks import api
+    with create_app().app_context():
+        results = api.run(packet_count=packets, token_count=tokens, access_log_rows=access_log_rows,
+                          requests=requests, processes=processes)
+    click.echo(json.dumps(results, indent=4))
+    if output:
+        json.dump(results, output, indent=4)
 
 
 @cli.command()
@@ -103,6 +103,10 @@ def create_app(debug=None, config_path=None):
     from brainzutils import cache
     cache.init(**app.config['REDIS'])
 
+    # Metrics
+    from metabrainz import metrics
+    metrics.init_app(app)
+
     # quickbooks module setup
     from metabrainz.admin.quickbooks import quickbooks
     quickbooks.init(app)
@@ -159,6 +163,7 @@ def create_app(debug=None, config_path=None):
     from metabrainz.admin.views import PaymentsView
     from metabrainz.admin.views import TokensView
     from metabrainz.admin.views import StatsView
+    from metabrainz.admin.views import BlockedIPsView
     admin.add_view(CommercialSupportersView(name='Commercial supporters', category='Supporters'))
     admin.add_view(SupportersView(name='Search', category='Supporters'))
     admin.add_view(PaymentsView(name='All', category='Payments'))
@@ -167,6 +172,7 @@ def create_app(debug=None, config_path=None):
     admin.add_view(StatsView(name='Top IPs', endpoint="statsview/top-ips", category='Statistics'))
     admin.add_view(StatsView(name='Top Tokens', endpoint="statsview/top-tokens", category='Statistics'))
     admin.add_view(StatsView(name='Supporters', endpoint="statsview/supporters", category='Statistics'))
+    admin.add_view(BlockedIPsView(name='Blocked IPs', category='Statistics'))
 
     if app.config["QUICKBOOKS_CLIENT_ID"]:
         admin.add_view(QuickBooksView(name='Invoices', endpoint="quickbooks/", category='Quickbooks'))
@@ -0,0 +1,270 @@
+"""Detection of access token abuse from the access log.
+
+Instead of checking requests as they're logged, a separate process
+(`manage.py detect-abuse`) reads new access log records incrementally and
+evaluates sliding-window rules for every token on them. Records are read up to
+`SETTLE_DELAY` seconds before the current time, so that ones that are written
+in batches (see `metabrainz.api.access_log_writer`) or loaded from nginx logs
+have arrived. Everything after that point is read on the next poll, starting
+from the watermark reached so far minus a margin (`ABUSE_DETECTION_LATE_MARGIN`
+seconds), so that records that arrive later than that with older timestamps
+are still evaluated. The margin only needs to cover how late the writers can
+be (a failed flush retried on the next one, nginx logs loaded every few
+seconds), every poll reads it again. Records are read in order of time and the
+ones that have already been processed are skipped. Records that arrive even
+later are not evaluated.
+
+Rules are configured with `ABUSE_DETECTION_RULES`, a list of dictionaries
+with the fields of `Rule`. Kinds of rules:
+
+    requests: number of requests in the window.
+    distinct_ips: number of distinct IP addresses in the window.
+    distinct_networks: number of distinct networks (IP addresses truncated to
+        `ipv4_prefix` or `ipv6_prefix` bits) in the window. This approximates
+        geographic spread without a GeoIP or ASN database.
+
+A rule is broken when its count exceeds the limit. Admins are notified by
+email about every broken rule of a token at most once an hour, which is
+tracked with `alert_sent_` keys in the cache.
+
+Windows are kept in memory, so after a restart the engine starts reading the
+access log from the start of the longest window.
+"""
+from brainzutils import cache
+from brainzutils.mail import send_mail
+from collections import Counter, deque, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from metabrainz.db import access_log as db_access_log
+from metabrainz.model import db
+from metabrainz.model.supporter import Supporter
+from metabrainz.model.token import Token
+import ipaddress
+import logging
+import pytz
+import time
+
+SETTLE_DELAY = 60
+DEFAULT_LATE_RECORDS_MARGIN = 5 * 60
+DEFAULT_INTERVAL = 30
+ALERT_DEDUPLICATION_TTL = 60 * 60  # 1 hour
+
+KINDS = ("requests", "distinct_ips", "distinct_networks")
+
+Rule = namedtuple("Rule", ["name", "kind", "window", "limit", "ipv4_prefix", "ipv6_prefix"],
+                  defaults=[16, 48])
+
+DEFAULT_RULES = [
+    # Matches the check that used to run when requests were logged.
+    {"name": "distinct_ips", "kind": "distinct_ips", "window": 60 * 60, "limit": 50},
+]
+
+
+def load_rules(config):
+    """Creates rules from dictionaries, checking that they make sense."""
+    rules = []
+    for rule in config:
+        rule = Rule(**rule)
+        if rule.kind not in KINDS:
+            raise ValueError("Unknown kind of rule %s: %s" % (rule.name, rule.kind))
+        if rule.window <= 0:
+            raise ValueError("Window of rule %s must be positive" % rule.name)
+        rules.append(rule)
+    if len({rule.name for rule in rules}) != len(rules):
+        raise ValueError("Names of rules must be unique")
+    return rules
+
+
+def network(ip_address, rule):
+    address = ipaddress.ip_address(ip_address)
+    prefix = rule.ipv4_prefix if address.version == 4 else rule.ipv6_prefix
+    return str(ipaddress.ip_network("%s/%s" % (address, prefix), strict=False))
+
+
+class Window(object):
+    """Sliding window over the requests of one token, for one rule.
+
+    Keeps the timestamps of requests in the window and, for rules that count
+    distinct values, how many of them have each value.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.events = deque()
+        self.values = Counter()
+
+    def _value(self, ip_address):
+        if self.rule.kind == "distinct_ips":
+            return ip_address
+        if self.rule.kind == "distinct_networks":
+            return network(ip_address, self.rule)
+        return None
+
+    def add(self, timestamp, ip_address):
+        if self.rule.kind != "requests" and not ip_address:
+            # IP addresses are removed from old records (see `manage.py cleanup-logs`).
+            return
+        latest = self.events[-1][0] if self.events else timestamp
+        if timestamp <= latest - self.rule.window:
+            # Arrived late, after it had already left the window.
+            return
+        value = self._value(ip_address)
+        # Records that arrive late are inserted in order of time.
+        i = len(self.events)
+        while i and self.events[i - 1][0] > timestamp:
+            i -= 1
+        self.events.insert(i, (timestamp, value))
+        if value is not None:
+            self.values[value] += 1
+        self.expire(max(latest, timestamp))
+
+    def expire(self, now):
+        cutoff = now - self.rule.window
+        while self.events and self.events[0][0] <= cutoff:
+            _, value = self.events.popleft()
+            if value is not None:
+                self.values[value] -= 1
+                if not self.values[value]:
+                    del self.values[value]
+
+    @property
+    def count(self):
+        return len(self.values) if self.rule.kind != "requests" else len(self.events)
+
+
+class DetectionEngine(object):
+    """Evaluates rules on access log records.
+
+    Args:
+        rules: List of `Rule`.
+        alert: Function called with (access token, rule, count) when a rule
+            is broken.
+        late_margin: Number of seconds before the watermark from which
+            records are read again on every poll.
+    """
+
+    def __init__(self, rules, alert, late_margin=DEFAULT_LATE_RECORDS_MARGIN):
+        self.rules = rules
+        self.alert = alert
+        self.late_margin = timedelta(seconds=late_margin)
+        self.max_window = max((rule.window for rule in rules), default=0)
+        self.windows = {}  # Windows of every rule by token
+        self.alerted = {}  # Time of the last alert by (token, rule name)
+        self.watermark = None
+        self.seen = set()  # (token, timestamp) of processed records within the margin
+
+    def process(self, records):
+        """Adds records to windows of their tokens and evaluates rules.
+
+        Records of each token should be ordered by time, ones that arrive
+        late are inserted into the windows in order.
+
+        Args:
+            records: Iterable of (access token, timestamp, IP address, ...)
+                tuples.
+        """
+        for record in records:
+            access_token, timestamp, ip_address = record[:3]
+            timestamp = timestamp.timestamp()
+            windows = self.windows.get(access_token)
+            if windows is None:
+                windows = self.windows[access_token] = [Window(rule) for rule in self.rules]
+            for window in windows:
+                window.add(timestamp, ip_address)
+                if window.count > window.rule.limit:
+                    key = (access_token, window.rule.name)
+                    if key not in self.alerted or timestamp - self.alerted[key] >= ALERT_DEDUPLICATION_TTL:
+                        self.alerted[key] = timestamp
+                        self.alert(access_token, window.rule, window.count)
+
+    def expire(self, now):
+        """Drops windows of tokens that haven't been used within any window."""
+        for access_token in list(self.windows):
+            windows = self.windows[access_token]
+            for window in windows:
+                window.expire(now)
+            if not any(window.events for window in windows):
+                del self.windows[access_token]
+        for key, alerted in list(self.alerted.items()):
+            if now - alerted >= ALERT_DEDUPLICATION_TTL:
+                del self.alerted[key]
+
+    def poll(self, now=None):
+        """Processes access log records logged since the watermark.
+
+        Must be called within an application context.
+        """
+        now = now if now is not None else time.time()
+        until = datetime.fromtimestamp(now - SETTLE_DELAY, pytz.utc)
+        if self.watermark is None:
+            since = until - timedelta(seconds=self.max_window)
+        elif until <= self.watermark:
+            return
+        else:
+            since = self.watermark - self.late_margin
+        self.process(self._unseen(db_access_log.iter_records(since, until, order_by_time=True)))
+        self.watermark = until
+        cutoff = until - self.late_margin
+        self.seen = {key for key in self.seen if key[1] >= cutoff}
+        self.expire(until.timestamp())
+
+    def _unseen(self, records):
+        """Skips records that have already been processed, and remembers the
+        others."""
+        for record in records:
+            # Token and timestamp are the primary key of the access log.
+            key = (record[0], record[1])
+            if key not in self.seen:
+                self.seen.add(key)
+                yield record
+
+
+def _alert_key(access_token, rule):
+    # The key of the distinct IP rule is the one used before the engine existed.
+    if rule.name == "distinct_ips":
+        return "alert_sent_%s" % access_token
+    return "alert_sent_%s_%s" % (access_token, rule.name)
+
+
+def send_alert(access_token, rule, count):
+    """Notifies admins about a broken rule, unless they've been notified
+    about it in the last hour."""
+    key = _alert_key(access_token, rule)
+    if cache.get(key):
+        return
+    email = db.session \
+        .query(Supporter.contact_email) \
+        .join(Token) \
+        .filter(Token.value == access_token) \
+        .scalar()
+    msg = ("Abuse detection rule %s broken by token %s\n\n"
+           "The supporter associated with the token can be contacted at %s\n\n"
+           "%s of this token in the last %s seconds: %s (limit is %s).") % \
+          (rule.name, access_token, email, rule.kind.replace("_", " ").capitalize(), rule.window, count, rule.limit)
+    logging.info(msg)
+    send_mail(
+        subject="[MetaBrainz] Abuse detection rule %s broken" % rule.name,
+        recipients=current_app.config['NOTIFICATION_RECIPIENTS'],
+        text=msg,
+    )
+    cache.set(key, True, ALERT_DEDUPLICATION_TTL)
+
+
+def create_engine(app):
+    """Creates an engine with rules from the config of an app."""
+    return DetectionEngine(
+        load_rules(app.config.get("ABUSE_DETECTION_RULES", DEFAULT_RULES)),
+        send_alert,
+        late_margin=app.config.get("ABUSE_DETECTION_LATE_MARGIN", DEFAULT_LATE_RECORDS_MARGIN),
+    )
+
+
+def run(engine, interval=DEFAULT_INTERVAL):
+    """Keeps processing new access log records every `interval` seconds.
+
+    Must be called within an application context.
+    """
+    while True:
+        engine.poll()
+        db.session.remove()
+        time.sleep(interval)
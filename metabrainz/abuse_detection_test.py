@@ -0,0 +1,133 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz import abuse_detection
+from metabrainz.abuse_detection import DetectionEngine, Rule
+from metabrainz.db import access_log as db_access_log
+from metabrainz.model import Supporter
+from metabrainz.model.supporter import STATE_ACTIVE
+from brainzutils import cache
+from datetime import datetime, timedelta
+from unittest import mock
+import pytz
+import uuid
+
+
+class DetectionEngineTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(DetectionEngineTestCase, self).setUp()
+        self.alerts = []
+        self.start = datetime(2024, 1, 1, tzinfo=pytz.utc)
+
+    def _engine(self, *rules):
+        return DetectionEngine(list(rules), lambda *alert: self.alerts.append(alert))
+
+    def test_distinct_ips(self):
+        rule = Rule("ips", "distinct_ips", window=60, limit=2)
+        engine = self._engine(rule)
+        engine.process([
+            ("token-a", self.start, "10.0.0.1"),
+            ("token-a", self.start + timedelta(seconds=1), "10.0.0.2"),
+            ("token-a", self.start + timedelta(seconds=2), "10.0.0.2"),
+            ("token-a", self.start + timedelta(seconds=3), None),
+            ("token-b", self.start, "10.0.0.3"),
+        ])
+        self.assertEqual(self.alerts, [])
+
+        engine.process([("token-a", self.start + timedelta(seconds=4), "10.0.0.3")])
+        self.assertEqual(self.alerts, [("token-a", rule, 3)])
+
+        # Alerts about the same token and rule are only sent once in a while.
+        engine.process([("token-a", self.start + timedelta(seconds=5), "10.0.0.4")])
+        self.assertEqual(len(self.alerts), 1)
+
+        # Requests drop out of the window.
+        engine.expire((self.start + timedelta(seconds=62)).timestamp())
+        self.assertEqual(engine.windows["token-a"][0].count, 2)
+        engine.expire((self.start + timedelta(seconds=66)).timestamp())
+        self.assertNotIn("token-a", engine.windows)
+
+    def test_requests_and_networks(self):
+        requests = Rule("rate", "requests", window=10, limit=3)
+        networks = Rule("networks", "distinct_networks", window=60, limit=1, ipv4_prefix=24)
+        engine = self._engine(requests, networks)
+        engine.process([
+            ("token", self.start + timedelta(seconds=i * 4), "10.0.%s.%s" % (i // 3, i)) for i in range(5)
+        ])
+        self.assertEqual(self.alerts, [("token", networks, 2)])
+
+        engine.process([("token", self.start + timedelta(seconds=17 + i), "10.0.1.1") for i in range(3)])
+        self.assertEqual(self.alerts[-1], ("token", requests, 4))
+
+    def test_late_records(self):
+        rule = Rule("rate", "requests", window=10, limit=2)
+        engine = self._engine(rule)
+        engine.process([("token", self.start + timedelta(seconds=i), None) for i in (0, 5)])
+        # Late records are inserted in order, ones that already left the window are dropped.
+        engine.process([("token", self.start + timedelta(seconds=i), None) for i in (-10, 3)])
+        window = engine.windows["token"][0]
+        self.assertEqual([timestamp - self.start.timestamp() for timestamp, _ in window.events], [0, 3, 5])
+        self.assertEqual(self.alerts, [("token", rule, 3)])
+
+    def test_load_rules(self):
+        rules = abuse_detection.load_rules(abuse_detection.DEFAULT_RULES)
+        self.assertEqual(rules, [Rule("distinct_ips", "distinct_ips", 3600, 50)])
+        with self.assertRaises(ValueError):
+            abuse_detection.load_rules([{"name": "geo", "kind": "countries", "window": 60, "limit": 1}])
+        with self.assertRaises(ValueError):
+            abuse_detection.load_rules([{"name": "rate", "kind": "requests", "window": 60, "limit": 1}] * 2)
+
+    def test_poll(self):
+        supporter = Supporter.add(is_commercial=True,
+                                  musicbrainz_id="mb_commercial",
+                                  musicbrainz_row_id=3,
+                                  contact_name="Mr. Commercial",
+                                  contact_email="testc@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!"
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        token = supporter.generate_token()
+        now = datetime.now(pytz.utc)
+        rule = Rule("distinct_ips", "distinct_ips", window=600, limit=2)
+        engine = DetectionEngine([rule], abuse_detection.send_alert)
+
+        db_access_log.copy_records([
+            (token, now - timedelta(minutes=5, seconds=i), "10.1.2.%s" % i, None, None) for i in range(3)
+        ])
+        # Records of the last SETTLE_DELAY seconds are left for later.
+        db_access_log.copy_records([(token, now, "10.1.2.3", None, None)])
+
+        with mock.patch("metabrainz.abuse_detection.send_mail") as send_mail:
+            engine.poll(now.timestamp())
+            send_mail.assert_called_once()
+            self.assertIn("testc@musicbrainz.org", send_mail.call_args[1]["text"])
+            self.assertTrue(cache.get("alert_sent_%s" % token))
+            self.assertEqual(engine.windows[token][0].count, 3)
+
+            # A new engine doesn't send the same alert again.
+            engine = DetectionEngine([rule], abuse_detection.send_alert)
+            engine.poll(now.timestamp())
+            send_mail.assert_called_once()
+
+        engine.poll(now.timestamp() + abuse_detection.SETTLE_DELAY + 1)
+        self.assertEqual(engine.windows[token][0].count, 4)
+
+        # Records that arrive after the watermark has passed them are still evaluated, once.
+        db_access_log.copy_records([(token, now - timedelta(minutes=1), "10.1.2.4", None, None)])
+        engine.poll(now.timestamp() + abuse_detection.SETTLE_DELAY + 2)
+        self.assertEqual(len(engine.windows[token][0].events), 5)
+        engine.poll(now.timestamp() + abuse_detection.SETTLE_DELAY + 3)
+        self.assertEqual(len(engine.windows[token][0].events), 5)
+
+        # Records that arrive later than the margin aren't read again.
+        engine.late_margin = timedelta(seconds=30)
+        db_access_log.copy_records([(token, now - timedelta(minutes=2), "10.1.2.5", None, None)])
+        engine.poll(now.timestamp() + abuse_detection.SETTLE_DELAY + 4)
+        self.assertEqual(len(engine.windows[token][0].events), 5)
+
+    def test_alert_key(self):
+        token = str(uuid.uuid4())
+        self.assertEqual(abuse_detection._alert_key(token, Rule("distinct_ips", "distinct_ips", 60, 1)),
+                         "alert_sent_%s" % token)
+        self.assertEqual(abuse_detection._alert_key(token, Rule("rate", "requests", 60, 1)),
+                         "alert_sent_%s_rate" % token)
@@ -0,0 +1,78 @@
+"""Export of raw access log records as CSV or NDJSON.
+
+Records are read with a server-side cursor (see
+`metabrainz.db.access_log.iter_records`) and turned into chunks of text as
+they arrive, so an export can be streamed in a response or written to a file
+without holding it in memory.
+"""
+from datetime import datetime, time, timedelta
+from metabrainz.db import access_log as db_access_log
+import pytz
+import json
+import csv
+import io
+
+FIELDS = ("token", "timestamp", "ip_address", "bytes_sent", "status")
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+DEFAULT_DAYS = 7
+
+# Number of records written out at once.
+CHUNK_SIZE = 1000
+
+
+def _row(record):
+    token, timestamp, ip_address, bytes_sent, status = record
+    return token, timestamp.isoformat(), ip_address, bytes_sent, status
+
+
+def _csv_chunks(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for i, record in enumerate(records, 1):
+        writer.writerow(_row(record))
+        if i % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps(dict(zip(FIELDS, _row(record)))) + "\n")
+        if len(lines) == CHUNK_SIZE:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def date_range(start=None, end=None):
+    """Turns an inclusive range of dates into (start, end) times in UTC.
+
+    Missing dates default to the last `DEFAULT_DAYS` days.
+    """
+    end = end or datetime.now(pytz.utc).date()
+    start = start or end - timedelta(days=DEFAULT_DAYS - 1)
+    return (datetime.combine(start, time.min, tzinfo=pytz.utc),
+            datetime.combine(end + timedelta(days=1), time.min, tzinfo=pytz.utc))
+
+
+def export(fmt, start, end, supporter_id=None, access_token=None):
+    """Yields chunks of an export of access log records.
+
+    Must be called within an application context. See
+    `metabrainz.db.access_log.iter_records` for the arguments.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unsupported export format: %s" % fmt)
+    records = db_access_log.iter_records(start, end, supporter_id=supporter_id, access_token=access_token)
+    chunks = _csv_chunks if fmt == "csv" else _ndjson_chunks
+    return chunks(records)
@@ -0,0 +1,60 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz import access_log_export
+from metabrainz.db import access_log as db_access_log
+from metabrainz.model import Supporter
+from metabrainz.model.supporter import STATE_ACTIVE
+from datetime import date, datetime
+import json
+import pytz
+
+
+class AccessLogExportTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(AccessLogExportTestCase, self).setUp()
+        supporter = Supporter.add(is_commercial=False,
+                                  musicbrainz_id="mb_test",
+                                  musicbrainz_row_id=1,
+                                  contact_name="Mr. Test",
+                                  contact_email="test@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!",
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        self.supporter_id = supporter.id
+        self.token = supporter.generate_token()
+        self.timestamp = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        db_access_log.copy_records([
+            (self.token, self.timestamp, "10.0.0.1", 1000, 200),
+            (self.token, datetime(2024, 1, 3, tzinfo=pytz.utc), "10.0.0.2", 10, 200),
+        ])
+
+    def test_date_range(self):
+        self.assertEqual(access_log_export.date_range(date(2024, 1, 1), date(2024, 1, 2)), (
+            datetime(2024, 1, 1, tzinfo=pytz.utc),
+            datetime(2024, 1, 3, tzinfo=pytz.utc),
+        ))
+        start, end = access_log_export.date_range()
+        self.assertEqual((end - start).days, access_log_export.DEFAULT_DAYS)
+
+    def test_export_csv(self):
+        start, end = access_log_export.date_range(date(2024, 1, 1), date(2024, 1, 2))
+        data = "".join(access_log_export.export("csv", start, end, supporter_id=self.supporter_id))
+        self.assertEqual(data.splitlines(), [
+            "token,timestamp,ip_address,bytes_sent,status",
+            "%s,%s,10.0.0.1,1000,200" % (self.token, self.timestamp.isoformat()),
+        ])
+
+    def test_export_ndjson(self):
+        start, end = access_log_export.date_range(date(2024, 1, 1), date(2024, 1, 3))
+        lines = "".join(access_log_export.export("ndjson", start, end, access_token=self.token)).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), {
+            "token": self.token,
+            "timestamp": self.timestamp.isoformat(),
+            "ip_address": "10.0.0.1",
+            "bytes_sent": 1000,
+            "status": 200,
+        })
+        with self.assertRaises(ValueError):
+            access_log_export.export("xml", start, end, access_token=self.token)
@@ -1,24 +1,29 @@
+from datetime import date, timedelta
 from decimal import Decimal
-from flask import Response, request, redirect, url_for, current_app
+from flask import Response, request, redirect, url_for, current_app, stream_with_context
 from flask_admin import expose
 from metabrainz.admin import AdminIndexView, AdminBaseView, forms
 from metabrainz.admin.forms import get_logo_storage_dir
 from metabrainz.model.supporter import Supporter, STATE_PENDING, STATE_ACTIVE, STATE_REJECTED, STATE_WAITING, STATE_LIMITED
-from metabrainz.model.token import Token
+from metabrainz.model.token import Token, get_cache_stats as get_token_cache_stats
 from metabrainz.model.token_log import TokenLog
 from metabrainz.model.access_log import AccessLog
 from metabrainz.db import supporter as db_supporter
 from metabrainz.db import payment as db_payment
+from metabrainz.api import ip_block
+from metabrainz import access_log_export
+from metabrainz import usage_stats
+from metabrainz import reverse_dns
 from metabrainz import flash
-from brainzutils import cache
+from werkzeug.exceptions import NotFound, BadRequest
 from werkzeug.utils import secure_filename
 import werkzeug.datastructures
 import os.path
+import calendar
 import logging
 import time
 import uuid
 import json
-import socket
 
 from metabrainz.utils import get_int_query_param
 
@@ -130,13 +135,37 @@ class SupportersView(AdminBaseView):
 
     @expose('/<int:supporter_id>/stats')
     def details_stats(self, supporter_id):
-        stats = AccessLog.get_hourly_usage(supporter_id=supporter_id)
+        stats = AccessLog.get_daily_usage(supporter_id=supporter_id)
         return Response(json.dumps([{'data': [[
-                time.mktime(i[0].utctimetuple()) * 1000,
+                calendar.timegm(i[0].timetuple()) * 1000,
                 i[1]
             ] for i in stats]}]),
             content_type='application/json; charset=utf-8')
 
+    @expose('/<int:supporter_id>/access-log')
+    def export_access_log(self, supporter_id):
+        supporter = Supporter.get(id=supporter_id)
+        if not supporter:
+            raise NotFound("Can't find supporter with a specified ID.")
+        fmt = request.args.get('format', 'csv')
+        if fmt not in access_log_export.FORMATS:
+            raise BadRequest("Unsupported export format.")
+        try:
+            start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+            end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+        except ValueError:
+            raise BadRequest("Dates must be in the YYYY-MM-DD format.")
+        start, end = access_log_export.date_range(start, end)
+
+        chunks = access_log_export.export(fmt, start, end, supporter_id=supporter.id,
+                                          access_token=request.args.get('token') or None)
+        filename = 'access-log-%s-%s-%s.%s' % (supporter.id, start.date(), (end - timedelta(days=1)).date(), fmt)
+        return Response(
+            stream_with_context(chunks),
+            mimetype=access_log_export.FORMATS[fmt],
+            headers={'Content-Disposition': 'attachment; filename=%s' % filename},
+        )
+
     @expose('/approve')
     def approve(self):
         supporter_id = request.args.get('supporter_id')
@@ -236,9 +265,21 @@ class TokensView(AdminBaseView):
                            value=value, results=results)
 
 
-class StatsView(AdminBaseView):
+class BlockedIPsView(AdminBaseView):
 
-    IP_ADDR_TIMEOUT = 10
+    @expose('/')
+    def index(self):
+        return self.render('admin/blocked-ips/index.html', blocked=ip_block.get_blocked())
+
+    @expose('/unblock')
+    def unblock(self):
+        ip_address = request.args.get('ip')
+        ip_block.unblock(ip_address)
+        flash.info('IP address %s has been unblocked.' % ip_address)
+        return redirect(url_for('.index'))
+
+
+class StatsView(AdminBaseView):
 
     @expose('/')
     def overview(self):
@@ -247,37 +288,19 @@ class StatsView(AdminBaseView):
             active_supporter_count=AccessLog.active_supporter_count(),
             top_downloaders=AccessLog.top_downloaders(10),
             token_actions=TokenLog.list(10)[0],
+            token_cache_stats=get_token_cache_stats(),
         )
 
-    @staticmethod
-    def dns_lookup(ip):
-        try:
-            data = socket.gethostbyaddr(ip)
-            return data[0]
-        except Exception as err:
-            return None
-
-
     @staticmethod
     def lookup_ips(supporters):
-        """ Try to lookup and cache as many reverse DNS as possible in a window of time """
+        """ Replace IP addresses with their reverse DNS names where they can be resolved in time """
+        names = reverse_dns.resolve_many(supporter[0] for supporter in supporters)
 
         data = []
-        timeout = time.monotonic() + StatsView.IP_ADDR_TIMEOUT
         for supporter in supporters:
             row = list(supporter)
-
-            reverse = cache.get(supporter[0])
-            if not reverse: 
-                if time.monotonic() < timeout:
-                    reverse = StatsView.dns_lookup(supporter[0])
-                else:
-                    reverse = None
-
-            if reverse:
-                cache.set(supporter[0], reverse, 3600)
-                row[0] = reverse
-
+            if names.get(supporter[0]):
+                row[0] = names[supporter[0]]
             data.append(row)
 
         return data
@@ -287,15 +310,16 @@ class StatsView(AdminBaseView):
     def top_ips(self):
         days = get_int_query_param('days', default=7)
 
-        non_commercial, commercial = AccessLog.top_ips(limit=100, days=days)
+        stats = usage_stats.get('top_ips', days)
 
-        non_commercial = StatsView.lookup_ips(non_commercial)
-        commercial = StatsView.lookup_ips(commercial)
+        non_commercial = StatsView.lookup_ips(stats['non_commercial'])
+        commercial = StatsView.lookup_ips(stats['commercial'])
             
         return self.render(
             'admin/stats/top-ips.html',
             non_commercial=non_commercial,
             commercial=commercial,
+            computed_at=stats['computed_at'],
             days=days
         )
 
@@ -303,11 +327,12 @@ class StatsView(AdminBaseView):
     def top_tokens(self):
         days = get_int_query_param('days', default=7)
 
-        non_commercial, commercial = AccessLog.top_tokens(limit=100, days=days)
+        stats = usage_stats.get('top_tokens', days)
         return self.render(
             'admin/stats/top-tokens.html',
-            non_commercial=non_commercial,
-            commercial=commercial,
+            non_commercial=stats['non_commercial'],
+            commercial=stats['commercial'],
+            computed_at=stats['computed_at'],
             days=days
         )
 
@@ -1,6 +1,9 @@
 from metabrainz.testing import FlaskTestCase
 from metabrainz.model.supporter import Supporter
+from metabrainz.model.access_log import AccessLog
+from metabrainz.api import ip_block
 from flask import url_for
+from unittest import mock
 
 
 class AdminViewsTestCase(FlaskTestCase):
@@ -16,6 +19,7 @@ class AdminViewsTestCase(FlaskTestCase):
         )
         self.app.config['ADMINS'] = ['admin_user']
         self.temporary_login(supporter.id)
+        return supporter
 
     def test_index_unauthenticated(self):
         self.assertStatus(self.client.get(url_for('admin.index')), 302)
@@ -31,6 +35,22 @@ class AdminViewsTestCase(FlaskTestCase):
         self._login_admin()
         self.assert200(self.client.get(url_for('supportersview.index')))
 
+    def test_supportersview_export_access_log(self):
+        supporter = self._login_admin()
+        response = self.client.get(url_for('supportersview.export_access_log', supporter_id=supporter.id,
+                                           format='ndjson', start='2024-01-01', end='2024-01-31'))
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIn('access-log-%s-2024-01-01-2024-01-31.ndjson' % supporter.id,
+                      response.headers['Content-Disposition'])
+        self.assertEqual(response.data, b'')
+
+        self.assert400(self.client.get(url_for('supportersview.export_access_log', supporter_id=supporter.id,
+                                               format='xml')))
+        self.assert400(self.client.get(url_for('supportersview.export_access_log', supporter_id=supporter.id,
+                                               start='yesterday')))
+        self.assert404(self.client.get(url_for('supportersview.export_access_log', supporter_id=supporter.id + 1)))
+
     def test_tokensview_index_unauthenticated(self):
         self.assertStatus(self.client.get(url_for('tokensview.index')), 302)
 
@@ -52,6 +72,27 @@ class AdminViewsTestCase(FlaskTestCase):
         self._login_admin()
         self.assert200(self.client.get(url_for('statsview.top_ips')))
 
+    def test_statsview_top_tokens_as_admin(self):
+        supporter = self._login_admin()
+        # Logging the new token looks up the current user, which mustn't be cached for the request below.
+        with self.app.app_context():
+            token = supporter.generate_token()
+            AccessLog.create_record(token, '10.1.1.1')
+        response = self.client.get(url_for('statsview.top_tokens', days=3))
+        self.assert200(response)
+        self.assertIn(b'Computed at', response.data)
+        self.assertIn(token.encode(), response.data)
+        self.assertIn(url_for('supportersview.details', supporter_id=supporter.id).encode(), response.data)
+
+    def test_statsview_top_ips_with_records_as_admin(self):
+        supporter = self._login_admin()
+        with self.app.app_context():
+            AccessLog.create_record(supporter.generate_token(), '10.1.1.2')
+        with mock.patch('metabrainz.reverse_dns.lookup', return_value=None):
+            response = self.client.get(url_for('statsview.top_ips', days=4))
+        self.assert200(response)
+        self.assertIn(b'10.1.1.2', response.data)
+
     def test_statsview_supporters_unauthenticated(self):
         self.assertStatus(self.client.get(url_for('statsview.supporters')), 302)
 
@@ -59,6 +100,20 @@ class AdminViewsTestCase(FlaskTestCase):
         self._login_admin()
         self.assert200(self.client.get(url_for('statsview.supporters')))
 
+    def test_blockedipsview_index_unauthenticated(self):
+        self.assertStatus(self.client.get(url_for('blockedipsview.index')), 302)
+
+    def test_blockedipsview_index_as_admin(self):
+        self._login_admin()
+        with mock.patch.dict(self.app.config, {'INVALID_TOKEN_BLOCK_THRESHOLD': 1}):
+            ip_block.record_failure('192.0.2.1')
+        resp = self.client.get(url_for('blockedipsview.index'))
+        self.assert200(resp)
+        self.assertIn(b'192.0.2.1', resp.data)
+
+        self.assertStatus(self.client.get(url_for('blockedipsview.unblock', ip='192.0.2.1')), 302)
+        self.assertNotIn('192.0.2.1', [ip_address for ip_address, _ in ip_block.get_blocked()])
+
     def test_commercialsupportersview_index_unauthenticated(self):
         self.assertStatus(self.client.get(url_for('commercialsupportersview.index')), 302)
 
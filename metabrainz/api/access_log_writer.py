@@ -0,0 +1,103 @@
+"""Buffered writer for the API access log.
+
+Writing an access log record synchronously means that every download pays for
+an INSERT and a commit. Instead, records are queued in memory by each process
+and written in bulk by a background thread, either when `ACCESS_LOG_FLUSH_SIZE`
+records have been queued or every `ACCESS_LOG_FLUSH_INTERVAL` milliseconds,
+whichever comes first. Remaining records are written when the process exits.
+
+Records that fail to be written (for example while the database is down) are
+queued again and retried with the next batch. At most `ACCESS_LOG_MAX_PENDING`
+records are kept, the oldest ones are dropped beyond that and counted in the
+`access_log_dropped_records_total` metric.
+"""
+from datetime import datetime
+from flask import current_app
+from metabrainz import metrics
+from metabrainz.model import db
+from metabrainz.model.access_log import AccessLog
+import threading
+import logging
+import atexit
+import pytz
+import time
+
+DEFAULT_FLUSH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1000  # ms
+DEFAULT_MAX_PENDING = 10000
+
+
+class AccessLogWriter(object):
+
+    def __init__(self):
+        self._records = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+        self._flush_size = DEFAULT_FLUSH_SIZE
+        self._flush_interval = DEFAULT_FLUSH_INTERVAL
+        self._max_pending = DEFAULT_MAX_PENDING
+
+    def add(self, access_token, ip_address):
+        """Queues a new access log record with a current timestamp.
+
+        Must be called within an application context.
+        """
+        record = (access_token, datetime.now(pytz.utc), ip_address)
+        with self._lock:
+            if self._thread is None:
+                self._start(current_app._get_current_object())
+            self._records.append(record)
+            full = len(self._records) >= self._flush_size
+        if full:
+            self._wakeup.set()
+
+    def _start(self, app):
+        self._app = app
+        self._flush_size = app.config.get('ACCESS_LOG_FLUSH_SIZE', DEFAULT_FLUSH_SIZE)
+        self._flush_interval = app.config.get('ACCESS_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self._max_pending = app.config.get('ACCESS_LOG_MAX_PENDING', DEFAULT_MAX_PENDING)
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._flush_interval / 1000)
+            self._wakeup.clear()
+            if not self.flush():
+                # Don't retry as often as records are queued while the database is down.
+                time.sleep(self._flush_interval / 1000)
+
+    def flush(self):
+        """Writes all queued records to the database.
+
+        Returns:
+            False if the records couldn't be written and were queued again.
+        """
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records:
+                return True
+            with self._app.app_context():
+                try:
+                    AccessLog.create_records(records)
+                    return True
+                except Exception:
+                    logging.exception("Failed to write %s access log records", len(records))
+                    db.session.rollback()
+                with self._lock:
+                    self._records = records + self._records
+                    dropped = len(self._records) - self._max_pending
+                    if dropped > 0:
+                        del self._records[:dropped]
+                if dropped > 0:
+                    logging.warning("Dropped %s access log records", dropped)
+                    metrics.increment("access_log_dropped_records_total", dropped)
+                return False
+
+
+writer = AccessLogWriter()
+atexit.register(writer.flush)
@@ -0,0 +1,62 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.api.access_log_writer import AccessLogWriter
+from metabrainz.model import AccessLog, Supporter
+from metabrainz.model.supporter import STATE_ACTIVE
+from unittest import mock
+
+
+class AccessLogWriterTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(AccessLogWriterTestCase, self).setUp()
+        supporter = Supporter.add(is_commercial=False,
+                                  musicbrainz_id="mb_test",
+                                  musicbrainz_row_id=1,
+                                  contact_name="Mr. Test",
+                                  contact_email="test@musicbrainz.org",
+                                  data_usage_desc="test",
+                                  org_desc="test",
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        self.token = supporter.generate_token()
+        self.writer = AccessLogWriter()
+
+    def test_flush(self):
+        self.app.config['ACCESS_LOG_FLUSH_INTERVAL'] = 60 * 1000
+        self.writer.add(self.token, "10.1.1.1")
+        self.writer.add(self.token, "10.1.1.2")
+        self.assertEqual(AccessLog.query.count(), 0)
+
+        self.writer.flush()
+        self.assertEqual(AccessLog.query.count(), 2)
+        self.assertEqual(sorted(r.ip_address for r in AccessLog.query.all()), ["10.1.1.1", "10.1.1.2"])
+
+        # Nothing left to write
+        self.writer.flush()
+        self.assertEqual(AccessLog.query.count(), 2)
+
+    def test_flush_when_full(self):
+        self.app.config['ACCESS_LOG_FLUSH_SIZE'] = 2
+        self.app.config['ACCESS_LOG_FLUSH_INTERVAL'] = 60 * 1000
+        self.writer.add(self.token, "10.1.1.1")
+        self.assertFalse(self.writer._wakeup.is_set())
+        with mock.patch.object(self.writer._wakeup, 'set') as wakeup:
+            self.writer.add(self.token, "10.1.1.2")
+            wakeup.assert_called_once()
+
+    def test_flush_failure(self):
+        with mock.patch.dict(self.app.config, {'ACCESS_LOG_FLUSH_INTERVAL': 60 * 1000, 'ACCESS_LOG_MAX_PENDING': 3}):
+            self.writer.add(self.token, "10.1.1.1")
+            self.writer.add(self.token, "10.1.1.2")
+        with mock.patch.object(AccessLog, 'create_records', side_effect=Exception("Database is down")), \
+                mock.patch('metabrainz.api.access_log_writer.metrics.increment') as increment:
+            self.assertFalse(self.writer.flush())
+            increment.assert_not_called()
+            # Failed records are retried with new ones, the oldest are dropped over the limit.
+            self.writer.add(self.token, "10.1.1.3")
+            self.writer.add(self.token, "10.1.1.4")
+            self.assertFalse(self.writer.flush())
+            increment.assert_called_once_with("access_log_dropped_records_total", 1)
+
+        self.assertTrue(self.writer.flush())
+        self.assertEqual(sorted(r.ip_address for r in AccessLog.query.all()), ["10.1.1.2", "10.1.1.3", "10.1.1.4"])
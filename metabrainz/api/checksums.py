@@ -0,0 +1,191 @@
+"""Precomputed SHA-256 checksums of replication packets and JSON dumps.
+
+Hashing packets on the request path means reading every byte of them. Instead,
+an indexer (see `manage.py index_checksums`) watches the directories and hashes
+new files in a pool of processes as they arrive. Digests are stored in a
+manifest file in the root of each directory, one line per file:
+
+    <path relative to the directory>\t<size>\t<mtime in ns>\t<sha256>
+
+Web processes keep the manifest in memory and reload it only when the file
+changes, in the same way as `packets.PacketIndex`.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+
+MANIFEST_FILENAME = '.sha256-manifest'
+
+JSON_DUMP_PATTERN = re.compile(r"^[a-z-]+\.tar\.xz(\.asc)?$")
+
+CHUNK_SIZE = 1024 * 1024
+
+ManifestEntry = namedtuple('ManifestEntry', ['size', 'mtime_ns', 'sha256'])
+
+
+def manifest_path(directory):
+    return os.path.join(directory, MANIFEST_FILENAME)
+
+
+def sha256_file(path):
+    """Returns hex SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """Reads a manifest file into a dictionary of `ManifestEntry`s keyed by path.
+
+    Returns an empty dictionary if the manifest doesn't exist yet.
+    """
+    entries = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, size, mtime_ns, sha256 = line.rstrip('\n').split('\t')
+                entries[name] = ManifestEntry(int(size), int(mtime_ns), sha256)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def write_manifest(path, entries):
+    """Atomically replaces a manifest file with specified entries."""
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        for name in sorted(entries):
+            entry = entries[name]
+            f.write('%s\t%s\t%s\t%s\n' % (name, entry.size, entry.mtime_ns, entry.sha256))
+    os.replace(tmp_path, path)
+
+
+def _list_files(directory, pattern):
+    """Returns stat results of files matching a pattern, keyed by relative path."""
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for filename in filenames:
+            if pattern.match(filename):
+                path = os.path.join(root, filename)
+                files[os.path.relpath(path, directory)] = os.stat(path)
+    return files
+
+
+def update_manifest(directory, pattern, executor):
+    """Hashes new and modified files in a directory and updates its manifest.
+
+    Files are hashed in parallel using a specified executor. The manifest is
+    only rewritten if anything changed.
+
+    Returns:
+        Number of files that were hashed.
+    """
+    path = manifest_path(directory)
+    entries = read_manifest(path)
+    files = _list_files(directory, pattern)
+
+    changed = [name for name, stat in files.items()
+               if entries.get(name, (None, None))[:2] != (stat.st_size, stat.st_mtime_ns)]
+    removed = set(entries) - set(files)
+    if not changed and not removed:
+        return 0
+
+    for name in removed:
+        del entries[name]
+    digests = executor.map(sha256_file, [os.path.join(directory, name) for name in changed])
+    for name, digest in zip(changed, digests):
+        stat = files[name]
+        entries[name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, digest)
+    write_manifest(path, entries)
+    return len(changed)
+
+
+def run_indexer(directories, interval=None, workers=None):
+    """Keeps manifests of specified directories up to date.
+
+    Args:
+        directories: List of (directory, file name pattern) tuples.
+        interval: Number of seconds between scans. If None, directories are
+            only indexed once.
+        workers: Number of hashing processes (defaults to the number of CPUs).
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for directory, pattern in directories:
+                try:
+                    hashed = update_manifest(directory, pattern, executor)
+                except OSError as e:
+                    logging.error("Failed to index %s: %s", directory, e)
+                    continue
+                if hashed:
+                    logging.info("Hashed %s files in %s", hashed, directory)
+            if interval is None:
+                return
+            time.sleep(interval)
+
+
+class Manifest(object):
+    """In-memory copy of the manifest of a directory."""
+
+    def __init__(self, directory):
+        self.path = manifest_path(directory)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries = {}
+        self._sha256sums = None
+
+    def refresh(self):
+        """Reloads the manifest if the file has changed since it was last read."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            self._entries = read_manifest(self.path) if mtime is not None else {}
+            self._sha256sums = None
+            self._mtime = mtime
+
+    @property
+    def available(self):
+        """True if the manifest has been generated by the indexer."""
+        return self._mtime is not None
+
+    def get(self, name):
+        """Returns `ManifestEntry` of a file or None if it hasn't been indexed."""
+        return self._entries.get(name)
+
+    def sha256sums(self):
+        """Returns the manifest in the format used by `sha256sum --check`."""
+        sha256sums = self._sha256sums
+        if sha256sums is None:
+            sha256sums = self._sha256sums = ''.join(
+                '%s  %s\n' % (self._entries[name].sha256, name) for name in sorted(self._entries)
+            )
+        return sha256sums
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(directory):
+    """Returns the up to date manifest of a specified directory."""
+    manifest = _manifests.get(directory)
+    if manifest is None:
+        with _manifests_lock:
+            manifest = _manifests.setdefault(directory, Manifest(directory))
+    manifest.refresh()
+    return manifest
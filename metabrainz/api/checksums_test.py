@@ -0,0 +1,59 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from metabrainz.api import checksums
+import tempfile
+import hashlib
+import shutil
+import os
+
+
+class ChecksumsTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.path)
+
+    def _create(self, name, content):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def test_update_manifest(self):
+        self._create('json-dump-1/artist.tar.xz', b'artist')
+        self._create('json-dump-1/artist.tar.xz.asc', b'signature')
+        self._create('json-dump-1/README', b'ignored')
+
+        self.assertEqual(checksums.update_manifest(self.path, checksums.JSON_DUMP_PATTERN, self.executor), 2)
+        entries = checksums.read_manifest(checksums.manifest_path(self.path))
+        self.assertEqual(set(entries), {'json-dump-1/artist.tar.xz', 'json-dump-1/artist.tar.xz.asc'})
+        self.assertEqual(entries['json-dump-1/artist.tar.xz'].sha256, hashlib.sha256(b'artist').hexdigest())
+        self.assertEqual(entries['json-dump-1/artist.tar.xz'].size, 6)
+
+        # Only new files are hashed.
+        self.assertEqual(checksums.update_manifest(self.path, checksums.JSON_DUMP_PATTERN, self.executor), 0)
+        self._create('json-dump-2/label.tar.xz', b'label')
+        self.assertEqual(checksums.update_manifest(self.path, checksums.JSON_DUMP_PATTERN, self.executor), 1)
+
+        # Removed files are dropped from the manifest.
+        shutil.rmtree(os.path.join(self.path, 'json-dump-1'))
+        self.assertEqual(checksums.update_manifest(self.path, checksums.JSON_DUMP_PATTERN, self.executor), 0)
+        entries = checksums.read_manifest(checksums.manifest_path(self.path))
+        self.assertEqual(set(entries), {'json-dump-2/label.tar.xz'})
+
+    def test_manifest(self):
+        manifest = checksums.Manifest(self.path)
+        manifest.refresh()
+        self.assertFalse(manifest.available)
+        self.assertIsNone(manifest.get('json-dump-1/artist.tar.xz'))
+
+        self._create('json-dump-1/artist.tar.xz', b'artist')
+        checksums.update_manifest(self.path, checksums.JSON_DUMP_PATTERN, self.executor)
+        manifest.refresh()
+        self.assertTrue(manifest.available)
+        self.assertEqual(manifest.get('json-dump-1/artist.tar.xz').size, 6)
+        self.assertEqual(manifest.sha256sums(), '%s  json-dump-1/artist.tar.xz\n' % hashlib.sha256(b'artist').hexdigest())
@@ -2,31 +2,104 @@ from functools import wraps
 from flask import request, current_app
 from werkzeug.wrappers import Response
 from metabrainz.model.token import Token
-from metabrainz.model.access_log import AccessLog
+from metabrainz.api.access_log_writer import writer as access_log_writer
+from metabrainz.api import rate_limit, ip_block
+import logging
+import redis
 
 
 def token_required(f):
+    """Requires a valid access token in the `token` query argument.
+
+    IP addresses that make too many requests with invalid tokens are blocked
+    for a while (see `metabrainz.api.ip_block`).
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
+        ip_address = _get_ip_address()
+        blocked_for = ip_block.blocked_for(ip_address)
+        if blocked_for is not None:
+            return Response("Your IP address has been temporarily blocked for using invalid access tokens!\n",
+                            status=403, headers={'Retry-After': str(blocked_for)})
         access_token = request.args.get('token')
         if not access_token:
             return Response("You need to provide an access token!\n", status=400)
         if not Token.is_valid(access_token):
+            ip_block.record_failure(ip_address)
             return Response("Provided access token is invalid!\n", status=403)
         return f(*args, **kwargs)
 
     return decorated
 
 
+def rate_limited(f):
+    """Limits the rate of requests per access token and per IP address.
+
+    See `metabrainz.api.rate_limit` for details. Requests are let through if
+    Redis is unavailable.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            retry_after = rate_limit.check(request.args.get('token'), _get_ip_address())
+        except redis.RedisError as e:
+            logging.warning("Failed to check rate limits: %s", e)
+            retry_after = None
+        if retry_after is not None:
+            return Response("Too many requests! Try again in %s seconds.\n" % retry_after,
+                            status=429, headers={'Retry-After': str(retry_after)})
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+# Partial content responses are logged as well, they're resumed downloads.
+TRACKED_STATUS_CODES = (200, 206, 307)
+
+
 def tracked(f):
+    """Logs successful requests in the access log.
+
+    Nothing is logged by the app if `ACCESS_LOG_FROM_NGINX` is set, requests
+    to tracked endpoints are then ingested from nginx logs instead (see
+    `metabrainz.api.nginx_log`).
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         response = f(*args, **kwargs)
-        if response.status_code in (200, 307):
-            ip_addr = request.environ.get('REMOTE_ADDR', None)
-            if not ip_addr:
-                ip_addr = request.remote_addr
-            AccessLog.create_record(request.args.get('token'), ip_addr)
+        if response.status_code in TRACKED_STATUS_CODES and not current_app.config.get('ACCESS_LOG_FROM_NGINX') \
+                and not is_untracked(decorated, request.args):
+            access_log_writer.add(request.args.get('token'), _get_ip_address())
         return response
 
+    # Copied to the outer decorators by `wraps`.
+    decorated.tracked = True
     return decorated
+
+
+def untracked_if(predicate):
+    """Keeps requests to a tracked endpoint out of the access log if a
+    predicate is true for their query arguments.
+
+    For requests that are counted in some other way, e.g. batches of signed
+    URLs (see `SignedURLLog`). Must be applied below `tracked`.
+    """
+    def decorator(f):
+        f.untracked_if = predicate
+        return f
+
+    return decorator
+
+
+def is_untracked(view, args):
+    """Checks if a request to a tracked view with specified query arguments
+    is kept out of the access log (see `untracked_if`)."""
+    predicate = getattr(view, 'untracked_if', None)
+    return predicate is not None and predicate(args)
+
+
+def _get_ip_address():
+    ip_addr = request.environ.get('REMOTE_ADDR', None)
+    if not ip_addr:
+        ip_addr = request.remote_addr
+    return ip_addr
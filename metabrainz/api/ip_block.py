@@ -0,0 +1,116 @@
+"""Temporary blocking of IP addresses that keep using invalid access tokens.
+
+Requests with an invalid token are counted per IP address in Redis over a
+window of `INVALID_TOKEN_WINDOW` seconds. Once an address makes
+`INVALID_TOKEN_BLOCK_THRESHOLD` such requests, it's blocked for
+`INVALID_TOKEN_BLOCK_DURATION` seconds and its requests are rejected before
+their tokens are looked at.
+
+Blocked addresses are kept in a sorted set scored by the time they're blocked
+until. Each process caches whether an address is blocked for
+`LOCAL_CACHE_TTL` seconds, so checking it doesn't cost a Redis round trip on
+every request. If Redis is unavailable, addresses are treated as not blocked
+and failures aren't counted, so that an outage doesn't take the API down.
+"""
+from metabrainz import raw_cache
+from datetime import datetime, timezone
+from flask import current_app
+from metabrainz.local_cache import LocalCache
+import logging
+import redis
+import time
+
+FAILURES_KEY_PREFIX = "invalid_token_failures"
+BLOCKED_KEY = "blocked_ips"
+
+DEFAULT_THRESHOLD = 50
+DEFAULT_WINDOW = 60 * 10  # 10 minutes
+DEFAULT_BLOCK_DURATION = 60 * 60  # 1 hour
+
+LOCAL_CACHE_TTL = 10
+LOCAL_CACHE_SIZE = 10000
+
+_local_cache = LocalCache(max_size=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL)
+
+
+def _failures_key(ip_address):
+    return raw_cache.key("%s:%s" % (FAILURES_KEY_PREFIX, ip_address))
+
+
+def _blocked_key():
+    return raw_cache.key(BLOCKED_KEY)
+
+
+def blocked_for(ip_address, now=None):
+    """Returns number of seconds an IP address is still blocked for, or None
+    if it isn't blocked."""
+    now = now if now is not None else time.time()
+    until = _local_cache.get(ip_address)
+    if until is None:
+        try:
+            until = raw_cache.connection().zscore(_blocked_key(), ip_address) or 0
+        except redis.RedisError as e:
+            logging.warning("Failed to check if %s is blocked: %s", ip_address, e)
+            return None
+        _local_cache.set(ip_address, until)
+    if until <= now:
+        return None
+    return int(until - now) + 1
+
+
+def record_failure(ip_address, now=None):
+    """Counts a request with an invalid token and blocks the IP address if it
+    made too many of them.
+
+    Returns:
+        True if the address has been blocked.
+    """
+    if not ip_address:
+        return False
+    now = now if now is not None else time.time()
+    window = current_app.config.get("INVALID_TOKEN_WINDOW", DEFAULT_WINDOW)
+    threshold = current_app.config.get("INVALID_TOKEN_BLOCK_THRESHOLD", DEFAULT_THRESHOLD)
+
+    key = _failures_key(ip_address)
+    until = now + current_app.config.get("INVALID_TOKEN_BLOCK_DURATION", DEFAULT_BLOCK_DURATION)
+    try:
+        pipe = raw_cache.connection().pipeline(transaction=False)
+        pipe.set(key, 0, ex=window, nx=True)
+        pipe.incr(key)
+        _, failures = pipe.execute()
+        if failures < threshold:
+            return False
+
+        pipe = raw_cache.connection().pipeline(transaction=False)
+        pipe.zadd(_blocked_key(), {ip_address: until})
+        pipe.delete(key)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning("Failed to count invalid token of %s: %s", ip_address, e)
+        return False
+    _local_cache.set(ip_address, until)
+    logging.warning("Blocked %s after %s requests with invalid access tokens", ip_address, failures)
+    return True
+
+
+def get_blocked(now=None):
+    """Returns list of (IP address, blocked until) tuples of currently blocked
+    addresses, the ones blocked for the longest time first."""
+    now = now if now is not None else time.time()
+    raw_cache.connection().zremrangebyscore(_blocked_key(), "-inf", now)
+    return [
+        (ip_address.decode(), datetime.fromtimestamp(until, timezone.utc))
+        for ip_address, until in raw_cache.connection().zrevrange(_blocked_key(), 0, -1, withscores=True)
+    ]
+
+
+def unblock(ip_address):
+    """Removes an IP address from the block list.
+
+    Other processes may keep rejecting it for up to `LOCAL_CACHE_TTL` seconds.
+    """
+    pipe = raw_cache.connection().pipeline(transaction=False)
+    pipe.zrem(_blocked_key(), ip_address)
+    pipe.delete(_failures_key(ip_address))
+    pipe.execute()
+    _local_cache.delete(ip_address)
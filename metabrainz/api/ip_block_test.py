@@ -0,0 +1,78 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.model.token import Token
+from metabrainz.api import ip_block
+from metabrainz import raw_cache
+from flask import current_app, url_for
+from unittest import mock
+import redis
+import uuid
+
+
+class IPBlockTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(IPBlockTestCase, self).setUp()
+        ip_block._local_cache.clear()
+        # Redis isn't reset between tests, so every test uses its own address.
+        self.ip = "10.%s.%s.%s" % tuple(uuid.uuid4().bytes[:3])
+        self.config = mock.patch.dict(current_app.config, {
+            'INVALID_TOKEN_BLOCK_THRESHOLD': 3,
+            'INVALID_TOKEN_BLOCK_DURATION': 100,
+        })
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        ip_block.unblock(self.ip)
+        super(IPBlockTestCase, self).tearDown()
+
+    def test_record_failure(self):
+        self.assertFalse(ip_block.record_failure(self.ip, now=1000))
+        self.assertFalse(ip_block.record_failure(self.ip, now=1000))
+        self.assertIsNone(ip_block.blocked_for(self.ip, now=1000))
+        self.assertTrue(ip_block.record_failure(self.ip, now=1000))
+        self.assertEqual(ip_block.blocked_for(self.ip, now=1000), 101)
+        self.assertIsNone(ip_block.blocked_for(self.ip, now=1100))
+
+        # Blocks are visible to other processes.
+        ip_block._local_cache.clear()
+        self.assertEqual(ip_block.blocked_for(self.ip, now=1050), 51)
+
+    def test_get_blocked(self):
+        for _ in range(3):
+            ip_block.record_failure(self.ip)
+        self.assertIn(self.ip, [ip_address for ip_address, _ in ip_block.get_blocked()])
+
+        ip_block.unblock(self.ip)
+        self.assertNotIn(self.ip, [ip_address for ip_address, _ in ip_block.get_blocked()])
+        self.assertIsNone(ip_block.blocked_for(self.ip))
+        # Failures are counted from scratch after unblocking.
+        self.assertFalse(ip_block.record_failure(self.ip))
+
+    def test_token_required(self):
+        token = Token.generate_token(owner_id=None)
+        environ = {'REMOTE_ADDR': self.ip}
+        for _ in range(3):
+            self.assert403(self.client.get(url_for('api_musicbrainz.replication_info', token='fake'),
+                                           environ_base=environ))
+
+        # Blocked addresses are rejected even with a valid token.
+        resp = self.client.get(url_for('api_musicbrainz.replication_info', token=token), environ_base=environ)
+        self.assert403(resp)
+        self.assertIn('Retry-After', resp.headers)
+        self.assert200(self.client.get(url_for('api_musicbrainz.replication_info', token=token)))
+
+        ip_block.unblock(self.ip)
+        self.assert200(self.client.get(url_for('api_musicbrainz.replication_info', token=token),
+                                       environ_base=environ))
+
+    def test_redis_failure(self):
+        token = Token.generate_token(owner_id=None)
+        environ = {'REMOTE_ADDR': self.ip}
+        with mock.patch.object(raw_cache, 'connection', side_effect=redis.ConnectionError("down")):
+            self.assertFalse(ip_block.record_failure(self.ip))
+            self.assertIsNone(ip_block.blocked_for(self.ip))
+            self.assert403(self.client.get(url_for('api_musicbrainz.replication_info', token='fake'),
+                                           environ_base=environ))
+            self.assert200(self.client.get(url_for('api_musicbrainz.replication_info', token=token),
+                                           environ_base=environ))
@@ -0,0 +1,233 @@
+"""Ingestion of API requests from nginx access logs into the access log.
+
+nginx knows how requests to the API really ended, including downloads that
+the app handed over with X-Accel-Redirect: the final status and the number of
+bytes sent. With `ACCESS_LOG_FROM_NGINX` set, the app doesn't log requests
+itself and `manage.py ingest-nginx-logs` loads them from nginx logs instead,
+in batches with COPY.
+
+nginx has to log requests to the API in `LOG_FORMAT`:
+
+    log_format metabrainz_api '$msec\\t$remote_addr\\t$request_method\\t$request_uri\\t$status\\t$body_bytes_sent';
+
+Only requests to endpoints that are tracked by the app (see
+`metabrainz.api.decorators.tracked`), with a status the app would have logged,
+are loaded.
+
+Plain log files are read incrementally. The inode and offset reached in every
+file are kept in a state file, and when a file is rotated, the rest of the old
+file is read from `<path>.1` before starting on the new one. Gzipped (rotated)
+files are read as a whole once. Records are loaded with `ON CONFLICT DO
+NOTHING`, so reading some lines again after a crash doesn't count them twice.
+
+`manage.py update-hourly-usage` only recalculates the last hours of usage, so
+when records older than that are loaded (from a backlog of logs), usage is
+recalculated from the hour of the oldest one (see `update_hourly_usage`).
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from metabrainz.api.decorators import TRACKED_STATUS_CODES, is_untracked
+from metabrainz.db import access_log as db_access_log
+import ipaddress
+import logging
+import json
+import psycopg2
+import sqlalchemy
+import gzip
+import time
+import os
+import re
+
+LOG_FORMAT = "$msec\\t$remote_addr\\t$request_method\\t$request_uri\\t$status\\t$body_bytes_sent"
+
+DEFAULT_BATCH_SIZE = 10000
+
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9]+$")
+
+Record = namedtuple('Record', ['token', 'timestamp', 'ip_address', 'bytes_sent', 'status'])
+
+
+class LineParser(object):
+    """Turns log lines into access log records of an app's tracked endpoints."""
+
+    def __init__(self, app):
+        self._adapter = app.url_map.bind("localhost")
+        self._view_functions = app.view_functions
+
+    def _is_tracked(self, path, method, args):
+        try:
+            endpoint, _ = self._adapter.match(path, method=method)
+        except (HTTPException, RequestRedirect):
+            return False
+        view = self._view_functions.get(endpoint)
+        return getattr(view, 'tracked', False) and not is_untracked(view, args)
+
+    def parse(self, line):
+        """Returns `Record` for a log line, or None if it shouldn't be logged."""
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != 6:
+            return None
+        msec, ip_address, method, uri, status, bytes_sent = fields
+        try:
+            status = int(status)
+            timestamp = datetime.fromtimestamp(float(msec), timezone.utc)
+            bytes_sent = int(bytes_sent)
+            ip_address = str(ipaddress.ip_address(ip_address)) if ip_address != "-" else None
+        except ValueError:
+            return None
+        if status not in TRACKED_STATUS_CODES:
+            return None
+        uri = urlsplit(uri)
+        args = MultiDict(parse_qs(uri.query))
+        token = args.get('token')
+        if not token or not TOKEN_PATTERN.match(token) or not self._is_tracked(uri.path, method, args):
+            return None
+        return Record(token, timestamp, ip_address, bytes_sent, status)
+
+
+def read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_state(path, state):
+    """Atomically replaces a state file."""
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _read_lines(f, offset):
+    """Yields complete lines from a binary file starting at an offset, with the
+    offset after every line."""
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b"\n"):
+            # Still being written.
+            break
+        offset += len(line)
+        yield line.decode("utf-8", "replace"), offset
+
+
+def _new_lines(path, position):
+    """Yields (line, position after it) for lines of a log file that haven't
+    been read yet, given the position reached so far (or None)."""
+    stat = os.stat(path)
+    if path.endswith(".gz"):
+        if position is None or position["inode"] != stat.st_ino:
+            with gzip.open(path, "rb") as f:
+                for line, _ in _read_lines(f, 0):
+                    yield line, None
+            yield None, {"inode": stat.st_ino, "offset": stat.st_size}
+        return
+
+    offset = 0
+    if position is not None:
+        if position["inode"] != stat.st_ino:
+            # Rotated, finish reading the previous file first.
+            rotated = path + ".1"
+            if os.path.exists(rotated) and os.stat(rotated).st_ino == position["inode"]:
+                with open(rotated, "rb") as f:
+                    for line, rotated_offset in _read_lines(f, position["offset"]):
+                        yield line, {"inode": position["inode"], "offset": rotated_offset}
+        elif stat.st_size >= position["offset"]:
+            offset = position["offset"]
+    with open(path, "rb") as f:
+        for line, offset in _read_lines(f, offset):
+            yield line, {"inode": stat.st_ino, "offset": offset}
+    if position is None or position["inode"] != stat.st_ino or stat.st_size < position["offset"]:
+        # Makes sure the new file is remembered even if it's empty.
+        yield None, {"inode": stat.st_ino, "offset": offset}
+
+
+def ingest(app, paths, state_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Loads new requests from log files into the access log.
+
+    Must be called within an application context.
+
+    Returns:
+        Number of inserted access log records and the timestamp of the oldest
+        one (None if nothing was inserted).
+    """
+    parser = LineParser(app)
+    state = read_state(state_path)
+    inserted, earliest = 0, None
+
+    def load(batch):
+        nonlocal inserted, earliest
+        count = db_access_log.copy_records(batch)
+        if count:
+            inserted += count
+            # Oldest record of the batch, which might not be one of the inserted ones.
+            oldest = min(record.timestamp for record in batch)
+            earliest = oldest if earliest is None else min(earliest, oldest)
+
+    for path in paths:
+        batch, position = [], state.get(path)
+        for line, new_position in _new_lines(path, position):
+            if line is not None:
+                record = parser.parse(line)
+                if record is not None:
+                    batch.append(record)
+            if new_position is not None:
+                position = new_position
+            if len(batch) >= batch_size:
+                load(batch)
+                batch = []
+                if position is not None:
+                    state[path] = position
+                    write_state(state_path, state)
+        if batch:
+            load(batch)
+        if position is not None and position != state.get(path):
+            state[path] = position
+            write_state(state_path, state)
+    return inserted, earliest
+
+
+def update_hourly_usage(earliest, now=None):
+    """Recalculates hourly usage starting from the hour of the oldest loaded
+    record, if it's older than the hours that are recalculated anyway.
+
+    Must be called within an application context.
+
+    Returns:
+        True if usage was recalculated.
+    """
+    now = now or datetime.now(timezone.utc)
+    if earliest is None or earliest >= now - db_access_log.HOURLY_USAGE_LATE_ROWS_MARGIN:
+        return False
+    db_access_log.update_hourly_usage(since=earliest)
+    return True
+
+
+def follow(app, paths, state_path, interval, batch_size=DEFAULT_BATCH_SIZE):
+    """Keeps loading new requests from log files every `interval` seconds.
+
+    Failures to read the logs or to write to the database are logged and
+    loading is tried again on the next interval, from the last saved position.
+    """
+    pending = None  # Oldest loaded record whose hour hasn't been recalculated
+    while True:
+        try:
+            inserted, earliest = ingest(app, paths, state_path, batch_size)
+            if inserted:
+                logging.info("Loaded %s access log records from nginx logs", inserted)
+            if earliest is not None:
+                pending = earliest if pending is None else min(pending, earliest)
+            if update_hourly_usage(pending):
+                logging.info("Recalculated hourly usage since %s", pending)
+            pending = None
+        except OSError as e:
+            logging.error("Failed to read nginx logs: %s", e)
+        except (sqlalchemy.exc.SQLAlchemyError, psycopg2.Error) as e:
+            logging.error("Failed to load nginx logs into the access log: %s", e)
+        time.sleep(interval)
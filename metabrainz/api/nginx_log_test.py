@@ -0,0 +1,141 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz import db
+from metabrainz.model.token import Token
+from metabrainz.api import nginx_log
+from metabrainz.db import access_log as db_access_log
+from flask import current_app
+from metabrainz.api.access_log_writer import writer as access_log_writer
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import psycopg2
+import sqlalchemy
+import tempfile
+import shutil
+import gzip
+import os
+
+
+class NginxLogTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(NginxLogTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.path, 'api.log')
+        self.state_path = os.path.join(self.path, 'state.json')
+        self.token = Token.generate_token(owner_id=None)
+        self.parser = nginx_log.LineParser(current_app)
+
+    def tearDown(self):
+        super(NginxLogTestCase, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def _line(self, msec, uri, status=200, bytes_sent=1000, ip='10.0.0.1', method='GET'):
+        return '%s\t%s\t%s\t%s\t%s\t%s\n' % (msec, ip, method, uri, status, bytes_sent)
+
+    def _packet_line(self, msec, token=None, **kwargs):
+        return self._line(msec, '/api/musicbrainz/replication-1.tar.bz2?token=%s' % (token or self.token), **kwargs)
+
+    def _append(self, *lines, path=None):
+        with open(path or self.log_path, 'a') as f:
+            f.write(''.join(lines))
+
+    def _get_records(self):
+        with db.engine.connect() as connection:
+            return connection.execute(sqlalchemy.text(
+                'SELECT token, "timestamp", ip_address, bytes_sent, status FROM access_log ORDER BY "timestamp"'
+            )).fetchall()
+
+    def test_parse(self):
+        record = self.parser.parse(self._packet_line('1700000000.123', status=206, bytes_sent=5))
+        self.assertEqual(record, nginx_log.Record(
+            self.token, datetime(2023, 11, 14, 22, 13, 20, 123000, tzinfo=timezone.utc), '10.0.0.1', 5, 206))
+
+        # Not tracked endpoints, failed requests and garbage are skipped.
+        self.assertIsNone(self.parser.parse(self._line(
+            '1700000000.123', '/api/musicbrainz/replication-1.tar.bz2.asc?token=%s' % self.token)))
+        self.assertIsNone(self.parser.parse(self._line('1700000000.123', '/about?token=%s' % self.token)))
+        self.assertIsNone(self.parser.parse(self._line('1700000000.123', '/api/musicbrainz/replication-1.tar.bz2')))
+        self.assertIsNone(self.parser.parse(self._packet_line('1700000000.123', status=403)))
+        self.assertIsNone(self.parser.parse(self._packet_line('1700000000.123', ip='nonsense')))
+        self.assertIsNone(self.parser.parse(self._packet_line('1700000000.123', token='a\\tb')))
+        self.assertIsNone(self.parser.parse('garbage\n'))
+
+        # Requests for signed URLs are counted by the number of URLs instead.
+        self.assertIsNotNone(self.parser.parse(self._line(
+            '1700000000.123', '/api/musicbrainz/replication-since-1?token=%s' % self.token)))
+        self.assertIsNone(self.parser.parse(self._line(
+            '1700000000.123', '/api/musicbrainz/replication-since-1?token=%s&signed=1' % self.token)))
+        self.assertIsNone(self.parser.parse(self._line(
+            '1700000000.123', '/api/musicbrainz/json-dumps/json-dump-1/signed-urls?token=%s' % self.token)))
+
+    def test_ingest(self):
+        self._append(
+            self._packet_line('1700000000.001'),
+            self._packet_line('1700000000.002', token='unknown'),
+            self._packet_line('1700000000.003', status=404),
+        )
+        self.assertEqual(nginx_log.ingest(current_app, [self.log_path], self.state_path),
+                         (1, datetime(2023, 11, 14, 22, 13, 20, 1000, tzinfo=timezone.utc)))
+        self.assertEqual(self._get_records(), [
+            (self.token, datetime(2023, 11, 14, 22, 13, 20, 1000, tzinfo=timezone.utc), '10.0.0.1', 1000, 200),
+        ])
+
+        # Only new complete lines are read.
+        self._append(self._packet_line('1700000000.004'), '1700000000.005\t10.0.0.1')
+        self.assertEqual(nginx_log.ingest(current_app, [self.log_path], self.state_path)[0], 1)
+        self.assertEqual(nginx_log.ingest(current_app, [self.log_path], self.state_path), (0, None))
+
+        # Rotated files are finished before reading the new one.
+        self._append('\tGET\t/api/musicbrainz/replication-1.tar.bz2?token=%s\t200\t1\n' % self.token)
+        os.rename(self.log_path, self.log_path + '.1')
+        self._append(self._packet_line('1700000000.006'))
+        self.assertEqual(nginx_log.ingest(current_app, [self.log_path], self.state_path)[0], 2)
+        self.assertEqual(len(self._get_records()), 4)
+
+        # Loading the same records again doesn't duplicate them.
+        os.remove(self.state_path)
+        self.assertEqual(nginx_log.ingest(current_app, [self.log_path], self.state_path), (0, None))
+
+    def test_ingest_gzipped(self):
+        gz_path = self.log_path + '.2.gz'
+        with gzip.open(gz_path, 'wt') as f:
+            f.write(self._packet_line('1700000000.001') + self._packet_line('1700000000.002'))
+        self.assertEqual(nginx_log.ingest(current_app, [gz_path], self.state_path, batch_size=1),
+                         (2, datetime(2023, 11, 14, 22, 13, 20, 1000, tzinfo=timezone.utc)))
+        self.assertEqual(nginx_log.ingest(current_app, [gz_path], self.state_path), (0, None))
+
+    def test_update_hourly_usage(self):
+        now = datetime(2023, 11, 15, 12, tzinfo=timezone.utc)
+        with mock.patch.object(db_access_log, 'update_hourly_usage') as update:
+            self.assertFalse(nginx_log.update_hourly_usage(None, now=now))
+            self.assertFalse(nginx_log.update_hourly_usage(now - timedelta(minutes=10), now=now))
+            update.assert_not_called()
+
+            # Hours of records from a backlog of logs are recalculated.
+            self.assertTrue(nginx_log.update_hourly_usage(now - timedelta(days=1), now=now))
+            update.assert_called_once_with(since=now - timedelta(days=1))
+
+    def test_follow_database_errors(self):
+        earliest = datetime(2023, 11, 14, tzinfo=timezone.utc)
+        ingest = mock.patch.object(nginx_log, 'ingest', side_effect=[
+            sqlalchemy.exc.OperationalError("COPY", {}, Exception("connection refused")),
+            (1, earliest),
+            (0, None),
+        ])
+        update = mock.patch.object(nginx_log, 'update_hourly_usage', side_effect=[
+            psycopg2.OperationalError("connection refused"),
+            True,
+        ])
+        sleep = mock.patch.object(nginx_log.time, 'sleep', side_effect=[None, None, StopIteration])
+        with ingest, update as update, sleep:
+            with self.assertRaises(StopIteration):
+                nginx_log.follow(current_app, [], self.state_path, interval=1)
+        # Hours of records loaded before a failure are recalculated on the next interval.
+        self.assertEqual(update.call_args_list, [mock.call(earliest), mock.call(earliest)])
+
+    def test_tracked_disabled(self):
+        with mock.patch.dict(current_app.config, {'ACCESS_LOG_FROM_NGINX': True, 'REPLICATION_PACKETS_DIR': self.path}):
+            open(os.path.join(self.path, 'replication-1.tar.bz2'), 'a').close()
+            with mock.patch.object(access_log_writer, 'add') as add:
+                self.assert200(self.client.get('/api/musicbrainz/replication-1.tar.bz2?token=%s' % self.token))
+            add.assert_not_called()
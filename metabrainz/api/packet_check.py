@@ -0,0 +1,91 @@
+"""Incremental integrity check of the replication packets directory.
+
+Checking that all packets are contiguous and (once the checksum indexer has
+generated a manifest) that their checksums are up to date would mean walking
+every packet ever published on each probe. Instead, a watermark is kept in Redis:
+the newest packet up to which everything has already been verified. Probes
+only walk packets newer than the watermark.
+
+Packets up to the watermark are contiguous as long as the number of packets
+between the oldest one and the watermark is what it should be, which is
+checked with a binary search. If older files were removed or added, the
+packets are walked from the start again.
+"""
+from brainzutils import cache
+from metabrainz.api import packets
+import bisect
+import time
+
+CACHE_NAMESPACE = "replication_check"
+WATERMARK_TTL = 60 * 60 * 24 * 7  # 1 week
+
+# Packets that the checksum indexer hasn't picked up after this long are reported.
+MAX_UNINDEXED_PACKET_AGE = 60 * 60
+
+
+def _verified_count(numbers, watermark, checksums_available):
+    """Returns number of packets that don't need to be checked again."""
+    if not watermark or watermark["checksums"] != checksums_available:
+        return 0
+    count = bisect.bisect_right(numbers, watermark["verified"])
+    if count != watermark["verified"] - numbers[0] + 1:
+        # Older packets have been added or removed since the last check.
+        return 0
+    return count
+
+
+def check(index, manifest, full=False, now=None):
+    """Checks packets that haven't been verified yet.
+
+    Args:
+        index: `packets.PacketIndex` of the directory.
+        manifest: `checksums.Manifest` of the directory.
+        full: Ignore the watermark and check all packets.
+        now: Current time (timestamp).
+
+    Returns:
+        None if everything is fine, otherwise a Nagios compatible status line.
+    """
+    numbers = index.numbers
+    if not numbers:
+        return None
+    now = now if now is not None else time.time()
+
+    watermark = cache.get(index.directory, namespace=CACHE_NAMESPACE)
+    start = 0 if full else _verified_count(numbers, watermark, manifest.available)
+
+    verified = numbers[start - 1] if start else None
+    previous = numbers[start - 1] if start else numbers[0] - 1
+    missing, problem, advancing = None, None, True
+    for num in numbers[start:]:
+        ok = True
+        if num != previous + 1:
+            missing = num - 1
+            ok = False
+        previous = num
+        if manifest.available:
+            packet_file = index.get(packets.packet_filename(num))
+            entry = manifest.get(packet_file.name)
+            if entry is None:
+                # Not indexed yet, doesn't need to be reported until it's been a while.
+                ok = False
+                if problem is None and now - packet_file.mtime > MAX_UNINDEXED_PACKET_AGE:
+                    problem = "WARNING Replication packet %d has no checksum" % num
+            elif (entry.size, entry.mtime_ns) != (packet_file.size, packet_file.mtime_ns):
+                # Packets aren't hashed here, a packet that changed after it
+                # was indexed only means that its manifest entry is stale.
+                ok = False
+                if problem is None:
+                    problem = "WARNING Replication packet %d has a stale manifest entry" % num
+        advancing = advancing and ok
+        if advancing:
+            verified = num
+
+    if verified is not None and (not watermark or watermark["verified"] != verified or
+                                 watermark["checksums"] != manifest.available):
+        cache.set(index.directory, {"verified": verified, "checksums": manifest.available},
+                  expirein=WATERMARK_TTL, namespace=CACHE_NAMESPACE)
+
+    if missing is not None:
+        return "CRITICAL Replication packet %d is missing" % missing
+    return problem
@@ -0,0 +1,96 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.api import packet_check, packets, checksums
+from brainzutils import cache
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import tempfile
+import shutil
+import os
+
+
+class PacketCheckTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(PacketCheckTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.index = packets.PacketIndex(self.path)
+        self.manifest = checksums.Manifest(self.path)
+
+    def tearDown(self):
+        super(PacketCheckTestCase, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def _create(self, *numbers):
+        for number in numbers:
+            with open(os.path.join(self.path, packets.packet_filename(number)), 'wb') as f:
+                f.write(b'%d' % number)
+        os.utime(self.path, None)
+        self.index.refresh()
+
+    def _remove(self, number):
+        os.remove(os.path.join(self.path, packets.packet_filename(number)))
+        self.index.refresh()
+
+    def _watermark(self):
+        return cache.get(self.path, namespace=packet_check.CACHE_NAMESPACE)
+
+    def test_check(self):
+        self.assertIsNone(packet_check.check(self.index, self.manifest))
+
+        self._create(1, 2, 3)
+        self.assertIsNone(packet_check.check(self.index, self.manifest))
+        self.assertEqual(self._watermark(), {"verified": 3, "checksums": False})
+
+        self._create(5)
+        self.assertEqual(packet_check.check(self.index, self.manifest), "CRITICAL Replication packet 4 is missing")
+        self.assertEqual(self._watermark()["verified"], 3)
+
+        self._create(4)
+        self.assertIsNone(packet_check.check(self.index, self.manifest))
+        self.assertEqual(self._watermark()["verified"], 5)
+
+        # Removing old packets is detected without walking all of them on every check.
+        self._remove(2)
+        self.assertEqual(packet_check.check(self.index, self.manifest), "CRITICAL Replication packet 2 is missing")
+        self.assertEqual(self._watermark()["verified"], 1)
+
+    def _index_checksums(self):
+        with ThreadPoolExecutor() as executor:
+            checksums.update_manifest(self.path, packets.PACKET_PATTERN, executor)
+        self.manifest.refresh()
+
+    def test_check_walks_only_new_packets(self):
+        self._create(1, 2, 3)
+        self._index_checksums()
+        packet_check.check(self.index, self.manifest)
+
+        self._create(4)
+        self._index_checksums()
+        with mock.patch.object(self.index, 'get', wraps=self.index.get) as get:
+            self.assertIsNone(packet_check.check(self.index, self.manifest))
+        get.assert_called_once_with(packets.packet_filename(4))
+
+        with mock.patch.object(self.index, 'get', wraps=self.index.get) as get:
+            self.assertIsNone(packet_check.check(self.index, self.manifest, full=True))
+        self.assertEqual(get.call_count, 4)
+
+    def test_check_checksums(self):
+        self._create(1, 2)
+        self._index_checksums()
+        self.assertIsNone(packet_check.check(self.index, self.manifest))
+        self.assertEqual(self._watermark(), {"verified": 2, "checksums": True})
+
+        self._create(3)
+        self.assertIsNone(packet_check.check(self.index, self.manifest, now=0))
+        self.assertEqual(self._watermark()["verified"], 2)
+        self.assertEqual(packet_check.check(self.index, self.manifest, now=10 ** 10),
+                         "WARNING Replication packet 3 has no checksum")
+
+        # Packets modified after they were indexed have stale manifest entries, even if their size is the same.
+        self._index_checksums()
+        self.assertIsNone(packet_check.check(self.index, self.manifest))
+        os.utime(os.path.join(self.path, packets.packet_filename(3)), (0, 0))
+        os.utime(self.path, None)
+        self.index.refresh()
+        self.assertEqual(packet_check.check(self.index, self.manifest, full=True),
+                         "WARNING Replication packet 3 has a stale manifest entry")
@@ -0,0 +1,122 @@
+"""Announcements of new replication packets through Redis pub/sub.
+
+A single watcher (see `manage.py watch-replication-packets`) polls the packets
+directory and publishes the number of every new packet. Each web process has
+one listener thread subscribed to the channel, which wakes up all requests
+waiting for a new packet in that process. Waiting requests don't touch the
+packets directory or Redis themselves.
+
+The number of the latest packet is also stored in Redis. The listener reads it
+every time its subscription is confirmed (also after reconnecting), so packets
+announced before it subscribed or while it was disconnected aren't missed.
+"""
+from metabrainz import raw_cache
+from metabrainz.api import packets
+import logging
+import threading
+import time
+
+CHANNEL = "replication_packets"
+LATEST_KEY = "replication_packets:latest"
+
+# Delay before the listener tries to subscribe again after losing connection.
+RECONNECT_DELAY = 5
+
+
+def publish(packet_number):
+    """Announces that a specified packet is the latest available one."""
+    pipe = raw_cache.connection().pipeline(transaction=False)
+    pipe.set(raw_cache.key(LATEST_KEY), packet_number)
+    pipe.publish(raw_cache.key(CHANNEL), packet_number)
+    pipe.execute()
+
+
+def watch(directory, interval):
+    """Announces new packets in a directory, checking it every `interval` seconds."""
+    announced = None
+    while True:
+        try:
+            numbers = packets.get_index(directory).numbers
+        except OSError as e:
+            logging.error("Failed to read %s: %s", directory, e)
+            numbers = []
+        if numbers and numbers[-1] != announced:
+            publish(numbers[-1])
+            announced = numbers[-1]
+            logging.info("Announced replication packet %s", announced)
+        time.sleep(interval)
+
+
+class PacketListener(object):
+    """Keeps track of the latest announced packet in a web process."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._latest = None
+        self._thread = None
+        self._waiters = 0
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='packet-listener', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            pubsub = raw_cache.connection().pubsub()
+            try:
+                pubsub.subscribe(raw_cache.key(CHANNEL))
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Packets announced from now on are received as messages.
+                        latest = raw_cache.connection().get(raw_cache.key(LATEST_KEY))
+                        if latest is not None:
+                            self._announce(int(latest))
+                    elif message['type'] == 'message':
+                        self._announce(int(message['data']))
+            except Exception:
+                logging.exception("Lost subscription to new replication packets")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                pubsub.close()
+
+    def _announce(self, packet_number):
+        with self._condition:
+            if self._latest is None or packet_number > self._latest:
+                self._latest = packet_number
+                self._condition.notify_all()
+
+    def wait(self, after, timeout, max_waiters):
+        """Waits until a packet newer than a specified one is announced.
+
+        Args:
+            after: Number of the last packet the client has seen.
+            timeout: Maximum number of seconds to wait.
+            max_waiters: Maximum number of requests that can wait at the same
+                time in this process.
+
+        Returns:
+            Number of the latest packet, which is newer than `after`, or None
+            if no such packet was announced before the timeout.
+
+        Raises:
+            TooManyWaitersException: If `max_waiters` requests are already waiting.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._start()
+            if self._waiters >= max_waiters:
+                raise TooManyWaitersException()
+            self._waiters += 1
+            try:
+                if self._condition.wait_for(lambda: self._latest is not None and self._latest > after, timeout):
+                    return self._latest
+                return None
+            finally:
+                self._waiters -= 1
+
+
+class TooManyWaitersException(Exception):
+    pass
+
+
+listener = PacketListener()
@@ -0,0 +1,47 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.api import packet_events
+from metabrainz import raw_cache
+from unittest import mock
+import redis
+import threading
+import time
+
+
+class PacketListenerTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(PacketListenerTestCase, self).setUp()
+        raw_cache.connection().delete(raw_cache.key(packet_events.LATEST_KEY))
+        self.listener = packet_events.PacketListener()
+
+    def test_wait(self):
+        self.assertIsNone(self.listener.wait(after=1, timeout=0, max_waiters=1))
+
+        packet_events.publish(2)
+        # The listener is already running, so it's notified of new packets.
+        self.assertEqual(self.listener.wait(after=1, timeout=5, max_waiters=1), 2)
+        self.assertIsNone(self.listener.wait(after=2, timeout=0, max_waiters=1))
+
+        threading.Timer(0.2, packet_events.publish, args=(3,)).start()
+        start = time.monotonic()
+        self.assertEqual(self.listener.wait(after=2, timeout=5, max_waiters=1), 3)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_latest_from_redis(self):
+        packet_events.publish(5)
+        self.assertEqual(self.listener.wait(after=4, timeout=5, max_waiters=1), 5)
+
+    @mock.patch.object(packet_events, 'RECONNECT_DELAY', 0)
+    def test_reconnect(self):
+        connection = raw_cache.connection()
+        lost = mock.MagicMock()
+        lost.listen.side_effect = redis.ConnectionError("Connection lost")
+        packet_events.publish(7)
+        # The latest packet is read again once the listener subscribes after losing connection.
+        with mock.patch.object(connection, 'pubsub', side_effect=[lost, connection.pubsub()]):
+            self.assertEqual(self.listener.wait(after=6, timeout=5, max_waiters=1), 7)
+        lost.close.assert_called_once()
+
+    def test_max_waiters(self):
+        with self.assertRaises(packet_events.TooManyWaitersException):
+            self.listener.wait(after=1, timeout=0, max_waiters=0)
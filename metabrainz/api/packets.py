@@ -0,0 +1,119 @@
+"""In-memory index of the replication packets directory.
+
+Listing `REPLICATION_PACKETS_DIR`, filtering and natural-sorting its contents
+on every API call gets expensive once the directory holds years of hourly
+packets. Instead, each process keeps an index of the directory which is only
+rebuilt when the mtime of the directory itself changes (that happens every
+time a file is added, removed or renamed in it).
+"""
+from collections import namedtuple
+import bisect
+import os
+import re
+import threading
+import time
+
+PACKET_PATTERN = re.compile(r"^replication-([0-9]+)(-v2)?\.tar\.bz2(\.asc)?$")
+
+# Changes made to the directory within this many seconds of a scan might share
+# its mtime with the scanned state, so such scans are not trusted for caching.
+MTIME_RACE_WINDOW = 1
+
+PacketFile = namedtuple('PacketFile', ['name', 'size', 'mtime', 'mtime_ns'])
+
+
+def packet_filename(packet_number, v2=False, signature=False):
+    """Returns name of the file for a specified replication packet."""
+    return 'replication-%s%s.tar.bz2%s' % (
+        packet_number,
+        '-v2' if v2 else '',
+        '.asc' if signature else '',
+    )
+
+
+class PacketIndex(object):
+    """Sorted index of the replication packets in a directory.
+
+    Keeps sorted numbers of available (v1) packets, and name, size and mtime
+    of every packet file (v1, v2 and their `.asc` signatures), so that looking
+    up the last packet is O(1) and checking if a packet exists is a dict lookup.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._numbers = []
+        self._files = {}
+
+    def refresh(self):
+        """Rescans the directory if it has been modified since the last scan.
+
+        Raises:
+            OSError: If the directory can't be read.
+        """
+        dir_mtime = os.stat(self.directory).st_mtime_ns
+        if dir_mtime == self._dir_mtime:
+            return
+        with self._lock:
+            if dir_mtime == self._dir_mtime:
+                return
+            self._scan(dir_mtime)
+
+    def _scan(self, dir_mtime):
+        files = {}
+        numbers = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                m = PACKET_PATTERN.match(entry.name)
+                if not m or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files[entry.name] = PacketFile(entry.name, stat.st_size, stat.st_mtime, stat.st_mtime_ns)
+                if not m.group(2) and not m.group(3):
+                    numbers.append(int(m.group(1)))
+        numbers.sort()
+        self._files = files
+        self._numbers = numbers
+        if time.time_ns() - dir_mtime > MTIME_RACE_WINDOW * 10 ** 9:
+            self._dir_mtime = dir_mtime
+        else:
+            # The directory might still be changing within the same mtime tick.
+            self._dir_mtime = None
+
+    @property
+    def numbers(self):
+        """Sorted list of numbers of the available (v1) replication packets."""
+        return self._numbers
+
+    def get(self, filename):
+        """Returns `PacketFile` for a specified file name or None if it doesn't exist."""
+        return self._files.get(filename)
+
+    def last_packet(self):
+        """Returns `PacketFile` of the latest (v1) replication packet or None."""
+        if not self._numbers:
+            return None
+        return self._files.get(packet_filename(self._numbers[-1]))
+
+    def numbers_after(self, packet_number):
+        """Returns sorted numbers of all available (v1) packets newer than a specified one."""
+        return self._numbers[bisect.bisect_right(self._numbers, packet_number):]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory):
+    """Returns the up to date packet index of a specified directory.
+
+    Raises:
+        OSError: If the directory can't be read.
+    """
+    index = _indexes.get(directory)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(directory, PacketIndex(directory))
+    index.refresh()
+    return index
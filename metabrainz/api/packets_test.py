@@ -0,0 +1,67 @@
+from unittest import TestCase
+from metabrainz.api import packets
+import tempfile
+import shutil
+import os
+
+
+class PacketIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _create(self, name, size=0):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(b'x' * size)
+
+    def test_packet_filename(self):
+        self.assertEqual(packets.packet_filename(1), 'replication-1.tar.bz2')
+        self.assertEqual(packets.packet_filename(1, v2=True), 'replication-1-v2.tar.bz2')
+        self.assertEqual(packets.packet_filename(1, signature=True), 'replication-1.tar.bz2.asc')
+        self.assertEqual(packets.packet_filename(1, v2=True, signature=True), 'replication-1-v2.tar.bz2.asc')
+
+    def test_index(self):
+        index = packets.PacketIndex(self.path)
+        index.refresh()
+        self.assertEqual(index.numbers, [])
+        self.assertIsNone(index.last_packet())
+
+        self._create('replication-99999.tar.bz2')
+        self._create('replication-100000.tar.bz2', size=42)
+        self._create('replication-100000-v2.tar.bz2')
+        self._create('replication-100000.tar.bz2.asc')
+        self._create('something-else.txt')
+        os.mkdir(os.path.join(self.path, 'replication-5.tar.bz2'))
+        index.refresh()
+
+        self.assertEqual(index.numbers, [99999, 100000])
+        self.assertEqual(index.last_packet().name, 'replication-100000.tar.bz2')
+        self.assertEqual(index.last_packet().size, 42)
+        self.assertIsNotNone(index.get('replication-100000-v2.tar.bz2'))
+        self.assertIsNotNone(index.get('replication-100000.tar.bz2.asc'))
+        self.assertIsNone(index.get('replication-99999.tar.bz2.asc'))
+        self.assertIsNone(index.get('something-else.txt'))
+        self.assertIsNone(index.get('replication-5.tar.bz2'))
+        self.assertEqual(index.numbers_after(99999), [100000])
+        self.assertEqual(index.numbers_after(0), [99999, 100000])
+
+    def test_refresh_skips_unmodified_directory(self):
+        self._create('replication-1.tar.bz2')
+        os.utime(self.path, (0, 0))
+        index = packets.PacketIndex(self.path)
+        index.refresh()
+        self.assertEqual(index.numbers, [1])
+
+        # Directory mtime is unchanged, so the index must not be rebuilt.
+        self._create('replication-2.tar.bz2')
+        os.utime(self.path, (0, 0))
+        index.refresh()
+        self.assertEqual(index.numbers, [1])
+
+        os.utime(self.path, None)
+        index.refresh()
+        self.assertEqual(index.numbers, [1, 2])
+
@@ -0,0 +1,178 @@
+"""Warming of the page cache with the newest replication packets and JSON dumps.
+
+Right after a packet is published, lots of mirrors download it at the same
+time. Instead of the first of these requests reading it from a cold disk, the
+warmer (`manage.py warm-page-cache`) loads every new file into the page cache
+as soon as it appears, using `posix_fadvise(POSIX_FADV_WILLNEED)` where it's
+available and by reading the file otherwise.
+
+Files stay in the warmer's working set while they're newer than
+`PAGE_CACHE_HORIZON` seconds. Once they're older, they're left to the kernel,
+which keeps them cached while replicas that are catching up still read them.
+With `PAGE_CACHE_EVICT` set, the kernel is told that they're no longer needed
+(`POSIX_FADV_DONTNEED`) instead, which drops them to leave room for newer files.
+
+What the warmer does is reported through `metabrainz.metrics`.
+"""
+from metabrainz import metrics
+from metabrainz.api import packets
+from metabrainz.api.checksums import JSON_DUMP_PATTERN
+import logging
+import time
+import os
+
+DEFAULT_HORIZON = 60 * 60 * 6  # 6 hours
+DEFAULT_INTERVAL = 10
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+JSON_DUMP_DIR_PREFIX = "json-dump-"
+
+
+def warm(path):
+    """Loads a file into the page cache.
+
+    Returns:
+        Size of the file.
+    """
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while f.read(READ_CHUNK_SIZE):
+                pass
+        return os.fstat(f.fileno()).st_size
+
+
+def evict(path):
+    """Tells the kernel that a file's pages in the page cache aren't needed."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        with open(path, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except FileNotFoundError:
+        pass
+
+
+def recent_packets(directory, cutoff):
+    """Returns {path: mtime} of replication packets and signatures modified after `cutoff`."""
+    index = packets.get_index(directory)
+    files = {}
+    for number in reversed(index.numbers):
+        packet_file = index.get(packets.packet_filename(number))
+        if packet_file.mtime < cutoff:
+            break
+        for v2 in (False, True):
+            for signature in (False, True):
+                packet_file = index.get(packets.packet_filename(number, v2=v2, signature=signature))
+                if packet_file is not None:
+                    files[os.path.join(directory, packet_file.name)] = packet_file.mtime
+    return files
+
+
+def recent_json_dumps(directory, cutoff):
+    """Returns {path: mtime} of files in JSON dumps modified after `cutoff`.
+
+    Only dump directories that were modified after `cutoff` are listed.
+    """
+    files = {}
+    with os.scandir(directory) as dumps:
+        for dump in dumps:
+            if not dump.name.startswith(JSON_DUMP_DIR_PREFIX) or not dump.is_dir():
+                continue
+            if dump.stat().st_mtime < cutoff:
+                continue
+            with os.scandir(dump.path) as entries:
+                for entry in entries:
+                    if JSON_DUMP_PATTERN.match(entry.name) and entry.is_file():
+                        mtime = entry.stat().st_mtime
+                        if mtime >= cutoff:
+                            files[entry.path] = mtime
+    return files
+
+
+class PageCacheWarmer(object):
+    """Keeps recent files of several directories in the page cache.
+
+    Args:
+        sources: List of (name, function) tuples. Each function returns
+            {path: mtime} of recent files, given the cutoff time. Names are
+            used as labels of the metrics.
+        horizon: Number of seconds files are kept warm for.
+        evict: Whether files older than the horizon are dropped from the page
+            cache.
+    """
+
+    def __init__(self, sources, horizon=DEFAULT_HORIZON, evict=False):
+        self.sources = sources
+        self.horizon = horizon
+        self.evict = evict
+        # Working set: (source name, mtime) of warmed files by path.
+        self.working_set = {}
+
+    def run_once(self, now=None):
+        """Warms new files and forgets (or evicts) ones that got older than
+        the horizon.
+
+        Must be called within an application context.
+        """
+        now = now if now is not None else time.time()
+        cutoff = now - self.horizon
+        current = {}
+        for name, list_files in self.sources:
+            try:
+                for path, mtime in list_files(cutoff).items():
+                    current[path] = (name, mtime)
+            except OSError as e:
+                logging.error("Failed to list %s: %s", name, e)
+                # Files of this source are kept in the working set until it can be listed again.
+                current.update({path: value for path, value in self.working_set.items() if value[0] == name})
+
+        for path, (name, mtime) in current.items():
+            if self.working_set.get(path) == (name, mtime):
+                continue
+            started = time.perf_counter()
+            try:
+                size = warm(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                # Tried again on the next run.
+                logging.warning("Failed to warm %s: %s", path, e)
+                continue
+            self.working_set[path] = (name, mtime)
+            metrics.increment("page_cache_warmed_files_total", source=name)
+            metrics.increment("page_cache_warmed_bytes_total", size, source=name)
+            metrics.increment("page_cache_warm_duration_seconds_total", time.perf_counter() - started, source=name)
+            logging.debug("Warmed %s (%s bytes)", path, size)
+
+        for path in [path for path in self.working_set if path not in current]:
+            name, _ = self.working_set.pop(path)
+            if self.evict:
+                evict(path)
+                metrics.increment("page_cache_evicted_files_total", source=name)
+                logging.debug("Evicted %s", path)
+
+    def run(self, interval=DEFAULT_INTERVAL):
+        while True:
+            try:
+                self.run_once()
+                metrics.flush()
+            except Exception:
+                logging.exception("Failed to warm the page cache")
+            time.sleep(interval)
+
+
+def create_warmer(app):
+    """Creates a warmer for the replication packets and JSON dumps of an app."""
+    packets_dir = app.config["REPLICATION_PACKETS_DIR"]
+    json_dumps_dir = app.config["JSON_DUMPS_DIR"]
+    return PageCacheWarmer(
+        sources=[
+            ("replication_packets", lambda cutoff: recent_packets(packets_dir, cutoff)),
+            ("json_dumps", lambda cutoff: recent_json_dumps(json_dumps_dir, cutoff)),
+        ],
+        horizon=app.config.get("PAGE_CACHE_HORIZON", DEFAULT_HORIZON),
+        evict=app.config.get("PAGE_CACHE_EVICT", False),
+    )
@@ -0,0 +1,100 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.api import page_cache, packets
+from metabrainz import raw_cache
+from unittest import mock
+import tempfile
+import shutil
+import time
+import os
+
+
+class PageCacheTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(PageCacheTestCase, self).setUp()
+        self.packets_path = tempfile.mkdtemp()
+        self.json_path = tempfile.mkdtemp()
+        self.registry = self.app.extensions["metrics"]
+        self.registry.flush(force=True)
+        raw_cache.connection().delete(self.registry.key)
+
+    def tearDown(self):
+        super(PageCacheTestCase, self).tearDown()
+        shutil.rmtree(self.packets_path)
+        shutil.rmtree(self.json_path)
+
+    def _create(self, path, mtime, content=b'data'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_recent_packets(self):
+        now = time.time()
+        self._create(os.path.join(self.packets_path, packets.packet_filename(1)), now - 1000)
+        self._create(os.path.join(self.packets_path, packets.packet_filename(2)), now - 10)
+        self._create(os.path.join(self.packets_path, packets.packet_filename(2, v2=True)), now - 10)
+        self._create(os.path.join(self.packets_path, packets.packet_filename(2, signature=True)), now - 10)
+        self.assertEqual(sorted(page_cache.recent_packets(self.packets_path, now - 100)), [
+            os.path.join(self.packets_path, 'replication-2-v2.tar.bz2'),
+            os.path.join(self.packets_path, 'replication-2.tar.bz2'),
+            os.path.join(self.packets_path, 'replication-2.tar.bz2.asc'),
+        ])
+
+    def test_recent_json_dumps(self):
+        now = time.time()
+        old_dump = os.path.join(self.json_path, 'json-dump-1')
+        self._create(os.path.join(old_dump, 'artist.tar.xz'), now - 1000)
+        os.utime(old_dump, (now - 1000, now - 1000))
+        self._create(os.path.join(self.json_path, 'json-dump-2', 'artist.tar.xz'), now - 10)
+        self._create(os.path.join(self.json_path, 'json-dump-2', 'README'), now - 10)
+        self.assertEqual(list(page_cache.recent_json_dumps(self.json_path, now - 100)), [
+            os.path.join(self.json_path, 'json-dump-2', 'artist.tar.xz'),
+        ])
+
+    def test_run_once(self):
+        path = os.path.join(self.packets_path, 'replication-1.tar.bz2')
+        self._create(path, 1000, b'x' * 100)
+        warmer = page_cache.PageCacheWarmer(
+            [('replication_packets', lambda cutoff: page_cache.recent_packets(self.packets_path, cutoff))],
+            horizon=100,
+        )
+        with mock.patch.object(page_cache, 'evict') as evict:
+            # Old files are only dropped from the page cache if the warmer is told to.
+            warmer.run_once(now=1050)
+            warmer.run_once(now=1200)
+            self.assertEqual(warmer.working_set, {})
+            evict.assert_not_called()
+
+            warmer.evict = True
+            warmer.working_set = {}
+            warmer.run_once(now=1050)
+            self.assertIn(path, warmer.working_set)
+            # Files already in the working set aren't warmed again.
+            with mock.patch.object(page_cache, 'warm') as warm:
+                warmer.run_once(now=1060)
+                warm.assert_not_called()
+            warmer.run_once(now=1200)
+            self.assertEqual(warmer.working_set, {})
+            evict.assert_called_once_with(path)
+
+        self.registry.flush(force=True)
+        totals = {key.decode(): float(value) for key, value in raw_cache.connection().hgetall(self.registry.key).items()}
+        labels = '{source="replication_packets"}'
+        self.assertEqual(totals['page_cache_warmed_files_total' + labels], 2)
+        self.assertEqual(totals['page_cache_warmed_bytes_total' + labels], 200)
+        self.assertEqual(totals['page_cache_evicted_files_total' + labels], 1)
+
+    def test_run_survives_errors(self):
+        path = os.path.join(self.packets_path, 'replication-1.tar.bz2')
+        self._create(path, time.time())
+        warmer = page_cache.PageCacheWarmer(
+            [('replication_packets', lambda cutoff: page_cache.recent_packets(self.packets_path, cutoff))],
+        )
+        with mock.patch.object(page_cache, 'warm', side_effect=PermissionError("Permission denied")), \
+                mock.patch.object(page_cache.metrics, 'flush', side_effect=Exception("Redis is down")), \
+                mock.patch.object(page_cache.time, 'sleep', side_effect=[None, StopIteration]):
+            with self.assertRaises(StopIteration):
+                warmer.run()
+        # Files that couldn't be warmed are tried again.
+        self.assertEqual(warmer.working_set, {})
@@ -0,0 +1,133 @@
+"""Token bucket rate limiting of API requests.
+
+Every access token and every client IP address gets a bucket in Redis that
+holds up to `burst` requests and is refilled at `rate` requests per minute.
+Both buckets of a request are checked and drained by a single Lua script, so
+the check is atomic across uWSGI workers and costs one round trip.
+
+Limits for tokens are taken from the tier of their owner, falling back to the
+defaults below (which can be overridden in the config) for tokens without a
+tier or tiers without limits set.
+"""
+from brainzutils import cache
+from metabrainz import raw_cache
+from flask import current_app
+from metabrainz.model import db
+from metabrainz.model.token import Token
+from metabrainz.model.supporter import Supporter
+from metabrainz.model.tier import Tier
+from metabrainz.local_cache import LocalCache
+import math
+import time
+
+KEY_PREFIX = "rate_limit"
+
+# Requests per minute and bucket size.
+DEFAULT_TOKEN_RATE = 60
+DEFAULT_TOKEN_BURST = 120
+DEFAULT_IP_RATE = 120
+DEFAULT_IP_BURST = 240
+
+LIMITS_CACHE_NAMESPACE = "token_rate_limits"
+LIMITS_CACHE_TTL = 60 * 60  # 1 hour
+LOCAL_LIMITS_CACHE_TTL = 60
+
+_local_limits_cache = LocalCache(max_size=10000, ttl=LOCAL_LIMITS_CACHE_TTL)
+
+# KEYS: bucket keys. ARGV: current time in seconds, followed by rate (per
+# second) and burst size for each key.
+# Returns 0 if the request is allowed, otherwise number of milliseconds until
+# it would be. Nothing is consumed from any bucket if one of them is empty.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'level', 'updated')
+    local level = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    level = math.min(burst, level + math.max(0, now - updated) * rate)
+    if level < 1 then
+        wait = math.max(wait, math.ceil((1 - level) / rate * 1000))
+    end
+    levels[i] = level
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'level', tostring(levels[i] - 1), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return 0
+"""
+
+_script = None
+
+
+def _key(kind, value):
+    return raw_cache.key("%s:%s:%s" % (KEY_PREFIX, kind, value))
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = raw_cache.connection().register_script(TOKEN_BUCKET_SCRIPT)
+    return _script
+
+
+def get_token_limits(access_token):
+    """Returns (rate per minute, burst size) for a specified access token.
+
+    Limits are cached in process and in Redis, changes to tiers are picked up
+    once the cached values expire.
+    """
+    limits = _local_limits_cache.get(access_token)
+    if limits is not None:
+        return limits
+    limits = cache.get(access_token, namespace=LIMITS_CACHE_NAMESPACE)
+    if limits is None:
+        row = db.session.query(Tier.api_rate_limit, Tier.api_rate_limit_burst) \
+            .join(Supporter, Supporter.tier_id == Tier.id) \
+            .join(Token, Token.owner_id == Supporter.id) \
+            .filter(Token.value == access_token) \
+            .first()
+        config = current_app.config
+        limits = [
+            row.api_rate_limit if row and row.api_rate_limit else config.get('API_RATE_LIMIT', DEFAULT_TOKEN_RATE),
+            row.api_rate_limit_burst if row and row.api_rate_limit_burst else config.get('API_RATE_LIMIT_BURST', DEFAULT_TOKEN_BURST),
+        ]
+        cache.set(access_token, limits, expirein=LIMITS_CACHE_TTL, namespace=LIMITS_CACHE_NAMESPACE)
+    limits = tuple(limits)
+    _local_limits_cache.set(access_token, limits)
+    return limits
+
+
+def check(access_token, ip_address, now=None):
+    """Takes a request out of the buckets of a token and an IP address.
+
+    Returns:
+        None if the request is allowed, otherwise number of seconds after which
+        it can be retried.
+    """
+    keys, args = [], [now if now is not None else time.time()]
+    if access_token:
+        rate, burst = get_token_limits(access_token)
+        keys.append(_key("token", access_token))
+        args += [rate / 60, burst]
+    if ip_address:
+        keys.append(_key("ip", ip_address))
+        args += [
+            current_app.config.get('API_IP_RATE_LIMIT', DEFAULT_IP_RATE) / 60,
+            current_app.config.get('API_IP_RATE_LIMIT_BURST', DEFAULT_IP_BURST),
+        ]
+    if not keys:
+        return None
+    wait = _get_script()(keys=keys, args=args)
+    if not wait:
+        return None
+    return int(math.ceil(wait / 1000))
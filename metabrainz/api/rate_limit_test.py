@@ -0,0 +1,59 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.model.supporter import Supporter, STATE_ACTIVE
+from metabrainz.model.tier import Tier
+from metabrainz.model.token import Token
+from metabrainz.api import rate_limit
+from brainzutils import cache
+import uuid
+
+
+class RateLimitTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(RateLimitTestCase, self).setUp()
+        rate_limit._local_limits_cache.clear()
+        # Redis isn't reset between tests, so every test uses its own address.
+        self.ip = "10.%s.%s.%s" % tuple(uuid.uuid4().bytes[:3])
+
+    def test_get_token_limits(self):
+        token = Token.generate_token(owner_id=None)
+        self.assertEqual(rate_limit.get_token_limits(token),
+                         (rate_limit.DEFAULT_TOKEN_RATE, rate_limit.DEFAULT_TOKEN_BURST))
+
+        tier = Tier.create(name="Stealing Stuff", price=1000, api_rate_limit=600, api_rate_limit_burst=10)
+        supporter = Supporter.add(is_commercial=True,
+                                  musicbrainz_id="mb_commercial",
+                                  musicbrainz_row_id=3,
+                                  contact_name="Mr. Commercial",
+                                  contact_email="testc@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!",
+                                  tier_id=tier.id,
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        token = supporter.generate_token()
+        self.assertEqual(rate_limit.get_token_limits(token), (600, 10))
+        self.assertEqual(cache.get(token, namespace=rate_limit.LIMITS_CACHE_NAMESPACE), [600, 10])
+
+    def test_check(self):
+        token = str(uuid.uuid4())
+        rate_limit._local_limits_cache.set(token, (60, 2))
+        now = 1000000
+
+        self.assertIsNone(rate_limit.check(token, self.ip, now=now))
+        self.assertIsNone(rate_limit.check(token, self.ip, now=now))
+        # Bucket is empty, it's refilled at one request per second.
+        self.assertEqual(rate_limit.check(token, self.ip, now=now), 1)
+        self.assertEqual(rate_limit.check(token, self.ip, now=now + 0.5), 1)
+        self.assertIsNone(rate_limit.check(token, self.ip, now=now + 1))
+
+        # Bucket of the IP address still has requests left.
+        self.assertIsNone(rate_limit.check(None, self.ip, now=now + 1))
+
+    def test_check_ip(self):
+        self.app.config['API_IP_RATE_LIMIT_BURST'] = 1
+        try:
+            self.assertIsNone(rate_limit.check(None, self.ip, now=1000000))
+            self.assertEqual(rate_limit.check(str(uuid.uuid4()), self.ip, now=1000000), 1)
+        finally:
+            del self.app.config['API_IP_RATE_LIMIT_BURST']
@@ -0,0 +1,68 @@
+"""Signed, expiring download URLs for replication packets and JSON dumps.
+
+Instead of requesting every file from the API (which checks the access token
+and logs the request before handing the download over to nginx), clients can
+get signed URLs for a whole batch of files in a single request. Signed URLs
+point to `SIGNED_URLS_BASE`, which can be served by nginx or a mirror host
+that checks the signature itself without calling the app.
+
+The signature is an HMAC-SHA256 of the expiry timestamp and the URL path
+(`"<expires><path>"`, like `$arg_expires$uri` in nginx) keyed with
+`SIGNED_URLS_SECRET`, encoded as unpadded URL-safe base64. It's passed in
+the `signature` query argument along with `expires`. `verify` can be used to
+check signatures on mirrors.
+"""
+from urllib.parse import urlencode, urlsplit
+import base64
+import hashlib
+import hmac
+import time
+
+DEFAULT_TTL = 60 * 60 * 6  # 6 hours
+
+# Expiry times are rounded up to a multiple of this, so that repeated requests
+# return the same URLs for a while and they can be cached by clients.
+EXPIRY_GRANULARITY = 60 * 5
+
+
+def sign(path, expires, secret):
+    """Returns signature of a URL path valid until `expires` (timestamp)."""
+    digest = hmac.new(secret.encode(), ("%d%s" % (expires, path)).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def verify(path, expires, signature, secret, now=None):
+    """Checks that a signature of a URL path is valid and hasn't expired."""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    now = now if now is not None else time.time()
+    if expires < now:
+        return False
+    return hmac.compare_digest(sign(path, expires, secret), signature or "")
+
+
+def expiry(ttl, now=None):
+    """Returns the expiry timestamp of URLs signed now that are valid for at least `ttl` seconds."""
+    now = now if now is not None else time.time()
+    return -(-int(now + ttl) // EXPIRY_GRANULARITY) * EXPIRY_GRANULARITY
+
+
+class URLSigner(object):
+    """Signs URLs of files relative to a base URL."""
+
+    def __init__(self, base_url, secret, expires):
+        self.base_url = base_url.rstrip("/")
+        self.base_path = urlsplit(self.base_url).path
+        self.secret = secret
+        self.expires = expires
+
+    def url(self, *path):
+        """Returns signed URL of a file, given the components of its path relative to the base URL."""
+        relative_path = "/" + "/".join(path)
+        signature = sign(self.base_path + relative_path, self.expires, self.secret)
+        return "%s%s?%s" % (self.base_url, relative_path, urlencode({
+            "expires": self.expires,
+            "signature": signature,
+        }))
@@ -0,0 +1,37 @@
+from unittest import TestCase
+from urllib.parse import urlsplit, parse_qs
+from metabrainz.api import signed_urls
+
+
+class SignedURLsTestCase(TestCase):
+
+    def test_sign(self):
+        signature = signed_urls.sign("/signed/replication/replication-1.tar.bz2", 1000, "secret")
+        self.assertEqual(signature, signed_urls.sign("/signed/replication/replication-1.tar.bz2", 1000, "secret"))
+        self.assertNotIn("=", signature)
+        self.assertNotEqual(signature, signed_urls.sign("/signed/replication/replication-2.tar.bz2", 1000, "secret"))
+        self.assertNotEqual(signature, signed_urls.sign("/signed/replication/replication-1.tar.bz2", 1001, "secret"))
+        self.assertNotEqual(signature, signed_urls.sign("/signed/replication/replication-1.tar.bz2", 1000, "other"))
+
+    def test_verify(self):
+        path = "/signed/replication/replication-1.tar.bz2"
+        signature = signed_urls.sign(path, 1000, "secret")
+        self.assertTrue(signed_urls.verify(path, "1000", signature, "secret", now=999))
+        self.assertFalse(signed_urls.verify(path, "1000", signature, "secret", now=1001))
+        self.assertFalse(signed_urls.verify(path, "2000", signature, "secret", now=999))
+        self.assertFalse(signed_urls.verify(path, "invalid", signature, "secret", now=999))
+        self.assertFalse(signed_urls.verify(path, "1000", None, "secret", now=999))
+        self.assertFalse(signed_urls.verify(path + ".asc", "1000", signature, "secret", now=999))
+
+    def test_expiry(self):
+        self.assertEqual(signed_urls.expiry(3600, now=0), 3600)
+        self.assertEqual(signed_urls.expiry(3600, now=1), 3600 + signed_urls.EXPIRY_GRANULARITY)
+
+    def test_url(self):
+        signer = signed_urls.URLSigner("https://mirror.example.org/signed/", "secret", 3600)
+        url = urlsplit(signer.url("json-dumps", "json-dump-1", "artist.tar.xz"))
+        self.assertEqual(url.netloc, "mirror.example.org")
+        self.assertEqual(url.path, "/signed/json-dumps/json-dump-1/artist.tar.xz")
+        query = parse_qs(url.query)
+        self.assertEqual(query["expires"], ["3600"])
+        self.assertTrue(signed_urls.verify(url.path, query["expires"][0], query["signature"][0], "secret", now=0))
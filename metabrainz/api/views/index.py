@@ -1,4 +1,5 @@
 from flask import Blueprint, render_template
+from metabrainz.api.views.musicbrainz import MAX_CATCH_UP_PACKETS
 
 api_index_bp = Blueprint('api_index', __name__)
 
@@ -6,4 +7,4 @@ api_index_bp = Blueprint('api_index', __name__)
 @api_index_bp.route('/')
 def info():
     """This view provides information about using the API."""
-    return render_template('api/info.html')
+    return render_template('api/info.html', max_catch_up_packets=MAX_CATCH_UP_PACKETS)
@@ -1,7 +1,10 @@
 from metabrainz.testing import FlaskTestCase
+from metabrainz.api.views.musicbrainz import MAX_CATCH_UP_PACKETS
 
 
 class IndexViewsTestCase(FlaskTestCase):
 
     def test_info(self):
-        self.assert200(self.client.get("/api/"))
+        resp = self.client.get("/api/")
+        self.assert200(resp)
+        self.assertIn("At most %s packets" % MAX_CATCH_UP_PACKETS, resp.data.decode())
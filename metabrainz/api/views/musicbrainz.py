@@ -1,108 +1,185 @@
-from flask import Blueprint, jsonify, send_from_directory, current_app
+from flask import Blueprint, jsonify, send_from_directory, current_app, request
 from werkzeug.utils import safe_join
 from werkzeug.wrappers import Response
 from werkzeug.urls import iri_to_uri
-from metabrainz.api.decorators import token_required, tracked
+from werkzeug.http import is_resource_modified
+from brainzutils import cache
+from datetime import datetime, timezone
+from metabrainz.api.decorators import token_required, rate_limited, tracked, untracked_if
+from metabrainz.api import packets, checksums, packet_check, packet_events, zstd_cache, signed_urls
+from metabrainz.model.signed_url_log import SignedURLLog
+from metabrainz.model import db
 import logging
+import tarfile
 import time
-import re
 import os
 
 api_musicbrainz_bp = Blueprint('api_musicbrainz', __name__)
 
 NGINX_INTERNAL_LOCATION = '/internal/replication'
+NGINX_JSON_DUMPS_INTERNAL_LOCATION = '/internal/json-dumps'
+
+# Paths of replication packets and JSON dumps relative to SIGNED_URLS_BASE.
+SIGNED_URLS_REPLICATION_PATH = 'replication'
+SIGNED_URLS_JSON_DUMPS_PATH = 'json-dumps'
 
 MIMETYPE_ARCHIVE_BZ2 = 'application/x-tar-bz2'
 MIMETYPE_ARCHIVE_XZ = 'application/x-xz'
 MIMETYPE_SIGNATURE = 'text/plain'
+MIMETYPE_TAR = 'application/x-tar'
+MIMETYPE_ARCHIVE_ZSTD = 'application/zstd'
+
+# Maximum number of packets returned by a single catch-up request (one week).
+MAX_CATCH_UP_PACKETS = 24 * 7
+STREAM_CHUNK_SIZE = 1024 * 1024
 
 # These durations are used to create nagios compatible status codes so we can monitor
 # the replication packet stream.
 MAX_PACKET_AGE_WARNING = 60 * 60 * 2  # 4 hours
 MAX_PACKET_AGE_CRITICAL = 60 * 60 * 6  # 4 hours
 
+# Responses of replication-info are cached for each newest packet, so entries
+# only need to outlive the time between two packets.
+REPLICATION_INFO_CACHE_NAMESPACE = "replication_info"
+REPLICATION_INFO_CACHE_TTL = 60 * 60 * 2
+
+# Long-polling requests are answered after this many seconds if no new packet
+# appears. Each waiting request pins a uWSGI thread for that long, so only
+# LONG_POLL_MAX_WAITERS of them can wait at the same time in one process. The
+# total number of waiting clients is capped at processes * LONG_POLL_MAX_WAITERS,
+# any more get a 503 response with Retry-After and are expected to poll
+# replication-info instead. Processes of docker/web/web.ini only have a single
+# thread, so nobody waits unless the deployment sets it up.
+DEFAULT_LONG_POLL_TIMEOUT = 55
+DEFAULT_LONG_POLL_MAX_WAITERS = 0
+LONG_POLL_RETRY_AFTER = 30
+
 
 @api_musicbrainz_bp.route('/replication-check')
 def replication_check():
     """Check that all the replication packets are contiguous and that no packet
     is more than a few hours old. Output a Nagios compatible line of text.
+
+    Only packets published since the last check are verified, unless the `full`
+    argument is set (see `packet_check`).
     """
 
     try:
-        entries = [os.path.join(current_app.config['REPLICATION_PACKETS_DIR'], e)
-                   for e in os.listdir(current_app.config['REPLICATION_PACKETS_DIR'])]
+        index = packets.get_index(current_app.config['REPLICATION_PACKETS_DIR'])
     except OSError as e:
         logging.warning(e)
         return Response("UNKNOWN " + str(e), mimetype='text/plain')
 
-    pattern = re.compile("replication-[0-9]+.tar.bz2$")
-    entries = filter(lambda x: pattern.search(x), entries)
-    entries = filter(os.path.isfile, entries)
-    entries = _sort_natural(entries)
-
-    if len(entries) == 0:
+    last_packet = index.last_packet()
+    if last_packet is None:
         return Response("UNKNOWN no replication packets available", mimetype='text/plain')
 
-    resp = "OK"
-    last = -1
-    pattern = re.compile("replication-([0-9]+).tar.bz2$")
-    for entry in entries:
-        m = pattern.search(entry)
-        if not m:
-            resp = "UNKNOWN Unkown files in the replication directory"
-            break
-        num = int(m.groups()[0])
-        if last < 0:
-            last = num - 1
-        if last != num - 1:
-            resp = "CRITICAL Replication packet %d is missing" % (num - 1)
-        last = num
-
-    if resp != "OK":
-        return Response(resp, mimetype='text/plain')
-        
-    last_packet_age = time.time() - os.path.getmtime(entries[-1]) 
-    if last_packet_age > MAX_PACKET_AGE_CRITICAL:
-        resp = "CRITICAL Latest replication packet is %.1f hours old" % (last_packet_age / 3600)
-    elif last_packet_age > MAX_PACKET_AGE_WARNING:
-        resp = "WARNING Latest replication packet is %.1f hours old" % (last_packet_age / 3600)
-
-    return Response(resp, mimetype='text/plain')
+    full = request.args.get('full', '').lower() in ('1', 'true')
+    resp = packet_check.check(index, checksums.get_manifest(index.directory), full=full) or "OK"
+
+    if resp == "OK":
+        last_packet_age = time.time() - last_packet.mtime
+        if last_packet_age > MAX_PACKET_AGE_CRITICAL:
+            resp = "CRITICAL Latest replication packet is %.1f hours old" % (last_packet_age / 3600)
+        elif last_packet_age > MAX_PACKET_AGE_WARNING:
+            resp = "WARNING Latest replication packet is %.1f hours old" % (last_packet_age / 3600)
+
+    # The status depends on the current time as well as on the newest packet,
+    # so the ETag is derived from the response itself. There's no
+    # Last-Modified, clients that only send If-Modified-Since would keep
+    # getting 304 after the status changed as the newest packet got older.
+    response = Response(resp, mimetype='text/plain')
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @api_musicbrainz_bp.route('/replication-info')
 @token_required
 def replication_info():
-    """This endpoint returns numbers of the last available replication packets."""
-
-    def _get_last_packet_name(location, pattern):
-        try:
-            entries = [os.path.join(location, e) for e in os.listdir(location)]
-        except OSError as e:
-            logging.warning(e)
-            return None
-        pattern = re.compile(pattern)
-        entries = filter(lambda x: pattern.search(x), entries)
-        entries = filter(os.path.isfile, entries)
-        entries = _sort_natural(entries, reverse=True)  # latest first
-        return os.path.split(entries[0])[-1] if entries else None
-
-    # TODO(roman): Cache this response:
+    """This endpoint returns numbers of the last available replication packets.
+
+    Responses carry an ETag and Last-Modified derived from the newest packet,
+    so that mirrors polling this endpoint get a 304 response until a new packet
+    is published.
+    """
+
+    try:
+        last_packet = packets.get_index(current_app.config['REPLICATION_PACKETS_DIR']).last_packet()
+    except OSError as e:
+        logging.warning(e)
+        last_packet = None
+
+    if last_packet is None:
+        return jsonify({
+            'last_packet': None,
+        })
+
+    etag = last_packet.name
+    last_modified = datetime.fromtimestamp(last_packet.mtime, timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        body = cache.get(last_packet.name, namespace=REPLICATION_INFO_CACHE_NAMESPACE)
+        if body is None:
+            body = current_app.json.dumps({
+                'last_packet': last_packet.name,
+            })
+            cache.set(last_packet.name, body, expirein=REPLICATION_INFO_CACHE_TTL,
+                      namespace=REPLICATION_INFO_CACHE_NAMESPACE)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@api_musicbrainz_bp.route('/replication-wait')
+@token_required
+@rate_limited
+def replication_wait():
+    """Long-polling version of replication-info.
+
+    Waits until a packet newer than the one specified in the `after` argument
+    is available and returns it in the same format as replication-info. If
+    there is no new packet within `timeout` seconds, an empty 204 response is
+    returned and the client should simply make another request.
+    """
+    after = request.args.get('after', type=int)
+    if after is None:
+        return Response("You need to specify number of the last packet you have!\n", status=400)
+    max_timeout = current_app.config.get('LONG_POLL_TIMEOUT', DEFAULT_LONG_POLL_TIMEOUT)
+    timeout = max(0, min(request.args.get('timeout', max_timeout, type=int), max_timeout))
+
+    try:
+        numbers = packets.get_index(current_app.config['REPLICATION_PACKETS_DIR']).numbers
+    except OSError as e:
+        logging.warning(e)
+        numbers = []
+    if numbers and numbers[-1] > after:
+        return jsonify({
+            'last_packet': packets.packet_filename(numbers[-1]),
+        })
+
+    # Don't hold on to a database connection while waiting.
+    db.session.close()
+    try:
+        latest = packet_events.listener.wait(after, timeout, max_waiters=current_app.config.get(
+            'LONG_POLL_MAX_WAITERS', DEFAULT_LONG_POLL_MAX_WAITERS))
+    except packet_events.TooManyWaitersException:
+        return Response("Too many clients are waiting for new packets! Try again later.\n",
+                        status=503, headers={'Retry-After': str(LONG_POLL_RETRY_AFTER)})
+    if latest is None:
+        return Response(status=204)
     return jsonify({
-        'last_packet': _get_last_packet_name(
-            current_app.config['REPLICATION_PACKETS_DIR'],
-            "replication-[0-9]+.tar.bz2$"
-        ),
+        'last_packet': packets.packet_filename(latest),
     })
 
 
 def _replication_hourly(packet_number, v2):
     directory = current_app.config['REPLICATION_PACKETS_DIR']
-    if v2:
-        filename = 'replication-%s-v2.tar.bz2' % packet_number
-    else:
-        filename = 'replication-%s.tar.bz2' % packet_number
-    if not os.path.isfile(safe_join(directory, filename)):
+    filename = packets.packet_filename(packet_number, v2=v2)
+    if not _packet_exists(directory, filename):
         return Response("Can't find specified replication packet!\n", status=404)
 
     if 'USE_NGINX_X_ACCEL' in current_app.config and current_app.config['USE_NGINX_X_ACCEL']:
@@ -113,11 +190,8 @@ def _replication_hourly(packet_number, v2):
 
 def _replication_hourly_signature(packet_number, v2):
     directory = current_app.config['REPLICATION_PACKETS_DIR']
-    if v2:
-        filename = 'replication-%s-v2.tar.bz2.asc' % packet_number
-    else:
-        filename = 'replication-%s.tar.bz2.asc' % packet_number
-    if not os.path.isfile(safe_join(directory, filename)):
+    filename = packets.packet_filename(packet_number, v2=v2, signature=True)
+    if not _packet_exists(directory, filename):
         return Response("Can't find signature for a specified replication packet!\n", status=404)
 
     if 'USE_NGINX_X_ACCEL' in current_app.config and current_app.config['USE_NGINX_X_ACCEL']:
@@ -128,6 +202,7 @@ def _replication_hourly_signature(packet_number, v2):
 
 @api_musicbrainz_bp.route('/replication-<int:packet_number>.tar.bz2')
 @token_required
+@rate_limited
 @tracked
 def replication_hourly(packet_number):
     return _replication_hourly(packet_number, v2=False)
@@ -135,11 +210,46 @@ def replication_hourly(packet_number):
 
 @api_musicbrainz_bp.route('/replication-<int:packet_number>-v2.tar.bz2')
 @token_required
+@rate_limited
 @tracked
 def replication_hourly_v2(packet_number):
     return _replication_hourly(packet_number, v2=True)
 
 
+def _replication_hourly_zstd(packet_number, v2):
+    directory = current_app.config['REPLICATION_PACKETS_DIR']
+    if not _packet_exists(directory, packets.packet_filename(packet_number, v2=v2)):
+        return Response("Can't find specified replication packet!\n", status=404)
+
+    path = zstd_cache.get(directory, packet_number, v2=v2)
+    if path is None:
+        zstd_cache.record_miss(packet_number, v2=v2)
+        return Response("Replication packet isn't available compressed with zstd yet! "
+                        "Try again later or download the bzip2 one.\n", status=404)
+
+    filename = os.path.basename(path)
+    if 'USE_NGINX_X_ACCEL' in current_app.config and current_app.config['USE_NGINX_X_ACCEL']:
+        return _redirect_to_nginx(os.path.join(NGINX_INTERNAL_LOCATION, zstd_cache.CACHE_SUBDIR, filename))
+    else:
+        return send_from_directory(os.path.dirname(path), filename, mimetype=MIMETYPE_ARCHIVE_ZSTD)
+
+
+@api_musicbrainz_bp.route('/replication-<int:packet_number>.tar.zst')
+@token_required
+@rate_limited
+@tracked
+def replication_hourly_zstd(packet_number):
+    return _replication_hourly_zstd(packet_number, v2=False)
+
+
+@api_musicbrainz_bp.route('/replication-<int:packet_number>-v2.tar.zst')
+@token_required
+@rate_limited
+@tracked
+def replication_hourly_zstd_v2(packet_number):
+    return _replication_hourly_zstd(packet_number, v2=True)
+
+
 @api_musicbrainz_bp.route('/replication-<int:packet_number>.tar.bz2.asc')
 @token_required
 def replication_hourly_signature(packet_number):
@@ -152,32 +262,268 @@ def replication_hourly_signature_v2(packet_number):
     return _replication_hourly_signature(packet_number, v2=True)
 
 
+def _catch_up_packets(packet_number):
+    """Returns the packet index and `PacketFile`s of packets newer than a specified one.
+
+    The `v2` query argument selects v2 packets and `limit` the maximum number of
+    packets to return, clamped between 1 and MAX_CATCH_UP_PACKETS. Each item is
+    a tuple of packet number, packet file and signature file (or None). The
+    last element of the returned tuple tells if more packets are available past
+    the limit.
+    """
+    v2 = _is_true(request.args.get('v2'))
+    try:
+        limit = max(1, min(int(request.args.get('limit', MAX_CATCH_UP_PACKETS)), MAX_CATCH_UP_PACKETS))
+    except ValueError:
+        limit = MAX_CATCH_UP_PACKETS
+    index = packets.get_index(current_app.config['REPLICATION_PACKETS_DIR'])
+    numbers = index.numbers_after(packet_number)
+    items = []
+    for number in numbers[:limit]:
+        packet_file = index.get(packets.packet_filename(number, v2=v2))
+        if packet_file is None:
+            continue
+        items.append((number, packet_file, index.get(packets.packet_filename(number, v2=v2, signature=True))))
+    return index, items, len(numbers) > limit
+
+
+@api_musicbrainz_bp.route('/replication-since-<int:packet_number>')
+@token_required
+@rate_limited
+@tracked
+@untracked_if(lambda args: _is_true(args.get('signed')))
+def replication_since(packet_number):
+    """Manifest of all replication packets newer than a specified one.
+
+    Lets replicas that fell behind find out which packets they need to fetch
+    (with their sizes and SHA-256 checksums) in a single request. Checksums
+    come from the manifest (see `metabrainz.api.checksums`), so they are null
+    for packets that haven't been indexed yet. With the `signed` query
+    argument, signed download URLs of the packets and their signatures are
+    included as well. Such requests aren't tracked, every issued URL is
+    counted as a request instead (see `_log_signed_urls`).
+    """
+    signer = None
+    if _is_true(request.args.get('signed')):
+        signer = _url_signer()
+        if signer is None:
+            return Response("Signed URLs are not available!\n", status=404)
+    try:
+        index, items, more = _catch_up_packets(packet_number)
+    except OSError as e:
+        logging.warning(e)
+        return Response("Can't read replication packets!\n", status=503)
+
+    manifest = checksums.get_manifest(index.directory)
+    result = []
+    for number, packet_file, signature_file in items:
+        item = {
+            'number': number,
+            'name': packet_file.name,
+            'size': packet_file.size,
+            'sha256': _packet_sha256(manifest, packet_file),
+            'signature': signature_file.name if signature_file else None,
+        }
+        if signer:
+            item['url'] = signer.url(SIGNED_URLS_REPLICATION_PATH, packet_file.name)
+            item['signature_url'] = signer.url(SIGNED_URLS_REPLICATION_PATH, signature_file.name) \
+                if signature_file else None
+        result.append(item)
+    response = {
+        'packets': result,
+        'more': more,
+    }
+    if signer:
+        response['expires'] = signer.expires
+        # Signatures aren't counted when they're downloaded from the API either.
+        _log_signed_urls(len(result))
+    return jsonify(response)
+
+
+def _is_true(value):
+    return (value or '').lower() in ('1', 'true')
+
+
+def _url_signer():
+    """Returns `signed_urls.URLSigner` for URLs issued now, or None if signed
+    URLs aren't configured."""
+    secret = current_app.config.get('SIGNED_URLS_SECRET')
+    base_url = current_app.config.get('SIGNED_URLS_BASE')
+    if not secret or not base_url:
+        return None
+    ttl = current_app.config.get('SIGNED_URLS_TTL', signed_urls.DEFAULT_TTL)
+    return signed_urls.URLSigner(base_url, secret, signed_urls.expiry(ttl))
+
+
+def _log_signed_urls(url_count):
+    if url_count:
+        SignedURLLog.create_record(request.args.get('token'), url_count)
+
+
+def _packet_sha256(manifest, packet_file):
+    """Returns checksum of a packet from the manifest, or None if the packet
+    hasn't been indexed (since it was last modified) yet."""
+    entry = manifest.get(packet_file.name)
+    if entry is not None and (entry.size, entry.mtime_ns) == (packet_file.size, packet_file.mtime_ns):
+        return entry.sha256
+    return None
+
+
+@api_musicbrainz_bp.route('/replication-sha256sums')
+@token_required
+def replication_sha256sums():
+    """SHA-256 checksums of all replication packets and their signatures, in
+    the format accepted by `sha256sum --check`."""
+    return _sha256sums_response(current_app.config['REPLICATION_PACKETS_DIR'])
+
+
+@api_musicbrainz_bp.route('/json-dumps/sha256sums')
+@token_required
+def json_dumps_sha256sums():
+    """SHA-256 checksums of all JSON dump files, in the format accepted by
+    `sha256sum --check`. Paths are relative to `/json-dumps/`."""
+    return _sha256sums_response(current_app.config['JSON_DUMPS_DIR'])
+
+
+def _sha256sums_response(directory):
+    manifest = checksums.get_manifest(directory)
+    if not manifest.available:
+        return Response("Checksums haven't been generated yet!\n", status=503)
+    return Response(manifest.sha256sums(), mimetype='text/plain')
+
+
+@api_musicbrainz_bp.route('/replication-since-<int:packet_number>.tar')
+@token_required
+@rate_limited
+@tracked
+def replication_since_tar(packet_number):
+    """Streams all replication packets newer than a specified one (and their
+    signatures) as a single uncompressed tar archive.
+
+    Packets are already compressed, so they are sent back-to-back as they are
+    with only tar headers in between.
+    """
+    try:
+        index, items, _ = _catch_up_packets(packet_number)
+    except OSError as e:
+        logging.warning(e)
+        return Response("Can't read replication packets!\n", status=503)
+    if not items:
+        return Response("There are no replication packets after the specified one!\n", status=404)
+
+    files = []
+    for _, packet_file, signature_file in items:
+        files.append(packet_file)
+        if signature_file:
+            files.append(signature_file)
+    return Response(
+        _stream_tar(index.directory, files),
+        mimetype=MIMETYPE_TAR,
+        headers={'Content-Length': str(_tar_size(files))},
+    )
+
+
+def _tar_size(files):
+    size = 2 * tarfile.BLOCKSIZE
+    for packet_file in files:
+        size += tarfile.BLOCKSIZE + -(-packet_file.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    return size
+
+
+def _stream_tar(directory, files):
+    for packet_file in files:
+        info = tarfile.TarInfo(packet_file.name)
+        info.size = packet_file.size
+        info.mtime = int(packet_file.mtime)
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.USTAR_FORMAT)
+        remaining = packet_file.size
+        with open(os.path.join(directory, packet_file.name), 'rb') as f:
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    # Packets are never modified once published, so this shouldn't happen.
+                    raise IOError("%s is shorter than expected" % packet_file.name)
+                remaining -= len(chunk)
+                yield chunk
+        padding = -packet_file.size % tarfile.BLOCKSIZE
+        if padding:
+            yield tarfile.NUL * padding
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+@api_musicbrainz_bp.route('/json-dumps/json-dump-<int:packet_number>/signed-urls')
+@token_required
+@rate_limited
+def json_dump_signed_urls(packet_number):
+    """Signed download URLs of all files in a JSON dump.
+
+    Not tracked, every issued URL is counted as a request instead (see
+    `_log_signed_urls`).
+    """
+    signer = _url_signer()
+    if signer is None:
+        return Response("Signed URLs are not available!\n", status=404)
+    dump_name = "json-dump-%s" % packet_number
+    directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], dump_name)
+    try:
+        filenames = sorted(f for f in os.listdir(directory) if checksums.JSON_DUMP_PATTERN.match(f))
+    except FileNotFoundError:
+        return Response("Can't find specified JSON dump!\n", status=404)
+
+    _log_signed_urls(len(filenames))
+    return jsonify({
+        'files': [{
+            'name': filename,
+            'url': signer.url(SIGNED_URLS_JSON_DUMPS_PATH, dump_name, filename),
+        } for filename in filenames],
+        'expires': signer.expires,
+    })
+
+
 @api_musicbrainz_bp.route('/json-dumps/json-dump-<int:packet_number>/<entity_name>.tar.xz')
 @token_required
+@rate_limited
 @tracked
 def json_dump(packet_number, entity_name):
     """Endpoint that provides access to the JSON dump files.
 
     See MEB-93 for more info.
     """
-    directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], "json-dump-%s" % packet_number)
+    dump_name = "json-dump-%s" % packet_number
+    directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], dump_name)
     filename = '%s.tar.xz' % entity_name
     if not os.path.isfile(safe_join(directory, filename)):
         return Response("Can't find specified JSON dump!", status=404)
-    return send_from_directory(directory, filename, mimetype=MIMETYPE_ARCHIVE_XZ)
+    return _send_json_dump_file(dump_name, filename, mimetype=MIMETYPE_ARCHIVE_XZ)
 
 
 @api_musicbrainz_bp.route('/json-dumps/json-dump-<int:packet_number>/<entity_name>.tar.xz.asc')
 @token_required
+@rate_limited
 @tracked
 def json_dump_signature(packet_number, entity_name):
     """Endpoint that provides access to the JSON dump signature files.
     """
-    directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], "json-dump-%s" % packet_number)
+    dump_name = "json-dump-%s" % packet_number
+    directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], dump_name)
     filename = '%s.tar.xz.asc' % entity_name
     if not os.path.isfile(safe_join(directory, filename)):
         return Response("Can't find signature for the specified JSON dump!", status=404)
-    return send_from_directory(directory, filename, mimetype=MIMETYPE_SIGNATURE)
+    return _send_json_dump_file(dump_name, filename, mimetype=MIMETYPE_SIGNATURE)
+
+
+def _send_json_dump_file(dump_name, filename, mimetype):
+    """Sends a file from a JSON dump, either through nginx or directly.
+
+    When sent directly, `Range`, `If-Range` and ETag based conditional requests
+    are supported, so that interrupted downloads can be resumed.
+    """
+    if 'USE_NGINX_X_ACCEL' in current_app.config and current_app.config['USE_NGINX_X_ACCEL']:
+        return _redirect_to_nginx(os.path.join(NGINX_JSON_DUMPS_INTERNAL_LOCATION, dump_name, filename))
+    else:
+        directory = os.path.join(current_app.config['JSON_DUMPS_DIR'], dump_name)
+        return send_from_directory(directory, filename, mimetype=mimetype, conditional=True, etag=True)
 
 
 def _redirect_to_nginx(location):
@@ -187,17 +533,14 @@ def _redirect_to_nginx(location):
     for more information about it.
     """
     response = Response(status=200)
-    location = iri_to_uri(location, safe_conversion=True)
+    location = iri_to_uri(location)
     response.headers['X-Accel-Redirect'] = location
     return response
 
 
-def _sort_natural(names_list, reverse=False):
-    """Sort list using a natural sort order.
-
-    https://en.wikipedia.org/wiki/Natural_sort_order
-    """
-    def sort_key(val):
-        return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', val)]
-
-    return sorted(names_list, key=sort_key, reverse=reverse)
+def _packet_exists(directory, filename):
+    try:
+        return packets.get_index(directory).get(filename) is not None
+    except OSError as e:
+        logging.warning(e)
+        return False
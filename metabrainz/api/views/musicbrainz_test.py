@@ -1,7 +1,25 @@
 from metabrainz.testing import FlaskTestCase
 from metabrainz.model.token import Token
+from metabrainz.api.access_log_writer import writer as access_log_writer
+from metabrainz.model import db
+from metabrainz.model.signed_url_log import SignedURLLog
+from metabrainz.api import checksums, packets, packet_events, rate_limit, zstd_cache, signed_urls
+from concurrent.futures import ThreadPoolExecutor
 from flask import url_for, current_app
+from brainzutils import cache
+from metabrainz import raw_cache
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+from werkzeug.http import http_date
+from metabrainz.api.views.musicbrainz import MAX_PACKET_AGE_WARNING
 import tempfile
+import redis
+import time
+import hashlib
+import tarfile
+import io
+import bz2
+import zstandard
 import shutil
 import os
 
@@ -15,6 +33,7 @@ class MusicBrainzViewsTestCase(FlaskTestCase):
         self.token = Token.generate_token(owner_id=None)
 
     def tearDown(self):
+        access_log_writer.flush()
         super(MusicBrainzViewsTestCase, self).tearDown()
         shutil.rmtree(self.path)
 
@@ -97,6 +116,36 @@ class MusicBrainzViewsTestCase(FlaskTestCase):
         open(os.path.join(self.path, 'replication-1-v2.tar.bz2.asc'), 'a').close()
         self.assert200(self.client.get(url_for('api_musicbrainz.replication_hourly_signature_v2', packet_number=1, token=self.token)))
 
+    def test_replication_hourly_zstd(self):
+        self.assert400(self.client.get(url_for('api_musicbrainz.replication_hourly_zstd', packet_number=1)))
+        self.assert404(self.client.get(url_for('api_musicbrainz.replication_hourly_zstd', packet_number=1, token=self.token)))
+
+        # Copies are only created by `manage.py compress-packets-zstd`, requests only record misses.
+        raw_cache.connection().delete(raw_cache.key(zstd_cache.REQUESTED_KEY))
+        self._create_packet('replication-1.tar.bz2', bz2.compress(b'packet'))
+        self.assert404(self.client.get(url_for('api_musicbrainz.replication_hourly_zstd', packet_number=1, token=self.token)))
+        zstd_dir = zstd_cache.cache_dir(self.path)
+        self.assertFalse(os.path.exists(os.path.join(zstd_dir, 'replication-1.tar.zst')))
+
+        self.assertEqual(zstd_cache.compress_requested(self.path), 1)
+        resp = self.client.get(url_for('api_musicbrainz.replication_hourly_zstd', packet_number=1, token=self.token))
+        self.assert200(resp)
+        self.assertEqual(resp.mimetype, 'application/zstd')
+        self.assertEqual(zstandard.ZstdDecompressor().stream_reader(io.BytesIO(resp.data)).read(), b'packet')
+        resp.close()
+
+        current_app.config['USE_NGINX_X_ACCEL'] = True
+        try:
+            resp = self.client.get(url_for('api_musicbrainz.replication_hourly_zstd', packet_number=1, token=self.token))
+        finally:
+            current_app.config['USE_NGINX_X_ACCEL'] = False
+        self.assert200(resp)
+        self.assertEqual(resp.headers['X-Accel-Redirect'], '/internal/replication/.zstd/replication-1.tar.zst')
+
+        # The cache directory doesn't show up as a packet.
+        resp = self.client.get(url_for('api_musicbrainz.replication_info', token=self.token))
+        self.assertEqual(resp.json, {'last_packet': 'replication-1.tar.bz2'})
+
     def test_json_dump(self):
         self.assert400(self.client.get(url_for('api_musicbrainz.json_dump', packet_number=1, entity_name='artist')))
         self.assert403(self.client.get(url_for('api_musicbrainz.json_dump', packet_number=1, entity_name='artist', token='fake')))
@@ -116,3 +165,287 @@ class MusicBrainzViewsTestCase(FlaskTestCase):
         os.makedirs(dump_path)
         open(os.path.join(dump_path, 'artist.tar.xz.asc'), 'a').close()
         self.assert200(self.client.get(url_for('api_musicbrainz.json_dump_signature', packet_number=1, entity_name='artist', token=self.token)))
+
+    def test_json_dump_range(self):
+        dump_path = os.path.join(self.json_path, 'json-dump-1')
+        os.makedirs(dump_path)
+        with open(os.path.join(dump_path, 'artist.tar.xz'), 'wb') as f:
+            f.write(b'0123456789')
+        url = url_for('api_musicbrainz.json_dump', packet_number=1, entity_name='artist', token=self.token)
+
+        resp = self.client.get(url)
+        self.assert200(resp)
+        etag = resp.headers['ETag']
+
+        resp = self.client.get(url, headers={'Range': 'bytes=4-'})
+        self.assertStatus(resp, 206)
+        self.assertEqual(resp.data, b'456789')
+
+        resp = self.client.get(url, headers={'Range': 'bytes=4-', 'If-Range': etag})
+        self.assertStatus(resp, 206)
+
+        # The file has changed since the download was started, so it has to be sent again in full
+        resp = self.client.get(url, headers={'Range': 'bytes=4-', 'If-Range': '"outdated"'})
+        self.assert200(resp)
+        self.assertEqual(resp.data, b'0123456789')
+
+        self.assertStatus(self.client.get(url, headers={'If-None-Match': etag}), 304)
+
+    def test_json_dump_x_accel(self):
+        dump_path = os.path.join(self.json_path, 'json-dump-1')
+        os.makedirs(dump_path)
+        open(os.path.join(dump_path, 'artist.tar.xz'), 'a').close()
+        current_app.config['USE_NGINX_X_ACCEL'] = True
+        try:
+            resp = self.client.get(url_for('api_musicbrainz.json_dump', packet_number=1, entity_name='artist', token=self.token))
+        finally:
+            current_app.config['USE_NGINX_X_ACCEL'] = False
+        self.assert200(resp)
+        self.assertEqual(resp.headers['X-Accel-Redirect'], '/internal/json-dumps/json-dump-1/artist.tar.xz')
+
+    def _create_packet(self, name, content=b''):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(content)
+
+    def test_replication_since(self):
+        self._create_packet('replication-1.tar.bz2', b'one')
+        self._create_packet('replication-2.tar.bz2', b'two')
+        self._create_packet('replication-2.tar.bz2.asc', b'sig')
+        self._create_packet('replication-2-v2.tar.bz2', b'two v2')
+        self._create_packet('replication-3.tar.bz2', b'three')
+        self._index_checksums()
+
+        self.assert400(self.client.get(url_for('api_musicbrainz.replication_since', packet_number=1)))
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=1, token=self.token))
+        self.assert200(resp)
+        self.assertEqual(resp.json, {
+            'packets': [
+                {
+                    'number': 2,
+                    'name': 'replication-2.tar.bz2',
+                    'size': 3,
+                    'sha256': hashlib.sha256(b'two').hexdigest(),
+                    'signature': 'replication-2.tar.bz2.asc',
+                },
+                {
+                    'number': 3,
+                    'name': 'replication-3.tar.bz2',
+                    'size': 5,
+                    'sha256': hashlib.sha256(b'three').hexdigest(),
+                    'signature': None,
+                },
+            ],
+            'more': False,
+        })
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=0, token=self.token, limit=1))
+        self.assertEqual([p['number'] for p in resp.json['packets']], [1])
+        self.assertTrue(resp.json['more'])
+
+        # Limits below 1 return one packet rather than none.
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=0, token=self.token, limit=-5))
+        self.assertEqual([p['number'] for p in resp.json['packets']], [1])
+        self.assertTrue(resp.json['more'])
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=1, token=self.token, v2=1))
+        self.assertEqual([p['name'] for p in resp.json['packets']], ['replication-2-v2.tar.bz2'])
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=3, token=self.token))
+        self.assertEqual(resp.json, {'packets': [], 'more': False})
+
+        # Packets aren't hashed on request, checksums of ones that haven't been indexed yet are missing.
+        self._create_packet('replication-4.tar.bz2', b'four')
+        resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=3, token=self.token))
+        self.assertEqual([(p['number'], p['sha256']) for p in resp.json['packets']], [(4, None)])
+
+    def _signed_urls_config(self):
+        return mock.patch.dict(current_app.config, {
+            'SIGNED_URLS_BASE': 'https://mirror.example.org/signed',
+            'SIGNED_URLS_SECRET': 'secret',
+        })
+
+    def _signed_url_count(self):
+        return db.session.query(db.func.sum(SignedURLLog.url_count)).filter_by(token=self.token).scalar()
+
+    def _assert_valid_signed_url(self, url, path):
+        url = urlsplit(url)
+        self.assertEqual(url.path, path)
+        query = parse_qs(url.query)
+        self.assertTrue(signed_urls.verify(url.path, query['expires'][0], query['signature'][0], 'secret'))
+
+    def test_replication_since_signed(self):
+        self._create_packet('replication-1.tar.bz2', b'one')
+        self._create_packet('replication-1.tar.bz2.asc', b'sig')
+        self._create_packet('replication-2.tar.bz2', b'two')
+
+        self.assert404(self.client.get(url_for('api_musicbrainz.replication_since', packet_number=0,
+                                               token=self.token, signed=1)))
+
+        with self._signed_urls_config(), mock.patch.object(access_log_writer, 'add') as add:
+            resp = self.client.get(url_for('api_musicbrainz.replication_since', packet_number=0,
+                                           token=self.token, signed=1))
+        self.assert200(resp)
+        # Only the signed URLs are counted, not the request itself.
+        add.assert_not_called()
+        self.assertGreater(resp.json['expires'], time.time())
+        first, second = resp.json['packets']
+        self._assert_valid_signed_url(first['url'], '/signed/replication/replication-1.tar.bz2')
+        self._assert_valid_signed_url(first['signature_url'], '/signed/replication/replication-1.tar.bz2.asc')
+        self._assert_valid_signed_url(second['url'], '/signed/replication/replication-2.tar.bz2')
+        self.assertIsNone(second['signature_url'])
+        self.assertEqual(self._signed_url_count(), 2)
+
+    def test_json_dump_signed_urls(self):
+        dump_path = os.path.join(self.json_path, 'json-dump-1')
+        os.makedirs(dump_path)
+        for filename in ('artist.tar.xz', 'artist.tar.xz.asc', 'label.tar.xz'):
+            open(os.path.join(dump_path, filename), 'a').close()
+
+        self.assert400(self.client.get(url_for('api_musicbrainz.json_dump_signed_urls', packet_number=1)))
+        self.assert404(self.client.get(url_for('api_musicbrainz.json_dump_signed_urls', packet_number=1,
+                                               token=self.token)))
+
+        with self._signed_urls_config():
+            self.assert404(self.client.get(url_for('api_musicbrainz.json_dump_signed_urls', packet_number=2,
+                                                   token=self.token)))
+            with mock.patch.object(access_log_writer, 'add') as add:
+                resp = self.client.get(url_for('api_musicbrainz.json_dump_signed_urls', packet_number=1,
+                                               token=self.token))
+        self.assert200(resp)
+        add.assert_not_called()
+        self.assertEqual([f['name'] for f in resp.json['files']],
+                         ['artist.tar.xz', 'artist.tar.xz.asc', 'label.tar.xz'])
+        self._assert_valid_signed_url(resp.json['files'][0]['url'], '/signed/json-dumps/json-dump-1/artist.tar.xz')
+        self.assertEqual(self._signed_url_count(), 3)
+
+    def test_replication_since_tar(self):
+        self._create_packet('replication-1.tar.bz2', b'one')
+        self._create_packet('replication-2.tar.bz2', b'two')
+        self._create_packet('replication-2.tar.bz2.asc', b'sig')
+        self._create_packet('replication-3.tar.bz2', b'x' * 1000)
+
+        self.assert404(self.client.get(url_for('api_musicbrainz.replication_since_tar', packet_number=3, token=self.token)))
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_since_tar', packet_number=1, token=self.token))
+        self.assert200(resp)
+        self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+        with tarfile.open(fileobj=io.BytesIO(resp.data)) as tar:
+            self.assertEqual(tar.getnames(), ['replication-2.tar.bz2', 'replication-2.tar.bz2.asc', 'replication-3.tar.bz2'])
+            self.assertEqual(tar.extractfile('replication-2.tar.bz2').read(), b'two')
+            self.assertEqual(tar.extractfile('replication-3.tar.bz2').read(), b'x' * 1000)
+
+    def _index_checksums(self):
+        with ThreadPoolExecutor() as executor:
+            checksums.update_manifest(self.path, packets.PACKET_PATTERN, executor)
+            checksums.update_manifest(self.json_path, checksums.JSON_DUMP_PATTERN, executor)
+
+    def test_sha256sums(self):
+        self.assertStatus(self.client.get(url_for('api_musicbrainz.replication_sha256sums', token=self.token)), 503)
+
+        self._create_packet('replication-1.tar.bz2', b'one')
+        os.makedirs(os.path.join(self.json_path, 'json-dump-1'))
+        with open(os.path.join(self.json_path, 'json-dump-1', 'artist.tar.xz'), 'wb') as f:
+            f.write(b'artist')
+        self._index_checksums()
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_sha256sums', token=self.token))
+        self.assert200(resp)
+        self.assertEqual(resp.data.decode(), '%s  replication-1.tar.bz2\n' % hashlib.sha256(b'one').hexdigest())
+
+        resp = self.client.get(url_for('api_musicbrainz.json_dumps_sha256sums', token=self.token))
+        self.assert200(resp)
+        self.assertEqual(resp.data.decode(), '%s  json-dump-1/artist.tar.xz\n' % hashlib.sha256(b'artist').hexdigest())
+
+    def test_replication_check_checksums(self):
+        self._create_packet('replication-1.tar.bz2', b'one')
+        self._create_packet('replication-2.tar.bz2', b'two')
+        self._index_checksums()
+        self.assertEqual(self.client.get('/api/musicbrainz/replication-check').data, b"OK")
+
+        # Packets that have already been verified are only checked again on request.
+        self._create_packet('replication-1.tar.bz2', b'modified')
+        self.assertEqual(self.client.get('/api/musicbrainz/replication-check').data, b"OK")
+        resp = self.client.get('/api/musicbrainz/replication-check?full=1')
+        self.assertEqual(resp.data, b"WARNING Replication packet 1 has a stale manifest entry")
+
+        self._create_packet('replication-1.tar.bz2', b'one')
+        self._create_packet('replication-3.tar.bz2', b'three')
+        os.utime(os.path.join(self.path, 'replication-3.tar.bz2'), (0, 0))
+        resp = self.client.get('/api/musicbrainz/replication-check')
+        self.assertEqual(resp.data, b"WARNING Replication packet 3 has no checksum")
+
+    def test_rate_limit(self):
+        self._create_packet('replication-1.tar.bz2')
+        rate_limit._local_limits_cache.set(self.token, (1, 1))
+        url = url_for('api_musicbrainz.replication_hourly', packet_number=1, token=self.token)
+        self.assert200(self.client.get(url))
+        resp = self.client.get(url)
+        self.assertStatus(resp, 429)
+        self.assertEqual(resp.headers['Retry-After'], '60')
+
+        # Requests aren't rejected when limits can't be checked.
+        with mock.patch.object(rate_limit, 'check', side_effect=redis.ConnectionError("down")):
+            resp = self.client.get(url)
+        self.assert200(resp)
+        resp.close()
+
+    def test_replication_info_conditional(self):
+        self._create_packet('replication-1.tar.bz2')
+        url = url_for('api_musicbrainz.replication_info', token=self.token)
+        resp = self.client.get(url)
+        self.assert200(resp)
+        etag = resp.headers['ETag']
+        last_modified = resp.headers['Last-Modified']
+        self.assertEqual(etag, '"replication-1.tar.bz2"')
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertStatus(resp, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertStatus(self.client.get(url, headers={'If-Modified-Since': last_modified}), 304)
+
+        self._create_packet('replication-2.tar.bz2')
+        os.utime(os.path.join(self.path, 'replication-2.tar.bz2'), (time.time() + 10, time.time() + 10))
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert200(resp)
+        self.assertEqual(resp.json, {'last_packet': 'replication-2.tar.bz2'})
+        self.assertEqual(cache.get('replication-2.tar.bz2', namespace='replication_info'), resp.get_data(as_text=True))
+
+    def test_replication_check_conditional(self):
+        self._create_packet('replication-1.tar.bz2')
+        resp = self.client.get('/api/musicbrainz/replication-check')
+        self.assert200(resp)
+        self.assertNotIn('Last-Modified', resp.headers)
+        resp = self.client.get('/api/musicbrainz/replication-check', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertStatus(resp, 304)
+
+        # The status changes as the newest packet gets older, without it being modified.
+        stale = time.time() - MAX_PACKET_AGE_WARNING - 60
+        os.utime(os.path.join(self.path, 'replication-1.tar.bz2'), (stale, stale))
+        os.utime(self.path, None)
+        resp = self.client.get('/api/musicbrainz/replication-check',
+                               headers={'If-Modified-Since': http_date(time.time())})
+        self.assert200(resp)
+        self.assertTrue(resp.data.startswith(b"WARNING Latest replication packet"))
+
+    @mock.patch.object(packet_events, 'listener', packet_events.PacketListener())
+    def test_replication_wait(self):
+        raw_cache.connection().delete(raw_cache.key(packet_events.LATEST_KEY))
+        self._create_packet('replication-1.tar.bz2')
+        self.assert400(self.client.get(url_for('api_musicbrainz.replication_wait', token=self.token)))
+
+        resp = self.client.get(url_for('api_musicbrainz.replication_wait', after=0, token=self.token))
+        self.assert200(resp)
+        self.assertEqual(resp.json, {'last_packet': 'replication-1.tar.bz2'})
+
+        # Waiting is disabled by default.
+        resp = self.client.get(url_for('api_musicbrainz.replication_wait', after=1, token=self.token))
+        self.assertStatus(resp, 503)
+        self.assertIn('Retry-After', resp.headers)
+
+        current_app.config['LONG_POLL_MAX_WAITERS'] = 1
+        try:
+            resp = self.client.get(url_for('api_musicbrainz.replication_wait', after=1, timeout=0, token=self.token))
+        finally:
+            del current_app.config['LONG_POLL_MAX_WAITERS']
+        self.assertStatus(resp, 204)
@@ -0,0 +1,208 @@
+"""zstd-compressed copies of replication packets, cached on disk.
+
+Decompressing bzip2 is the slowest part of applying a backlog of packets, so
+packets can also be downloaded recompressed with zstd. Copies are kept in the
+`.zstd` subdirectory of the packets directory, so they can be served through
+the same nginx location as the originals. They are only created ahead of time
+by `manage.py compress-packets-zstd`; web processes serve copies that already
+exist and never compress anything themselves. The command compresses the latest
+packets and the ones that were requested without having a copy, which web
+processes record in a Redis set (so replicas that are catching up get copies
+of older packets after a while).
+When the cache grows over `ZSTD_CACHE_MAX_SIZE` bytes, the least recently
+requested copies are removed. Requests are recorded by bumping the mtime of an
+empty `.used` file next to each copy, so that the mtime of the copy itself (and
+the ETag and Last-Modified of responses derived from it) doesn't change.
+
+Copies are written to a temporary file which is created exclusively, so the
+same packet isn't recompressed by several processes at once.
+"""
+from metabrainz import raw_cache
+from metabrainz.api import packets
+import bz2
+import logging
+import os
+import redis
+import time
+import zstandard
+
+DEFAULT_LEVEL = 10
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3  # 10 GiB
+
+CACHE_SUBDIR = '.zstd'
+USED_SUFFIX = '.used'
+
+# Redis set of packets whose copies were requested but didn't exist.
+REQUESTED_KEY = 'zstd_cache:requested'
+
+CHUNK_SIZE = 1024 * 1024
+
+# Temporary files older than this are left over from crashed processes.
+STALE_TMP_AGE = 60 * 60
+
+
+def zstd_filename(packet_number, v2=False):
+    """Returns name of the zstd copy of a specified replication packet."""
+    return 'replication-%s%s.tar.zst' % (packet_number, '-v2' if v2 else '')
+
+
+def cache_dir(packets_dir):
+    return os.path.join(packets_dir, CACHE_SUBDIR)
+
+
+def _tmp_path(path):
+    return path + '.tmp'
+
+
+def recompress(source, destination, level=DEFAULT_LEVEL, max_size=None):
+    """Recompresses a bzip2 file with zstd.
+
+    Does nothing if the destination already exists or is being written by
+    another process. Old copies are evicted afterwards if `max_size` is set.
+
+    Returns:
+        True if a new copy was created.
+    """
+    if os.path.exists(destination):
+        return False
+    tmp_path = _tmp_path(destination)
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        if time.time() - os.path.getmtime(tmp_path) < STALE_TMP_AGE:
+            return False
+        os.remove(tmp_path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        with os.fdopen(fd, 'wb') as out, bz2.open(source, 'rb') as src:
+            compressor = zstandard.ZstdCompressor(level=level)
+            with compressor.stream_writer(out, closefd=False) as writer:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    writer.write(chunk)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if max_size is not None:
+        evict(os.path.dirname(destination), max_size)
+    return True
+
+
+def evict(directory, max_size):
+    """Removes least recently used copies until the cache fits in `max_size` bytes.
+
+    Returns:
+        List of names of removed files.
+    """
+    copies = {}
+    used = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.tar.zst') and entry.is_file():
+                stat = entry.stat()
+                copies[entry.name] = (stat.st_mtime, stat.st_size)
+            elif entry.name.endswith('.tar.zst' + USED_SUFFIX):
+                used[entry.name[:-len(USED_SUFFIX)]] = entry.stat().st_mtime
+    total = sum(size for _, size in copies.values())
+    removed = []
+    for _, size, name in sorted((max(mtime, used.get(name, 0)), size, name)
+                                        for name, (mtime, size) in copies.items()):
+        if total <= max_size:
+            break
+        for path in (os.path.join(directory, name), os.path.join(directory, name + USED_SUFFIX)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(name)
+    return removed
+
+
+def mark_used(path):
+    """Records that a copy was requested, for `evict`."""
+    used_path = path + USED_SUFFIX
+    try:
+        os.utime(used_path, None)
+    except FileNotFoundError:
+        try:
+            open(used_path, 'a').close()
+        except OSError:
+            pass
+    except OSError:
+        pass
+
+
+def get(packets_dir, packet_number, v2=False):
+    """Returns path to the zstd copy of a packet, or None if it hasn't been
+    created (see `compress_latest`)."""
+    path = os.path.join(cache_dir(packets_dir), zstd_filename(packet_number, v2=v2))
+    if not os.path.isfile(path):
+        return None
+    mark_used(path)
+    return path
+
+
+def record_miss(packet_number, v2=False):
+    """Records that the copy of a packet was requested but doesn't exist, so
+    that `compress_requested` creates it."""
+    try:
+        raw_cache.connection().sadd(raw_cache.key(REQUESTED_KEY), _packet_key(packet_number, v2))
+    except redis.RedisError as e:
+        logging.warning("Failed to record request for zstd copy of packet %s: %s", packet_number, e)
+
+
+def _packet_key(packet_number, v2):
+    return '%d%s' % (packet_number, '-v2' if v2 else '')
+
+
+def _compress(packets_dir, packet_number, v2, level, max_size):
+    """Creates the copy of a packet, logging any failure so that other
+    packets are still compressed."""
+    source = os.path.join(packets_dir, packets.packet_filename(packet_number, v2=v2))
+    destination = os.path.join(cache_dir(packets_dir), zstd_filename(packet_number, v2=v2))
+    try:
+        return recompress(source, destination, level, max_size)
+    except Exception:
+        logging.exception("Failed to compress %s with zstd", source)
+        return False
+
+
+def compress_latest(packets_dir, count, level=DEFAULT_LEVEL, max_size=DEFAULT_MAX_SIZE):
+    """Creates zstd copies of the latest `count` packets (v1 and v2) that don't have one.
+
+    Returns:
+        Number of created copies.
+    """
+    os.makedirs(cache_dir(packets_dir), exist_ok=True)
+    index = packets.get_index(packets_dir)
+    created = 0
+    for number in index.numbers[-count:]:
+        for v2 in (False, True):
+            if index.get(packets.packet_filename(number, v2=v2)) is None:
+                continue
+            if _compress(packets_dir, number, v2, level, max_size):
+                created += 1
+    return created
+
+
+def compress_requested(packets_dir, level=DEFAULT_LEVEL, max_size=DEFAULT_MAX_SIZE):
+    """Creates zstd copies of packets recorded by `record_miss`.
+
+    Packets are removed from the set once they're processed, even if
+    compressing them failed; they're recorded again if they're requested.
+
+    Returns:
+        Number of created copies.
+    """
+    os.makedirs(cache_dir(packets_dir), exist_ok=True)
+    connection = raw_cache.connection()
+    key = raw_cache.key(REQUESTED_KEY)
+    created = 0
+    for member in connection.smembers(key):
+        member = member.decode()
+        v2 = member.endswith('-v2')
+        if _compress(packets_dir, int(member[:-3] if v2 else member), v2, level, max_size):
+            created += 1
+        connection.srem(key, member)
+    return created
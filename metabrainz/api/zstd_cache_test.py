@@ -0,0 +1,157 @@
+from unittest import TestCase, mock
+from metabrainz.testing import FlaskTestCase
+from metabrainz.api import zstd_cache, packets
+from metabrainz import raw_cache
+import tempfile
+import shutil
+import time
+import bz2
+import os
+import redis
+import zstandard
+
+
+class ZstdCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_dir = zstd_cache.cache_dir(self.path)
+        os.makedirs(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _create_packet(self, number, content, v2=False):
+        path = os.path.join(self.path, packets.packet_filename(number, v2=v2))
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(content))
+        return path
+
+    def _create_copy(self, name, size, mtime):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (mtime, mtime))
+
+    def test_recompress(self):
+        source = self._create_packet(1, b'packet contents' * 1000)
+        destination = os.path.join(self.cache_dir, zstd_cache.zstd_filename(1))
+        self.assertTrue(zstd_cache.recompress(source, destination, level=3))
+        with open(destination, 'rb') as f:
+            self.assertEqual(zstandard.ZstdDecompressor().stream_reader(f).read(), b'packet contents' * 1000)
+        self.assertFalse(os.path.exists(destination + '.tmp'))
+
+        # Existing copies aren't created again.
+        self.assertFalse(zstd_cache.recompress(source, destination, level=3))
+
+    def test_recompress_in_progress(self):
+        source = self._create_packet(1, b'contents')
+        destination = os.path.join(self.cache_dir, zstd_cache.zstd_filename(1))
+        open(destination + '.tmp', 'wb').close()
+        self.assertFalse(zstd_cache.recompress(source, destination))
+        self.assertFalse(os.path.exists(destination))
+
+        # Temporary files of crashed processes are replaced.
+        stale = time.time() - zstd_cache.STALE_TMP_AGE - 1
+        os.utime(destination + '.tmp', (stale, stale))
+        self.assertTrue(zstd_cache.recompress(source, destination))
+        self.assertTrue(os.path.exists(destination))
+
+    def test_recompress_failure(self):
+        source = os.path.join(self.path, packets.packet_filename(1))
+        with open(source, 'wb') as f:
+            f.write(b'not bzip2')
+        destination = os.path.join(self.cache_dir, zstd_cache.zstd_filename(1))
+        with self.assertRaises(OSError):
+            zstd_cache.recompress(source, destination)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_evict(self):
+        now = time.time()
+        self._create_copy(zstd_cache.zstd_filename(1), 100, now - 30)
+        self._create_copy(zstd_cache.zstd_filename(2), 100, now - 10)
+        self._create_copy(zstd_cache.zstd_filename(3), 100, now - 20)
+        self._create_copy(zstd_cache.zstd_filename(4) + '.tmp', 1000, now - 40)
+
+        self.assertEqual(zstd_cache.evict(self.cache_dir, 300), [])
+        self.assertEqual(zstd_cache.evict(self.cache_dir, 150), [
+            zstd_cache.zstd_filename(1),
+            zstd_cache.zstd_filename(3),
+        ])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), [
+            zstd_cache.zstd_filename(2),
+            zstd_cache.zstd_filename(4) + '.tmp',
+        ])
+
+    def test_evict_by_last_use(self):
+        now = time.time()
+        self._create_copy(zstd_cache.zstd_filename(1), 100, now - 30)
+        self._create_copy(zstd_cache.zstd_filename(2), 100, now - 20)
+        self._create_copy(zstd_cache.zstd_filename(1) + zstd_cache.USED_SUFFIX, 0, now - 10)
+
+        self.assertEqual(zstd_cache.evict(self.cache_dir, 150), [zstd_cache.zstd_filename(2)])
+        self.assertEqual(zstd_cache.evict(self.cache_dir, 0), [zstd_cache.zstd_filename(1)])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_get(self):
+        self._create_packet(1, b'contents')
+        self.assertIsNone(zstd_cache.get(self.path, 1))
+        # Missing copies aren't created on request.
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+        mtime = time.time() - 100
+        self._create_copy(zstd_cache.zstd_filename(1), 10, mtime)
+        path = zstd_cache.get(self.path, 1)
+        self.assertEqual(path, os.path.join(self.cache_dir, zstd_cache.zstd_filename(1)))
+        self.assertIsNone(zstd_cache.get(self.path, 1, v2=True))
+        # Requests are recorded without changing the mtime of the copy.
+        self.assertEqual(os.path.getmtime(path), mtime)
+        self.assertGreater(os.path.getmtime(path + zstd_cache.USED_SUFFIX), time.time() - 10)
+
+    def test_compress_latest(self):
+        for number in (1, 2, 3):
+            self._create_packet(number, b'%d' % number)
+        self._create_packet(3, b'3', v2=True)
+        self.assertEqual(zstd_cache.compress_latest(self.path, 2, level=3), 3)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), [
+            zstd_cache.zstd_filename(2),
+            zstd_cache.zstd_filename(3, v2=True),
+            zstd_cache.zstd_filename(3),
+        ])
+        self.assertEqual(zstd_cache.compress_latest(self.path, 2, level=3), 0)
+
+    def test_compress_latest_failure(self):
+        for number in (1, 2):
+            self._create_packet(number, b'%d' % number)
+        with open(os.path.join(self.path, packets.packet_filename(1)), 'wb') as f:
+            f.write(b'not bzip2')
+        # Other packets are still compressed.
+        self.assertEqual(zstd_cache.compress_latest(self.path, 2, level=3), 1)
+        self.assertEqual(os.listdir(self.cache_dir), [zstd_cache.zstd_filename(2)])
+
+
+class RequestedCopiesTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(RequestedCopiesTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        raw_cache.connection().delete(raw_cache.key(zstd_cache.REQUESTED_KEY))
+
+    def tearDown(self):
+        super(RequestedCopiesTestCase, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def test_compress_requested(self):
+        for number in (1, 2):
+            with open(os.path.join(self.path, packets.packet_filename(number, v2=True)), 'wb') as f:
+                f.write(bz2.compress(b'contents'))
+        zstd_cache.record_miss(1, v2=True)
+        zstd_cache.record_miss(3)
+        # Packets that can't be compressed are logged and dropped from the set.
+        self.assertEqual(zstd_cache.compress_requested(self.path, level=3), 1)
+        self.assertEqual(os.listdir(zstd_cache.cache_dir(self.path)), [zstd_cache.zstd_filename(1, v2=True)])
+        self.assertEqual(raw_cache.connection().smembers(raw_cache.key(zstd_cache.REQUESTED_KEY)), set())
+
+    def test_record_miss_without_redis(self):
+        with mock.patch.object(raw_cache, 'connection', side_effect=redis.ConnectionError("down")):
+            zstd_cache.record_miss(1)
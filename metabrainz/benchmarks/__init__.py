@@ -0,0 +1,12 @@
+import statistics
+
+
+def percentiles(timings):
+    """Summarizes a list of durations (in seconds) in milliseconds."""
+    timings = sorted(timings)
+    return {
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95)] * 1000,
+        "p99_ms": timings[int(len(timings) * 0.99)] * 1000,
+    }
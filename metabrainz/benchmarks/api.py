@@ -0,0 +1,232 @@
+"""Benchmark of the MusicBrainz API hot paths.
+
+Builds a synthetic replication packets directory, seeds tokens and access log
+rows, and then makes requests to the API endpoints, first one by one through
+the Flask test client (which shows the cost of the app itself) and then
+concurrently from several processes through a local WSGI server. Reports
+throughput and latency for every endpoint.
+
+Seeded rows are committed (the app must be able to see them) and deleted at the
+end, so this should only be run against development or test databases.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from metabrainz.api import ip_block, packets
+from metabrainz.api.access_log_writer import writer as access_log_writer
+from metabrainz.benchmarks import percentiles
+from metabrainz.model import db
+from metabrainz.utils import generate_string
+from flask import current_app
+from sqlalchemy import text
+from werkzeug.serving import make_server
+import multiprocessing
+import urllib.error
+import urllib.request
+import subprocess
+import threading
+import tempfile
+import shutil
+import random
+import time
+import pytz
+import os
+
+PACKET_SIZE = 4096
+
+# Endpoints that are expected to reject requests, all others must succeed.
+ERROR_ENDPOINTS = {"invalid_token"}
+
+CLIENT_IP_ADDRESS = "127.0.0.1"
+
+
+def _endpoints(last_packet, token):
+    """Returns functions that pick a path to request for every benchmarked endpoint."""
+    return {
+        "replication_info": lambda: "/api/musicbrainz/replication-info?token=%s" % token(),
+        "replication_check": lambda: "/api/musicbrainz/replication-check",
+        "replication_hourly": lambda: "/api/musicbrainz/%s?token=%s" % (
+            packets.packet_filename(random.randint(1, last_packet)), token()),
+        "replication_since": lambda: "/api/musicbrainz/replication-since-%s?token=%s&limit=24" % (
+            random.randint(1, last_packet), token()),
+        "invalid_token": lambda: "/api/musicbrainz/replication-info?token=invalid-%s" % generate_string(8),
+    }
+
+
+def _create_packets(directory, count):
+    data = os.urandom(PACKET_SIZE)
+    for number in range(1, count + 1):
+        for signature in (False, True):
+            with open(os.path.join(directory, packets.packet_filename(number, signature=signature)), 'wb') as f:
+                f.write(data if not signature else b'signature')
+
+
+def _seed(connection, tokens, access_log_rows):
+    now = datetime.now(pytz.utc)
+    connection.execute(text("INSERT INTO token (value, is_active) VALUES (:value, 't')"),
+                       [{"value": token} for token in tokens])
+    connection.execute(text('INSERT INTO access_log (token, "timestamp", ip_address) '
+                            'VALUES (:token, :timestamp, :ip_address) ON CONFLICT DO NOTHING'),
+                       [{
+                           "token": random.choice(tokens),
+                           "timestamp": now - timedelta(microseconds=i * 3600 * 10 ** 6 // access_log_rows),
+                           "ip_address": "192.168.%s.%s" % (random.randrange(4), random.randrange(256)),
+                       } for i in range(access_log_rows)])
+
+
+def _cleanup(connection, prefix):
+    for table in ("token_usage_daily", "access_log_hourly", "access_log"):
+        connection.execute(text("DELETE FROM %s WHERE token LIKE :prefix" % table), {"prefix": prefix + "%"})
+    connection.execute(text("DELETE FROM token WHERE value LIKE :prefix"), {"prefix": prefix + "%"})
+
+
+def _summarize(timings, statuses, elapsed=None):
+    results = {}
+    for endpoint, endpoint_timings in timings.items():
+        results[endpoint] = percentiles(endpoint_timings)
+        results[endpoint]["requests"] = len(endpoint_timings)
+        results[endpoint]["statuses"] = dict(statuses[endpoint])
+        if elapsed:
+            results[endpoint]["requests_per_second"] = len(endpoint_timings) / elapsed
+    return results
+
+
+def _run_test_client(app, endpoints, requests):
+    timings, statuses = defaultdict(list), defaultdict(lambda: defaultdict(int))
+    client = app.test_client()
+    for endpoint, path in endpoints.items():
+        for _ in range(requests):
+            url = path()
+            started = time.perf_counter()
+            response = client.get(url)
+            response.close()
+            timings[endpoint].append(time.perf_counter() - started)
+            statuses[endpoint][response.status_code] += 1
+    return _summarize(timings, statuses)
+
+
+def _load_worker(args):
+    """Makes requests to a server from a separate process.
+
+    Returns time it took to make all of them and timing of every request.
+    """
+    base_url, urls = args
+    results = []
+    worker_started = time.perf_counter()
+    for endpoint, url in urls:
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url + url) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        results.append((endpoint, time.perf_counter() - started, status))
+    return time.perf_counter() - worker_started, results
+
+
+def _run_load(app, endpoints, requests, processes):
+    server = make_server(CLIENT_IP_ADDRESS, 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://%s:%s" % (CLIENT_IP_ADDRESS, server.server_port)
+
+    urls = [(endpoint, path()) for endpoint, path in endpoints.items() for _ in range(requests)]
+    random.shuffle(urls)
+    chunks = [(base_url, urls[i::processes]) for i in range(processes)]
+    timings, statuses = defaultdict(list), defaultdict(lambda: defaultdict(int))
+    try:
+        # Startup of the processes isn't included, throughput is measured
+        # over the time the slowest process spent making requests.
+        elapsed = 0
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            for worker_elapsed, results in pool.imap_unordered(_load_worker, chunks):
+                elapsed = max(elapsed, worker_elapsed)
+                for endpoint, duration, status in results:
+                    timings[endpoint].append(duration)
+                    statuses[endpoint][status] += 1
+    finally:
+        server.shutdown()
+    results = _summarize(timings, statuses, elapsed)
+    results["total_requests_per_second"] = len(urls) / elapsed
+    return results
+
+
+def _check_statuses(results):
+    """Makes sure that requests to endpoints that should succeed did, otherwise
+    their timings aren't comparable."""
+    for endpoint, result in results.items():
+        if endpoint in ERROR_ENDPOINTS or not isinstance(result, dict):
+            continue
+        failed = {status: count for status, count in result["statuses"].items() if status != 200}
+        if failed:
+            raise RuntimeError("Requests to %s failed: %s" % (endpoint, failed))
+
+
+def _current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(packet_count=20000, token_count=100, access_log_rows=100000, requests=500, processes=4):
+    """Runs the benchmark.
+
+    Args:
+        packet_count: Number of packets (each with a signature) in the directory.
+        token_count: Number of valid tokens making requests.
+        access_log_rows: Number of access log rows within the last hour.
+        requests: Number of requests made to each endpoint by each driver.
+        processes: Number of client processes generating load.
+
+    Returns:
+        Dictionary with results.
+    """
+    prefix = "bench-%s-" % generate_string(8)
+    tokens = [prefix + str(i) for i in range(token_count)]
+    app = current_app._get_current_object()
+    directory = tempfile.mkdtemp()
+    config = {
+        'REPLICATION_PACKETS_DIR': directory,
+        'USE_NGINX_X_ACCEL': False,
+        # Rate limiting is benchmarked, but requests shouldn't be rejected by it.
+        'API_RATE_LIMIT': 10 ** 9,
+        'API_RATE_LIMIT_BURST': 10 ** 9,
+        'API_IP_RATE_LIMIT': 10 ** 9,
+        'API_IP_RATE_LIMIT_BURST': 10 ** 9,
+        # Requests with invalid tokens are benchmarked too, the client mustn't get blocked for them.
+        'INVALID_TOKEN_BLOCK_THRESHOLD': 10 ** 9,
+    }
+    original_config = {key: app.config[key] for key in config if key in app.config}
+    try:
+        _create_packets(directory, packet_count)
+        with db.engine.begin() as connection:
+            _seed(connection, tokens, access_log_rows)
+        app.config.update(config)
+
+        endpoints = _endpoints(packet_count, lambda: random.choice(tokens))
+        ip_block.unblock(CLIENT_IP_ADDRESS)
+        results = {
+            "commit": _current_commit(),
+            "timestamp": datetime.now(pytz.utc).isoformat(),
+            "packets": packet_count,
+            "tokens": token_count,
+            "access_log_rows": access_log_rows,
+            "requests_per_endpoint": requests,
+            "processes": processes,
+            "test_client": _run_test_client(app, endpoints, requests),
+            "wsgi_server": _run_load(app, endpoints, requests, processes),
+        }
+        _check_statuses(results["test_client"])
+        _check_statuses(results["wsgi_server"])
+    finally:
+        for key in config:
+            app.config.pop(key, None)
+        app.config.update(original_config)
+        # Failures counted while the threshold was lifted mustn't block the address later.
+        ip_block.unblock(CLIENT_IP_ADDRESS)
+        access_log_writer.flush()
+        with db.engine.begin() as connection:
+            _cleanup(connection, prefix)
+        shutil.rmtree(directory)
+    return results
@@ -0,0 +1,307 @@
+"""Maintenance of the access log: partitions and usage rollups.
+
+The access log is partitioned by day. Partitions are named after the day they
+hold (`access_log_p20240131`) and are created ahead of time. Rows that don't
+fit into any of them end up in the `access_log_default` partition and are moved
+to the right partition when it gets created.
+
+Usage statistics are read from `access_log_hourly`, which holds the number of
+requests per token for every hour and is updated incrementally from the access
+log (and the log of issued signed URLs), so that they don't need to aggregate
+the whole access log. `token_usage_daily` holds the same counts per day and is
+updated from `access_log_hourly` at the same time.
+"""
+from datetime import datetime, time, timedelta
+from metabrainz import db
+import sqlalchemy
+import pytz
+import io
+import re
+
+PARTITION_NAME_FORMAT = "access_log_p%Y%m%d"
+PARTITION_NAME_PATTERN = re.compile(r"^access_log_p[0-9]{8}$")
+UPPER_BOUND_PATTERN = re.compile(r"TO \('([^']+)'\)")
+
+# Rows are written to the access log in batches, so some of them can arrive
+# after the hourly usage has been updated past their hour.
+HOURLY_USAGE_LATE_ROWS_MARGIN = timedelta(hours=1)
+
+
+def partition_name(day):
+    return day.strftime(PARTITION_NAME_FORMAT)
+
+
+def _bound(day):
+    return datetime.combine(day, time.min, tzinfo=pytz.utc).isoformat()
+
+
+def _get_partition_bounds():
+    with db.engine.connect() as connection:
+        result = connection.execute(sqlalchemy.text("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+              FROM pg_inherits
+              JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+              JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+             WHERE parent.relname = 'access_log'
+        """))
+        return result.fetchall()
+
+
+def list_partitions():
+    """Returns list of (day, partition name) tuples for all daily partitions
+    currently attached to the access log, oldest first."""
+    names = [name for name, _ in _get_partition_bounds() if PARTITION_NAME_PATTERN.match(name)]
+    return sorted((datetime.strptime(name, PARTITION_NAME_FORMAT).date(), name) for name in names)
+
+
+def _covered_until():
+    """Returns the upper bound of partitions other than the daily and the
+    default ones (like the one created from the unpartitioned access log),
+    or None if there are no such partitions."""
+    bounds = []
+    for name, bound in _get_partition_bounds():
+        match = UPPER_BOUND_PATTERN.search(bound)
+        if match and not PARTITION_NAME_PATTERN.match(name):
+            bounds.append(datetime.fromisoformat(match.group(1)))
+    return max(bounds) if bounds else None
+
+
+def create_partitions(days_ahead=7, today=None):
+    """Creates daily partitions from today up to `days_ahead` days in the future.
+
+    Rows already stored in the default partition for these days are moved
+    into the new partitions.
+
+    Returns:
+        List of names of the created partitions.
+    """
+    today = today or datetime.now(pytz.utc).date()
+    existing = {name for _, name in list_partitions()}
+    covered_until = _covered_until()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        if name in existing:
+            continue
+        start, end = _bound(day), _bound(day + timedelta(days=1))
+        if covered_until and datetime.fromisoformat(end) <= covered_until:
+            continue
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "CREATE TABLE {name} (LIKE access_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(name=name)
+            ))
+            connection.execute(sqlalchemy.text("""
+                WITH moved AS (
+                    DELETE FROM access_log_default
+                          WHERE "timestamp" >= :start AND "timestamp" < :end
+                      RETURNING token, "timestamp", ip_address, bytes_sent, status
+                )
+                INSERT INTO {name} (token, "timestamp", ip_address, bytes_sent, status)
+                     SELECT token, "timestamp", ip_address, bytes_sent, status
+                       FROM moved
+            """.format(name=name)), {"start": start, "end": end})
+            connection.execute(sqlalchemy.text(
+                "ALTER TABLE access_log ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                    name=name, start=start, end=end)
+            ))
+        created.append(name)
+    return created
+
+
+def detach_partitions(older_than_days, drop=False, today=None):
+    """Detaches daily partitions that only hold rows older than `older_than_days`.
+
+    Detached partitions are kept as standalone tables (so that they can be
+    archived with pg_dump) unless `drop` is set.
+
+    Returns:
+        List of names of the detached partitions.
+    """
+    today = today or datetime.now(pytz.utc).date()
+    cutoff = today - timedelta(days=older_than_days)
+    detached = []
+    for day, name in list_partitions():
+        if day + timedelta(days=1) > cutoff:
+            break
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text("ALTER TABLE access_log DETACH PARTITION {name}".format(name=name)))
+            if drop:
+                connection.execute(sqlalchemy.text("DROP TABLE {name}".format(name=name)))
+        detached.append(name)
+    return detached
+
+
+def update_hourly_usage(since=None, full=False):
+    """Updates `access_log_hourly` from the access log, and
+    `token_usage_daily` from it.
+
+    Hours from the last one already in `access_log_hourly` (minus a margin
+    for records that were written late) are recalculated, so this only
+    reads the newest part of the access log. Days are recalculated starting
+    with the one that contains the first recalculated hour.
+
+    Args:
+        since: Recalculate hours starting from this time instead (datetime).
+        full: Recalculate usage from the whole access log.
+
+    Returns:
+        Start of the first hour that was recalculated or None if the
+        whole access log was processed.
+    """
+    with db.engine.begin() as connection:
+        if since is None and not full:
+            high_water_mark = connection.execute(sqlalchemy.text(
+                "SELECT max(hour) FROM access_log_hourly"
+            )).scalar()
+            if high_water_mark is not None:
+                since = high_water_mark - HOURLY_USAGE_LATE_ROWS_MARGIN
+        if since is not None:
+            since = connection.execute(sqlalchemy.text(
+                "SELECT date_trunc('hour', CAST(:since AS TIMESTAMP WITH TIME ZONE))"
+            ), {"since": since}).scalar()
+
+        connection.execute(sqlalchemy.text("""
+            DELETE FROM access_log_hourly
+            {where_clause}
+        """.format(where_clause="WHERE hour >= :since" if since else "")), {"since": since})
+        # Every URL in a batch of signed URLs counts as a request.
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO access_log_hourly (hour, token, supporter_id, request_count)
+                 SELECT usage.hour,
+                        usage.token,
+                        token.owner_id,
+                        sum(usage.request_count)
+                   FROM (
+                            SELECT date_trunc('hour', "timestamp") AS hour, token, count(*) AS request_count
+                              FROM access_log
+                            {where_clause}
+                          GROUP BY date_trunc('hour', "timestamp"), token
+                         UNION ALL
+                            SELECT date_trunc('hour', "timestamp") AS hour, token, sum(url_count) AS request_count
+                              FROM signed_url_log
+                            {where_clause}
+                          GROUP BY date_trunc('hour', "timestamp"), token
+                        ) usage
+                   JOIN token ON usage.token = token.value
+               GROUP BY usage.hour, usage.token, token.owner_id
+        """.format(where_clause='WHERE "timestamp" >= :since' if since else "")), {"since": since})
+
+        since_day = since.astimezone(pytz.utc).date() if since else None
+        connection.execute(sqlalchemy.text("""
+            DELETE FROM token_usage_daily
+            {where_clause}
+        """.format(where_clause="WHERE day >= :since_day" if since_day else "")), {"since_day": since_day})
+        connection.execute(sqlalchemy.text("""
+            INSERT INTO token_usage_daily (day, token, supporter_id, request_count)
+                 SELECT CAST(hour AT TIME ZONE 'UTC' AS DATE), token, max(supporter_id), sum(request_count)
+                   FROM access_log_hourly
+                 {where_clause}
+               GROUP BY CAST(hour AT TIME ZONE 'UTC' AS DATE), token
+        """.format(where_clause="WHERE hour >= :since_day_start" if since_day else "")), {
+            "since_day_start": datetime.combine(since_day, time.min, tzinfo=pytz.utc) if since_day else None,
+        })
+    return since
+
+
+def copy_records(records):
+    """Bulk-loads access log records with COPY.
+
+    Records are copied into a temporary table first and then inserted into the
+    access log, skipping records of tokens that don't exist and records that
+    are already there, so loading the same records again is harmless.
+
+    Args:
+        records: Iterable of (access token, timestamp, IP address, bytes sent,
+            status) tuples. Values must not contain tabs or newlines.
+
+    Returns:
+        Number of inserted records.
+    """
+    data = io.StringIO()
+    for access_token, timestamp, ip_address, bytes_sent, status in records:
+        data.write("%s\t%s\t%s\t%s\t%s\n" % (
+            access_token,
+            timestamp.isoformat(),
+            ip_address if ip_address else "\\N",
+            bytes_sent if bytes_sent is not None else "\\N",
+            status if status is not None else "\\N",
+        ))
+    data.seek(0)
+
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TEMPORARY TABLE access_log_import (LIKE access_log) ON COMMIT DROP")
+            cursor.copy_expert(
+                'COPY access_log_import (token, "timestamp", ip_address, bytes_sent, status) FROM STDIN',
+                data,
+            )
+            cursor.execute("""
+                INSERT INTO access_log (token, "timestamp", ip_address, bytes_sent, status)
+                     SELECT access_log_import.token,
+                            access_log_import."timestamp",
+                            access_log_import.ip_address,
+                            access_log_import.bytes_sent,
+                            access_log_import.status
+                       FROM access_log_import
+                       JOIN token ON access_log_import.token = token.value
+                ON CONFLICT DO NOTHING
+            """)
+            inserted = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+    return inserted
+
+
+def iter_records(start, end, supporter_id=None, access_token=None, order_by_time=False, batch_size=10000):
+    """Yields access log records from a time range, of a supporter or a token.
+
+    Records are read with a named (server-side) cursor, `batch_size` at a
+    time, so that exporting millions of them doesn't load them all into
+    memory. They are ordered by token and timestamp, which is the order of
+    the primary key of the access log, or only by timestamp.
+
+    Args:
+        start: Records at or after this time are included.
+        end: Records before this time are included.
+        supporter_id: ID of the supporter whose tokens were used.
+        access_token: Token that was used.
+        order_by_time: Whether records are ordered only by timestamp.
+
+    Yields:
+        (access token, timestamp, IP address, bytes sent, status) tuples.
+    """
+    conditions = ['access_log."timestamp" >= %(start)s', 'access_log."timestamp" < %(end)s']
+    if supporter_id is not None:
+        conditions.append("token.owner_id = %(supporter_id)s")
+    if access_token is not None:
+        conditions.append("access_log.token = %(access_token)s")
+    query = """
+        SELECT access_log.token, access_log."timestamp", access_log.ip_address,
+               access_log.bytes_sent, access_log.status
+          FROM access_log
+          JOIN token ON access_log.token = token.value
+         WHERE {conditions}
+      ORDER BY {order}
+    """.format(
+        conditions=" AND ".join(conditions),
+        order='access_log."timestamp"' if order_by_time else 'access_log.token, access_log."timestamp"',
+    )
+
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor(name="access_log_export") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, {
+                "start": start,
+                "end": end,
+                "supporter_id": supporter_id,
+                "access_token": access_token,
+            })
+            for row in cursor:
+                yield row
+        connection.rollback()
+    finally:
+        connection.close()
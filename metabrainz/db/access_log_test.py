@@ -0,0 +1,183 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz import db
+from metabrainz.db import access_log as db_access_log
+from metabrainz.model.token import Token
+from datetime import date, datetime, timedelta
+import sqlalchemy
+import pytz
+
+
+class AccessLogPartitionsTestCase(FlaskTestCase):
+
+    def _insert(self, token, timestamp):
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                'INSERT INTO access_log (token, "timestamp", ip_address) VALUES (:token, :timestamp, \'10.0.0.1\')'
+            ), {"token": token, "timestamp": timestamp})
+
+    def _partition_of(self, timestamp):
+        with db.engine.connect() as connection:
+            return connection.execute(sqlalchemy.text(
+                'SELECT tableoid::regclass::text FROM access_log WHERE "timestamp" = :timestamp'
+            ), {"timestamp": timestamp}).scalar()
+
+    def test_create_partitions(self):
+        token = Token.generate_token(owner_id=None)
+        today = date(2024, 1, 31)
+        timestamp = datetime(2024, 2, 1, 12, tzinfo=pytz.utc)
+        self._insert(token, timestamp)
+        self.assertEqual(self._partition_of(timestamp), "access_log_default")
+
+        created = db_access_log.create_partitions(days_ahead=2, today=today)
+        self.assertEqual(created, ["access_log_p20240131", "access_log_p20240201", "access_log_p20240202"])
+        self.assertEqual(self._partition_of(timestamp), "access_log_p20240201")
+        self.assertEqual(db_access_log.create_partitions(days_ahead=2, today=today), [])
+        self.assertEqual([p[0] for p in db_access_log.list_partitions()],
+                         [today, today + timedelta(days=1), today + timedelta(days=2)])
+
+    def test_detach_partitions(self):
+        db_access_log.create_partitions(days_ahead=2, today=date(2024, 1, 1))
+        detached = db_access_log.detach_partitions(older_than_days=1, today=date(2024, 1, 3))
+        self.assertEqual(detached, ["access_log_p20240101"])
+        self.assertEqual([p[1] for p in db_access_log.list_partitions()],
+                         ["access_log_p20240102", "access_log_p20240103"])
+
+        detached = db_access_log.detach_partitions(older_than_days=0, drop=True, today=date(2024, 1, 3))
+        self.assertEqual(detached, ["access_log_p20240102"])
+        with db.engine.connect() as connection:
+            self.assertIsNone(connection.execute(sqlalchemy.text(
+                "SELECT to_regclass('access_log_p20240102')"
+            )).scalar())
+            self.assertIsNotNone(connection.execute(sqlalchemy.text(
+                "SELECT to_regclass('access_log_p20240101')"
+            )).scalar())
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text("DROP TABLE access_log_p20240101"))
+
+
+class HourlyUsageTestCase(FlaskTestCase):
+
+    def _insert(self, token, *timestamps):
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                'INSERT INTO access_log (token, "timestamp") VALUES (:token, :timestamp)'
+            ), [{"token": token, "timestamp": timestamp} for timestamp in timestamps])
+
+    def _get_rollup(self):
+        with db.engine.connect() as connection:
+            return connection.execute(sqlalchemy.text(
+                "SELECT hour, token, request_count FROM access_log_hourly ORDER BY hour, token"
+            )).fetchall()
+
+    def test_update_hourly_usage(self):
+        token = Token.generate_token(owner_id=None)
+        hour = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        self._insert(token, hour, hour + timedelta(minutes=1), hour + timedelta(hours=3))
+
+        self.assertIsNone(db_access_log.update_hourly_usage())
+        self.assertEqual(self._get_rollup(), [
+            (hour, token, 2),
+            (hour + timedelta(hours=3), token, 1),
+        ])
+
+        # Only hours after the high-water mark (minus the margin) are recalculated
+        self._insert(token, hour + timedelta(minutes=2), hour + timedelta(hours=2), hour + timedelta(hours=3, minutes=1))
+        since = db_access_log.update_hourly_usage()
+        self.assertEqual(since, hour + timedelta(hours=2))
+        self.assertEqual(self._get_rollup(), [
+            (hour, token, 2),
+            (hour + timedelta(hours=2), token, 1),
+            (hour + timedelta(hours=3), token, 2),
+        ])
+
+        db_access_log.update_hourly_usage(full=True)
+        self.assertEqual(self._get_rollup()[0], (hour, token, 3))
+
+    def test_update_hourly_usage_signed_urls(self):
+        token = Token.generate_token(owner_id=None)
+        hour = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        self._insert(token, hour)
+        with db.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                'INSERT INTO signed_url_log (token, "timestamp", url_count) VALUES (:token, :timestamp, :count)'
+            ), [
+                {"token": token, "timestamp": hour + timedelta(minutes=1), "count": 24},
+                {"token": token, "timestamp": hour + timedelta(hours=1), "count": 5},
+            ])
+
+        db_access_log.update_hourly_usage()
+        self.assertEqual(self._get_rollup(), [
+            (hour, token, 25),
+            (hour + timedelta(hours=1), token, 5),
+        ])
+
+
+    def test_update_daily_usage(self):
+        token = Token.generate_token(owner_id=None)
+        day = datetime(2024, 1, 1, tzinfo=pytz.utc)
+        self._insert(token, day + timedelta(hours=1), day + timedelta(hours=23), day + timedelta(days=1, hours=2))
+        db_access_log.update_hourly_usage()
+
+        def get_daily():
+            with db.engine.connect() as connection:
+                return connection.execute(sqlalchemy.text(
+                    "SELECT day, token, request_count FROM token_usage_daily ORDER BY day, token"
+                )).fetchall()
+
+        self.assertEqual(get_daily(), [(day.date(), token, 2), (day.date() + timedelta(days=1), token, 1)])
+
+        # Days are recalculated from the start of the day of the first recalculated hour
+        self._insert(token, day + timedelta(days=1, hours=1), day + timedelta(days=1, hours=3))
+        self.assertEqual(db_access_log.update_hourly_usage(), day + timedelta(days=1, hours=1))
+        self.assertEqual(get_daily(), [(day.date(), token, 2), (day.date() + timedelta(days=1), token, 3)])
+
+
+class CopyRecordsTestCase(FlaskTestCase):
+
+    def test_copy_records(self):
+        token = Token.generate_token(owner_id=None)
+        timestamp = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        records = [
+            (token, timestamp, '10.0.0.1', 1000, 200),
+            (token, timestamp + timedelta(seconds=1), None, None, None),
+            ('unknown', timestamp, '10.0.0.1', 1000, 200),
+        ]
+        self.assertEqual(db_access_log.copy_records(records), 2)
+        self.assertEqual(db_access_log.copy_records(records), 0)
+        with db.engine.connect() as connection:
+            rows = connection.execute(sqlalchemy.text(
+                'SELECT token, "timestamp", ip_address, bytes_sent, status FROM access_log ORDER BY "timestamp"'
+            )).fetchall()
+        self.assertEqual(rows, [
+            (token, timestamp, '10.0.0.1', 1000, 200),
+            (token, timestamp + timedelta(seconds=1), None, None, None),
+        ])
+
+
+class IterRecordsTestCase(FlaskTestCase):
+
+    def test_iter_records(self):
+        supporter_token = Token.generate_token(owner_id=None)
+        other_token = Token.generate_token(owner_id=None)
+        timestamp = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        db_access_log.copy_records([
+            (supporter_token, timestamp, '10.0.0.1', 1000, 200),
+            (supporter_token, timestamp + timedelta(days=1), '10.0.0.2', None, None),
+            (supporter_token, timestamp + timedelta(days=2), '10.0.0.3', None, None),
+            (other_token, timestamp, '10.0.0.4', None, None),
+            (other_token, timestamp + timedelta(hours=36), '10.0.0.5', None, None),
+        ])
+
+        records = db_access_log.iter_records(timestamp, timestamp + timedelta(days=2),
+                                             access_token=supporter_token, batch_size=1)
+        self.assertEqual(list(records), [
+            (supporter_token, timestamp, '10.0.0.1', 1000, 200),
+            (supporter_token, timestamp + timedelta(days=1), '10.0.0.2', None, None),
+        ])
+        records = db_access_log.iter_records(timestamp, timestamp + timedelta(days=3), supporter_id=1)
+        self.assertEqual(list(records), [])
+
+        records = db_access_log.iter_records(timestamp + timedelta(hours=1), timestamp + timedelta(days=3),
+                                             order_by_time=True)
+        self.assertEqual([record[1] - timestamp for record in records],
+                         [timedelta(days=1), timedelta(hours=36), timedelta(days=2)])
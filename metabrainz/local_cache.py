@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LocalCache(object):
+    """Simple in-process LRU cache with a fixed time-to-live for each entry.
+
+    Useful for putting in front of Redis on hot paths. Every process (uWSGI
+    worker) has its own copy, so invalidations done in one process are only
+    picked up by other processes once their entries expire.
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        Args:
+            max_size: Maximum number of entries to keep.
+            ttl: Number of seconds an entry is kept for.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns cached value or None if it's missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,32 @@
+from unittest import TestCase, mock
+from metabrainz.local_cache import LocalCache
+
+
+class LocalCacheTestCase(TestCase):
+
+    def test_get_set(self):
+        local_cache = LocalCache(max_size=10, ttl=10)
+        self.assertIsNone(local_cache.get('a'))
+        local_cache.set('a', 1)
+        self.assertEqual(local_cache.get('a'), 1)
+        local_cache.delete('a')
+        self.assertIsNone(local_cache.get('a'))
+
+    def test_lru_eviction(self):
+        local_cache = LocalCache(max_size=2, ttl=10)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')
+        local_cache.set('c', 3)
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual(local_cache.get('c'), 3)
+
+    def test_expiration(self):
+        local_cache = LocalCache(max_size=10, ttl=10)
+        with mock.patch('time.monotonic', return_value=100):
+            local_cache.set('a', 1)
+        with mock.patch('time.monotonic', return_value=105):
+            self.assertEqual(local_cache.get('a'), 1)
+        with mock.patch('time.monotonic', return_value=111):
+            self.assertIsNone(local_cache.get('a'))
@@ -0,0 +1,323 @@
+"""Runtime metrics of the web apps in the Prometheus text format.
+
+Every process collects request counts, request latency histograms, database
+query counts and times, and Redis round trips per blueprint and endpoint in
+memory. Collected values are added to totals shared by all processes in a
+Redis hash at most every `METRICS_FLUSH_INTERVAL` seconds, so recording
+metrics doesn't cost a Redis round trip per request. The number of requests in
+progress is reported by each process separately and summed up when metrics
+are exposed on `/metrics`.
+
+`/metrics` is only available to addresses in `METRICS_ALLOWED_NETWORKS`
+(loopback by default), since scraping it writes to Redis. Failing to add
+values to Redis while handling a request is logged and doesn't fail the
+request, the values are added on the next flush instead.
+"""
+from metabrainz import raw_cache
+from collections import Counter
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import ipaddress
+import logging
+import redis
+import os
+import threading
+import time
+
+KEY_PREFIX = "metrics"
+
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+
+DEFAULT_ALLOWED_NETWORKS = ("127.0.0.0/8", "::1/128")
+
+# Processes that haven't reported for this many flush intervals are considered gone.
+STALE_PROCESS_INTERVALS = 6
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = (
+    ("http_requests_total", "counter", "Number of handled HTTP requests."),
+    ("http_request_duration_seconds", "histogram", "Time spent handling HTTP requests."),
+    ("http_requests_in_flight", "gauge", "Number of HTTP requests being handled."),
+    ("db_queries_total", "counter", "Number of database queries made while handling requests."),
+    ("db_query_duration_seconds_total", "counter", "Time spent on database queries while handling requests."),
+    ("redis_round_trips_total", "counter", "Number of Redis round trips made while handling requests."),
+    ("page_cache_warmed_files_total", "counter", "Number of new files loaded into the page cache by the warmer."),
+    ("page_cache_warmed_bytes_total", "counter", "Number of bytes loaded into the page cache by the warmer."),
+    ("page_cache_warm_duration_seconds_total", "counter", "Time the warmer spent loading files into the page cache."),
+    ("page_cache_evicted_files_total", "counter", "Number of files the warmer dropped from the page cache."),
+)
+
+_sqlalchemy_instrumented = False
+
+
+class _Registry(object):
+    """Metrics collected by one app in the current process."""
+
+    def __init__(self, app_name, flush_interval):
+        self.app_name = app_name
+        self.flush_interval = flush_interval
+        self.counters = Counter()
+        self.in_flight = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def key(self):
+        return raw_cache.key("%s:%s" % (KEY_PREFIX, self.app_name))
+
+    @property
+    def in_flight_key(self):
+        return raw_cache.key("%s:%s:in_flight" % (KEY_PREFIX, self.app_name))
+
+    def add(self, values):
+        with self.lock:
+            self.counters.update(values)
+
+    def flush(self, force=False):
+        """Adds collected values to the totals in Redis."""
+        with self.lock:
+            if not force and time.monotonic() - self.last_flush < self.flush_interval:
+                return
+            counters, self.counters = self.counters, Counter()
+            in_flight = self.in_flight
+            self.last_flush = time.monotonic()
+        try:
+            pipe = _original_pipeline(transaction=False)
+            for field, value in counters.items():
+                pipe.hincrbyfloat(self.key, field, value)
+            pipe.hset(self.in_flight_key, str(os.getpid()), "%s %s" % (in_flight, time.time()))
+            pipe.execute()
+        except redis.RedisError:
+            # Keeps the values for the next flush.
+            self.add(counters)
+            raise
+
+
+def _field(name, labels):
+    return "%s{%s}" % (name, ",".join('%s="%s"' % (key, _escape(value)) for key, value in labels))
+
+
+def _labels_field(name, labels):
+    return _field(name, tuple(sorted(labels.items()))) if labels else name
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _before_request():
+    g._metrics = {"start": time.perf_counter(), "db_queries": 0, "db_time": 0.0, "redis": 0, "status": 500}
+    registry = _get_registry()
+    with registry.lock:
+        registry.in_flight += 1
+
+
+def _after_request(response):
+    if "_metrics" in g:
+        g._metrics["status"] = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    metrics = g.pop("_metrics", None)
+    if metrics is None:
+        return
+    duration = time.perf_counter() - metrics["start"]
+    endpoint = request.url_rule.endpoint if request.url_rule else "unmatched"
+    labels = (("blueprint", request.blueprint or ""), ("endpoint", endpoint))
+
+    values = Counter()
+    values[_field("http_requests_total", labels + (("method", request.method), ("status", metrics["status"])))] += 1
+    for le in LATENCY_BUCKETS:
+        # Buckets are cumulative and all of them have to be present.
+        values[_field("http_request_duration_seconds_bucket", labels + (("le", repr(float(le))),))] += \
+            1 if duration <= le else 0
+    values[_field("http_request_duration_seconds_bucket", labels + (("le", "+Inf"),))] += 1
+    values[_field("http_request_duration_seconds_sum", labels)] += duration
+    values[_field("http_request_duration_seconds_count", labels)] += 1
+    if metrics["db_queries"]:
+        values[_field("db_queries_total", labels)] += metrics["db_queries"]
+        values[_field("db_query_duration_seconds_total", labels)] += metrics["db_time"]
+    if metrics["redis"]:
+        values[_field("redis_round_trips_total", labels)] += metrics["redis"]
+
+    registry = _get_registry()
+    with registry.lock:
+        registry.in_flight -= 1
+    registry.add(values)
+    try:
+        registry.flush()
+    except redis.RedisError as e:
+        logging.warning("Failed to add metrics to Redis: %s", e)
+
+
+def _get_registry():
+    return current_app.extensions["metrics"]
+
+
+def increment(name, value=1, **labels):
+    """Adds to a counter outside of request handling, e.g. in background processes.
+
+    Must be called within an application context. Values are added to the
+    totals in Redis along with the other metrics of the process.
+    """
+    registry = _get_registry()
+    registry.add({_labels_field(name, labels): value})
+    registry.flush()
+
+
+def flush():
+    """Adds values collected by the current process to the totals in Redis if
+    `METRICS_FLUSH_INTERVAL` has passed since they were last added.
+
+    Background processes should call this periodically, so that the last
+    values they collect don't wait for the next `increment`.
+    """
+    _get_registry().flush()
+
+
+def _current_request_metrics():
+    if has_request_context():
+        return g.get("_metrics")
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("metrics_query_start", None)
+    metrics = _current_request_metrics()
+    if metrics is not None and start is not None:
+        metrics["db_queries"] += 1
+        metrics["db_time"] += time.perf_counter() - start
+
+
+def _count_redis_round_trip():
+    metrics = _current_request_metrics()
+    if metrics is not None:
+        metrics["redis"] += 1
+
+
+def _original_pipeline(transaction=True):
+    """Creates a Redis pipeline that isn't counted in request metrics."""
+    connection = raw_cache.connection()
+    return getattr(connection, "_metrics_original_pipeline", connection.pipeline)(transaction=transaction)
+
+
+def _instrument_redis(client):
+    """Counts commands and executed pipelines of a Redis client as round trips."""
+    if hasattr(client, "_metrics_original_pipeline"):
+        return
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def counted_execute_command(*args, **kwargs):
+        _count_redis_round_trip()
+        return execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            _count_redis_round_trip()
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    client._metrics_original_pipeline = pipeline
+    client.execute_command = counted_execute_command
+    client.pipeline = counted_pipeline
+
+
+def _instrument_sqlalchemy():
+    global _sqlalchemy_instrumented
+    if not _sqlalchemy_instrumented:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _sqlalchemy_instrumented = True
+
+
+def _sort_key(sample):
+    """Orders samples by their labels and histogram buckets by their upper bound."""
+    field = sample[0]
+    if ',le="' not in field:
+        return field, 0
+    labels, le = field.rsplit(',le="', 1)
+    le = le[:-len('"}')]
+    return labels, float("inf") if le == "+Inf" else float(le)
+
+
+def render(registry):
+    """Returns metrics of all processes of an app in the Prometheus text format."""
+    registry.flush(force=True)
+    totals = raw_cache.connection().hgetall(registry.key)
+    processes = raw_cache.connection().hgetall(registry.in_flight_key)
+
+    in_flight, stale = 0, []
+    now = time.time()
+    for pid, value in processes.items():
+        count, updated = value.decode().split()
+        if now - float(updated) > registry.flush_interval * STALE_PROCESS_INTERVALS:
+            stale.append(pid)
+        else:
+            in_flight += int(count)
+    if stale:
+        raw_cache.connection().hdel(registry.in_flight_key, *stale)
+
+    samples = {}
+    for field, value in totals.items():
+        field = field.decode()
+        samples.setdefault(field.split("{", 1)[0], []).append((field, float(value)))
+    samples["http_requests_in_flight"] = [("http_requests_in_flight", in_flight)]
+
+    lines = []
+    for name, metric_type, description in METRICS:
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        names = [name + suffix for suffix in ("_bucket", "_sum", "_count")] if metric_type == "histogram" else [name]
+        for sample_name in names:
+            for field, value in sorted(samples.get(sample_name, []), key=_sort_key):
+                lines.append("%s %s" % (field, _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def _is_allowed(ip_address, networks):
+    try:
+        address = ipaddress.ip_address(ip_address or "")
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def init_app(app):
+    """Sets up collection of metrics for an app and adds the `/metrics` endpoint.
+
+    Redis must already be initialized.
+    """
+    app.extensions["metrics"] = _Registry(
+        app_name=app.import_name,
+        flush_interval=app.config.get("METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL),
+    )
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    _instrument_sqlalchemy()
+    _instrument_redis(raw_cache.connection())
+    allowed_networks = [ipaddress.ip_network(network) for network in
+                        app.config.get("METRICS_ALLOWED_NETWORKS", DEFAULT_ALLOWED_NETWORKS)]
+
+    @app.route("/metrics")
+    def metrics():
+        if not _is_allowed(request.remote_addr, allowed_networks):
+            return Response("Metrics are only available from the internal network.\n", status=403)
+        return Response(render(app.extensions["metrics"]), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,64 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.model.token import Token
+from metabrainz import metrics
+from metabrainz import raw_cache
+from flask import url_for
+from unittest import mock
+import ipaddress
+import redis
+
+
+class MetricsTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.registry = self.app.extensions["metrics"]
+        self.registry.flush(force=True)
+        raw_cache.connection().delete(self.registry.key, self.registry.in_flight_key)
+
+    def _samples(self):
+        samples = {}
+        for line in self.client.get("/metrics").data.decode().splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_metrics(self):
+        token = Token.generate_token(owner_id=None)
+        self.client.get(url_for("api_musicbrainz.replication_info", token=token))
+        self.client.get(url_for("api_musicbrainz.replication_info", token=token))
+        self.client.get("/nonexistent")
+
+        samples = self._samples()
+        labels = 'blueprint="api_musicbrainz",endpoint="api_musicbrainz.replication_info"'
+        self.assertEqual(samples['http_requests_total{%s,method="GET",status="200"}' % labels], 2)
+        self.assertEqual(samples['http_requests_total{blueprint="",endpoint="unmatched",method="GET",status="404"}'], 1)
+        self.assertEqual(samples['http_request_duration_seconds_count{%s}' % labels], 2)
+        self.assertEqual(samples['http_request_duration_seconds_bucket{%s,le="+Inf"}' % labels], 2)
+        for le in metrics.LATENCY_BUCKETS:
+            self.assertIn('http_request_duration_seconds_bucket{%s,le="%r"}' % (labels, float(le)), samples)
+        # The first request checks the token in the database.
+        self.assertGreaterEqual(samples['db_queries_total{%s}' % labels], 1)
+        self.assertGreaterEqual(samples['redis_round_trips_total{%s}' % labels], 2)
+        # The request to /metrics itself is in progress.
+        self.assertEqual(samples['http_requests_in_flight'], 1)
+
+    def test_metrics_allowed_networks(self):
+        self.assert403(self.client.get("/metrics", environ_base={"REMOTE_ADDR": "10.1.2.3"}))
+        self.assert200(self.client.get("/metrics", environ_base={"REMOTE_ADDR": "::1"}))
+        self.assertFalse(metrics._is_allowed(None, [ipaddress.ip_network("127.0.0.0/8")]))
+
+    def test_redis_failure(self):
+        token = Token.generate_token(owner_id=None)
+        with mock.patch.object(metrics, "_original_pipeline", side_effect=redis.ConnectionError("down")):
+            resp = self.client.get(url_for("api_musicbrainz.replication_info", token=token))
+            self.registry.last_flush = 0
+            self.assert200(self.client.get(url_for("api_musicbrainz.replication_info", token=token)))
+        self.assert200(resp)
+        # Values that couldn't be added are added on the next flush.
+        labels = 'blueprint="api_musicbrainz",endpoint="api_musicbrainz.replication_info"'
+        self.assertEqual(self._samples()['http_requests_total{%s,method="GET",status="200"}' % labels], 2)
+
+    def test_escape(self):
+        self.assertEqual(metrics._field("x", (("a", 'quote " and \\ slash'),)), 'x{a="quote \\" and \\\\ slash"}')
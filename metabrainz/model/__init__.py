@@ -7,6 +7,7 @@ from .supporter import Supporter
 from .token import Token
 from .token_log import TokenLog
 from .access_log import AccessLog
+from .signed_url_log import SignedURLLog
 from .tier import Tier
 from .payment import Payment
 from .dataset import Dataset
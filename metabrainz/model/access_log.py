@@ -1,40 +1,38 @@
 from metabrainz.model import db
-from metabrainz.model.token import Token
 from metabrainz.model.supporter import Supporter
-from brainzutils.mail import send_mail
-from brainzutils import cache
-from sqlalchemy import func, text
+from sqlalchemy import text
 from sqlalchemy.dialects import postgresql
 from datetime import datetime, timedelta
-from flask import current_app
-import logging
 import pytz
 
 CLEANUP_RANGE_MINUTES = 60
-DIFFERENT_IP_LIMIT = 50
+CLEANUP_LOOKBACK_HOURS = 24
+
+
+def _last_day_start():
+    """Returns start of the earliest hour of the last 24 hours, counting the current one."""
+    return datetime.now(pytz.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)
 
 
 class AccessLog(db.Model):
     """Access log is used for tracking requests to the API.
 
     Each request needs to be logged. Logging is done to keep track of number of
-    requests in a fixed time frame. If there is an unusual number of requests
-    being made from different IP addresses in this time frame, action is taken.
-    See implementation of this model for more details.
+    requests in a fixed time frame. Unusual use of tokens is detected from the
+    log by a separate process, see `metabrainz.abuse_detection`.
     """
     __tablename__ = 'access_log'
 
     token = db.Column(db.String, db.ForeignKey('token.value'), primary_key=True)
     timestamp = db.Column(db.DateTime(timezone=True), primary_key=True, default=datetime.utcnow)
     ip_address = db.Column(postgresql.INET)
+    bytes_sent = db.Column(db.BigInteger)
+    status = db.Column(db.SmallInteger)
 
     @classmethod
     def create_record(cls, access_token, ip_address):
         """Creates new access log record with a current timestamp.
 
-        It also checks if `DIFFERENT_IP_LIMIT` is exceeded within current time
-        and `CLEANUP_RANGE_MINUTES`, alerts admins if that's the case.
-
         Args:
             access_token: Access token used to access the API.
             ip_address: IP access used to access the API.
@@ -48,49 +46,46 @@ class AccessLog(db.Model):
         )
         db.session.add(new_record)
         db.session.commit()
+        return new_record
 
-        # Checking if HOURLY_ALERT_THRESHOLD is exceeded
-        count = cls.query \
-            .distinct(cls.ip_address) \
-            .filter(cls.timestamp > datetime.now(pytz.utc) - timedelta(minutes=CLEANUP_RANGE_MINUTES),
-                    cls.token == access_token) \
-            .count()
-        if count > DIFFERENT_IP_LIMIT:
-            email = db.session \
-                .query(Supporter.contact_email) \
-                .join(Token) \
-                .filter(Token.value == access_token) \
-                .first()
-            msg = ("Hourly access threshold exceeded for token %s\n\n"
-                   "The supporter associated with the token can be contacted at %s\n\n"
-                   "This token has been used from %s different IP "
-                   "addresses during the last %s minutes.") % \
-                  (access_token, email, count, CLEANUP_RANGE_MINUTES)
-            logging.info(msg)
-            # Checking if notification for admins about this token abuse has
-            # been sent in the last hour. This info is kept in cache.
-            key = "alert_sent_%s" % access_token
-            if not cache.get(key):
-                send_mail(
-                    subject="[MetaBrainz] Hourly access threshold exceeded",
-                    recipients=current_app.config['NOTIFICATION_RECIPIENTS'],
-                    text=msg,
-                )
-                cache.set(key, True, 3600)  # 1 hour
+    @classmethod
+    def create_records(cls, records):
+        """Creates multiple access log records using a single multi-row INSERT.
 
-        return new_record
+        Args:
+            records: List of (access token, timestamp, IP address) tuples.
+        """
+        if not records:
+            return
+        db.session.execute(
+            postgresql.insert(cls.__table__).on_conflict_do_nothing(),
+            [{"token": token, "timestamp": timestamp, "ip_address": ip_address}
+             for token, timestamp, ip_address in records],
+        )
+        db.session.commit()
 
     @classmethod
-    def remove_old_ip_addr_records(cls):
-        cls.query. \
-            filter(cls.timestamp < datetime.now(pytz.utc) - timedelta(minutes=CLEANUP_RANGE_MINUTES)). \
-            update({cls.ip_address: None})
+    def remove_old_ip_addr_records(cls, full=False):
+        """Removes IP addresses from records older than `CLEANUP_RANGE_MINUTES`.
+
+        Unless `full` is set, only records from `CLEANUP_LOOKBACK_HOURS` before
+        that are checked. Older ones have been cleaned up by earlier runs, so
+        this only touches the newest partitions of the access log.
+        """
+        cutoff = datetime.now(pytz.utc) - timedelta(minutes=CLEANUP_RANGE_MINUTES)
+        query = cls.query.filter(cls.timestamp < cutoff, cls.ip_address != None)
+        if not full:
+            query = query.filter(cls.timestamp >= cutoff - timedelta(hours=CLEANUP_LOOKBACK_HOURS))
+        query.update({cls.ip_address: None}, synchronize_session=False)
         db.session.commit()
 
     @classmethod
     def get_hourly_usage(cls, supporter_id=None):
         """Get information about API usage.
 
+        Usage is read from the `access_log_hourly` rollup, which is updated
+        by `manage.py update-hourly-usage`.
+
         Args:
             supporter_id: Supporter ID that can be specified to get stats only for that account.
 
@@ -99,60 +94,140 @@ class AccessLog(db.Model):
         """
         if not supporter_id:
             rows = db.engine.execute(
-                'SELECT max("timestamp") as ts, count(*) '
-                'FROM access_log '
-                'GROUP BY extract(year from "timestamp"), extract(month from "timestamp"), '
-                '         extract(day from "timestamp"), trunc(extract(hour from "timestamp")) '
-                'ORDER BY ts'
+                'SELECT hour, sum(request_count) '
+                'FROM access_log_hourly '
+                'GROUP BY hour '
+                'ORDER BY hour'
+            )
+        else:
+            rows = db.engine.execute(
+                'SELECT hour, sum(request_count) '
+                'FROM access_log_hourly '
+                'WHERE supporter_id = %s '
+                'GROUP BY hour '
+                'ORDER BY hour',
+                (supporter_id,)
+            )
+        return [(r[0].replace(tzinfo=None), r[1]) for r in rows]
+
+    @classmethod
+    def get_daily_usage(cls, supporter_id=None):
+        """Get information about API usage per day.
+
+        Usage is read from the `token_usage_daily` rollup, which is updated
+        together with the hourly one.
+
+        Args:
+            supporter_id: Supporter ID that can be specified to get stats only for that account.
+
+        Returns:
+            List of <date, request count> tuples for every day.
+        """
+        if not supporter_id:
+            rows = db.engine.execute(
+                'SELECT day, sum(request_count) '
+                'FROM token_usage_daily '
+                'GROUP BY day '
+                'ORDER BY day'
             )
         else:
             rows = db.engine.execute(
-                'SELECT max(access_log."timestamp") as ts, count(access_log.*) '
-                'FROM access_log '
-                'JOIN token ON access_log.token = token.value '
-                'JOIN supporter ON token.owner_id = supporter.id '
-                'WHERE supporter.id = %s '
-                'GROUP BY extract(year from "timestamp"), extract(month from "timestamp"), '
-                '         extract(day from "timestamp"), trunc(extract(hour from "timestamp")) '
-                'ORDER BY ts',
+                'SELECT day, sum(request_count) '
+                'FROM token_usage_daily '
+                'WHERE supporter_id = %s '
+                'GROUP BY day '
+                'ORDER BY day',
                 (supporter_id,)
             )
-        return [(
-            r[0].replace(
-                minute=0,
-                second=0,
-                microsecond=0,
-                tzinfo=None,
-            ),
-            r[1]
-        ) for r in rows]
+        return [(r[0], r[1]) for r in rows]
 
     @classmethod
     def active_supporter_count(cls):
         """Returns number of different supporters whose access has been logged in
         the last 24 hours.
+
+        It's counted from the `access_log_hourly` rollup, so requests made
+        after it was last updated are not included.
         """
-        return cls.query.join(Token).join(Supporter) \
-            .filter(cls.timestamp > datetime.now() - timedelta(days=1)) \
-            .distinct(Supporter.id).count()
+        return db.session.execute(text("""
+            SELECT count(DISTINCT supporter_id)
+              FROM access_log_hourly
+             WHERE hour >= :since
+        """), {"since": _last_day_start()}).scalar()
 
     @classmethod
     def top_downloaders(cls, limit=None):
         """Generates list of most active supporters in the last 24 hours.
 
+        Request counts are read from the `access_log_hourly` rollup, so
+        requests made after it was last updated are not included.
+
         Args:
             limit: Max number of items to return.
 
         Returns:
             List of <Supporter, request count> pairs
         """
-        query = db.session.query(Supporter).join(Token).join(AccessLog) \
-            .filter(cls.timestamp > datetime.now() - timedelta(days=1)) \
-            .add_columns(func.count("AccessLog.*").label("count")).group_by(Supporter.id) \
-            .order_by(text("count DESC"))
-        if limit:
-            query = query.limit(limit)
-        return query.all()
+        rows = db.session.execute(text("""
+              SELECT supporter_id, sum(request_count) AS count
+                FROM access_log_hourly
+               WHERE hour >= :since
+                 AND supporter_id IS NOT NULL
+            GROUP BY supporter_id
+            ORDER BY count DESC
+            {limit_clause}
+        """.format(limit_clause="LIMIT :limit" if limit else "")), {
+            "since": _last_day_start(),
+            "limit": limit,
+        }).fetchall()
+        supporters = Supporter.query.filter(Supporter.id.in_([row[0] for row in rows])).all()
+        supporters = {supporter.id: supporter for supporter in supporters}
+        return [(supporters[row[0]], row[1]) for row in rows if row[0] in supporters]
+
+    @classmethod
+    def _top_usage(cls, group_by, columns, days, limit):
+        """Counts requests in the last days grouped by `group_by` columns of
+        the access log, in one pass for commercial supporters and for
+        non-commercial supporters who are not in good standing.
+
+        Rows are ranked separately for both kinds of supporters, so `limit`
+        applies to each of the returned lists.
+
+        Returns:
+            Tuple of (non_commercial, commercial) lists of rows with `columns`
+            (of the counts joined with the supporter table) and the count.
+        """
+        query = """
+            WITH counts AS (
+                SELECT {group_by}, supporter.id AS supporter_id, supporter.is_commercial, count(*) AS count
+                  FROM access_log
+                  JOIN token ON access_log.token = token.value
+                  JOIN supporter ON token.owner_id = supporter.id
+                 WHERE access_log.timestamp > :since
+                   AND (supporter.is_commercial OR supporter.good_standing != TRUE)
+              GROUP BY {group_by}, supporter.id
+            ), ranked AS (
+                SELECT counts.*, row_number() OVER (PARTITION BY is_commercial ORDER BY count DESC) AS rank
+                  FROM counts
+            )
+            SELECT ranked.is_commercial, {columns}, ranked.count
+              FROM ranked
+              JOIN supporter ON ranked.supporter_id = supporter.id
+             {where}
+          ORDER BY ranked.is_commercial, ranked.count DESC
+        """.format(
+            group_by=", ".join("access_log.%s" % column for column in group_by),
+            columns=", ".join(columns),
+            where="WHERE ranked.rank <= :limit" if limit else "",
+        )
+        rows = db.session.execute(text(query), {
+            "since": datetime.now(pytz.utc) - timedelta(days=days),
+            "limit": limit,
+        })
+        non_commercial, commercial = [], []
+        for row in rows:
+            (commercial if row[0] else non_commercial).append(tuple(row[1:]))
+        return non_commercial, commercial
 
     @classmethod
     def top_ips(cls, days=7, limit=None):
@@ -167,44 +242,16 @@ class AccessLog(db.Model):
             limit: Max number of items to return.
 
         Returns:
-            Tuple of (non_commercial, commercial) lists of [ip_address, token, musicbrainz_id, supporter_id, contact_name, contact_email]
+            Tuple of (non_commercial, commercial) lists of [ip_address, token, musicbrainz_id, supporter_id, contact_name, contact_email, data_usage_desc, count]
 
         """
-        query = db.session.query(AccessLog) \
-                          .select_from(AccessLog) \
-                          .join(Token) \
-                          .join(Supporter) \
-                          .with_entities(AccessLog.ip_address, AccessLog.token, Supporter.musicbrainz_id, Supporter.id, \
-                                         Supporter.contact_name, Supporter.contact_email, Supporter.data_usage_desc) \
-                          .filter(Supporter.is_commercial == False) \
-                          .filter(cls.timestamp > datetime.now() - timedelta(days=days)) \
-                          .filter(Supporter.good_standing != True) \
-                          .add_columns(func.count("AccessLog.*").label("count")) \
-                          .group_by(AccessLog.ip_address, AccessLog.token, Supporter.musicbrainz_id, Supporter.id, \
-                                    Supporter.contact_name, Supporter.contact_email, Supporter.data_usage_desc) \
-                          .order_by(text("count DESC"))
-        if limit:
-            query = query.limit(limit)
-        non_commercial = query.all()
-
-        query = db.session.query(AccessLog) \
-                          .select_from(AccessLog) \
-                          .join(Token) \
-                          .join(Supporter) \
-                          .with_entities(AccessLog.ip_address, AccessLog.token, Supporter.musicbrainz_id, Supporter.id,
-                                         Supporter.contact_name, Supporter.contact_email, Supporter.data_usage_desc) \
-                          .filter(Supporter.is_commercial == True) \
-                          .filter(cls.timestamp > datetime.now() - timedelta(days=days)) \
-                          .add_columns(func.count("AccessLog.*").label("count")) \
-                          .group_by(AccessLog.ip_address, AccessLog.token, Supporter.musicbrainz_id, Supporter.id,
-                                    Supporter.contact_name, Supporter.contact_email, Supporter.data_usage_desc) \
-                          .order_by(text("count DESC"))
-        if limit:
-            query = query.limit(limit)
-        commercial = query.all()
-
-        return (non_commercial, commercial)
-
+        return cls._top_usage(
+            group_by=["ip_address", "token"],
+            columns=["ranked.ip_address", "ranked.token", "supporter.musicbrainz_id", "supporter.id",
+                     "supporter.contact_name", "supporter.contact_email", "supporter.data_usage_desc"],
+            days=days,
+            limit=limit,
+        )
 
     @classmethod
     def top_tokens(cls, days=7, limit=None):
@@ -219,35 +266,13 @@ class AccessLog(db.Model):
             limit: Max number of items to return.
 
         Returns:
-            Tuple of (non_commercial, commercial) lists of [token, musicbrainz_id, supporter_id, contact_name, contact_email]
+            Tuple of (non_commercial, commercial) lists of [token, musicbrainz_id, supporter_id, contact_name, contact_email, count]
 
         """
-        query = db.session.query(AccessLog) \
-                          .select_from(AccessLog) \
-                          .join(Token).join(Supporter) \
-                          .with_entities(AccessLog.token, Supporter.musicbrainz_id, Supporter.id, Supporter.contact_name, \
-                                         Supporter.contact_email) \
-                          .filter(Supporter.is_commercial == False) \
-                          .filter(cls.timestamp > datetime.now() - timedelta(days=days)) \
-                          .filter(Supporter.good_standing != True) \
-                          .add_columns(func.count("AccessLog.*").label("count")) \
-                          .group_by(AccessLog.token, Supporter.musicbrainz_id, Supporter.id, Supporter.contact_name, Supporter.contact_email) \
-                          .order_by(text("count DESC"))
-        if limit:
-            query = query.limit(limit)
-        non_commercial = query.all()
-
-        query = db.session.query(AccessLog) \
-                          .select_from(AccessLog) \
-                          .join(Token).join(Supporter) \
-                          .with_entities(AccessLog.token, Supporter.musicbrainz_id, Supporter.id, Supporter.contact_name, Supporter.contact_email) \
-                          .filter(Supporter.is_commercial == True) \
-                          .filter(cls.timestamp > datetime.now() - timedelta(days=days)) \
-                          .add_columns(func.count("AccessLog.*").label("count")) \
-                          .group_by(AccessLog.token, Supporter.musicbrainz_id, Supporter.id, Supporter.contact_name, Supporter.contact_email) \
-                          .order_by(text("count DESC"))
-        if limit:
-            query = query.limit(limit)
-        commercial = query.all()
-
-        return (non_commercial, commercial)
+        return cls._top_usage(
+            group_by=["token"],
+            columns=["ranked.token", "supporter.musicbrainz_id", "supporter.id",
+                     "supporter.contact_name", "supporter.contact_email"],
+            days=days,
+            limit=limit,
+        )
@@ -1,8 +1,11 @@
 from metabrainz.testing import FlaskTestCase
 from metabrainz.model import AccessLog, db, Supporter
 from metabrainz.model.supporter import STATE_ACTIVE
+from metabrainz.db import access_log as db_access_log
 from flask import current_app
+from datetime import datetime, timedelta
 import copy
+import pytz
 
 
 class AccessLogTestCase(FlaskTestCase):
@@ -59,3 +62,107 @@ class AccessLogTestCase(FlaskTestCase):
         # Check that we have the right number of counts
         self.assertEqual(non_commercial[0][5], 2)
         self.assertEqual(commercial[0][5], 1)
+
+    def test_top_tokens_limit(self):
+        tokens = []
+        for i, is_commercial in enumerate((False, False, True, True)):
+            supporter = Supporter.add(is_commercial=is_commercial,
+                                      musicbrainz_id="mb_test_%s" % i,
+                                      musicbrainz_row_id=10 + i,
+                                      contact_name="Mr. Test",
+                                      contact_email="test%s@musicbrainz.org" % i,
+                                      data_usage_desc="poop!",
+                                      org_desc="foo!",
+                                      )
+            supporter.set_state(STATE_ACTIVE)
+            token = supporter.generate_token()
+            for _ in range(i % 2 + 1):
+                AccessLog.create_record(token, "10.1.1.%s" % i)
+            tokens.append(token)
+
+        non_commercial, commercial = AccessLog.top_tokens(limit=1)
+        self.assertEqual([row[0] for row in non_commercial], [tokens[1]])
+        self.assertEqual([row[0] for row in commercial], [tokens[3]])
+
+        non_commercial, commercial = AccessLog.top_tokens()
+        self.assertEqual([row[0] for row in non_commercial], [tokens[1], tokens[0]])
+        self.assertEqual([row[0] for row in commercial], [tokens[3], tokens[2]])
+
+    def test_overview_stats(self):
+        supporters = []
+        for i in range(2):
+            supporter = Supporter.add(is_commercial=False,
+                                      musicbrainz_id="mb_test_%s" % i,
+                                      musicbrainz_row_id=20 + i,
+                                      contact_name="Mr. Test",
+                                      contact_email="test%s@musicbrainz.org" % i,
+                                      data_usage_desc="poop!",
+                                      org_desc="foo!",
+                                      )
+            supporter.set_state(STATE_ACTIVE)
+            token = supporter.generate_token()
+            now = datetime.now(pytz.utc)
+            for minutes in range(i + 1):
+                db.session.add(AccessLog(token=token, timestamp=now - timedelta(minutes=minutes), ip_address="10.1.1.1"))
+            db.session.add(AccessLog(token=token, timestamp=now - timedelta(days=2), ip_address="10.1.1.1"))
+            supporters.append(supporter)
+        db.session.commit()
+
+        # Counts are read from the rollups
+        self.assertEqual(AccessLog.active_supporter_count(), 0)
+        db_access_log.update_hourly_usage()
+        self.assertEqual(AccessLog.active_supporter_count(), 2)
+        self.assertEqual(AccessLog.top_downloaders(), [(supporters[1], 2), (supporters[0], 1)])
+        self.assertEqual(AccessLog.top_downloaders(1), [(supporters[1], 2)])
+
+        usage = AccessLog.get_daily_usage(supporter_id=supporters[1].id)
+        self.assertEqual([day for day, _ in usage][-1], datetime.now(pytz.utc).date())
+        self.assertEqual(sum(count for _, count in usage), 3)
+        self.assertEqual(sum(count for _, count in AccessLog.get_daily_usage()), 5)
+
+    def test_remove_old_ip_addr_records(self):
+        supporter = Supporter.add(is_commercial=False,
+                                  musicbrainz_id="mb_test",
+                                  musicbrainz_row_id=1,
+                                  contact_name="Mr. Test",
+                                  contact_email="test@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!",
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        token = supporter.generate_token()
+        now = datetime.now(pytz.utc)
+        for age in (timedelta(minutes=1), timedelta(hours=2), timedelta(days=3)):
+            db.session.add(AccessLog(token=token, timestamp=now - age, ip_address="10.1.1.1"))
+        db.session.commit()
+
+        AccessLog.remove_old_ip_addr_records()
+        ips = [r.ip_address for r in AccessLog.query.order_by(AccessLog.timestamp.desc())]
+        self.assertEqual(ips, ["10.1.1.1", None, "10.1.1.1"])
+
+        AccessLog.remove_old_ip_addr_records(full=True)
+        ips = [r.ip_address for r in AccessLog.query.order_by(AccessLog.timestamp.desc())]
+        self.assertEqual(ips, ["10.1.1.1", None, None])
+
+    def test_get_hourly_usage(self):
+        supporter = Supporter.add(is_commercial=False,
+                                  musicbrainz_id="mb_test",
+                                  musicbrainz_row_id=1,
+                                  contact_name="Mr. Test",
+                                  contact_email="test@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!",
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        token = supporter.generate_token()
+        hour = datetime(2024, 1, 1, 10, tzinfo=pytz.utc)
+        for minute in (1, 2):
+            db.session.add(AccessLog(token=token, timestamp=hour + timedelta(minutes=minute), ip_address="10.1.1.1"))
+        db.session.commit()
+        db_access_log.update_hourly_usage()
+
+        usage = AccessLog.get_hourly_usage(supporter_id=supporter.id)
+        self.assertEqual(len(usage), 1)
+        self.assertEqual(usage[0][1], 2)
+        self.assertEqual(AccessLog.get_hourly_usage(supporter_id=supporter.id + 1), [])
+        self.assertEqual([u[1] for u in AccessLog.get_hourly_usage()], [2])
@@ -0,0 +1,28 @@
+from metabrainz.model import db
+from datetime import datetime
+import pytz
+
+
+class SignedURLLog(db.Model):
+    """Log of signed download URLs issued to access tokens.
+
+    Files downloaded through signed URLs are served without going through the
+    API, so they can't be logged in the access log. Instead, the number of URLs
+    in every issued batch is recorded here and counted in the hourly usage (see
+    `metabrainz.db.access_log.update_hourly_usage`).
+    """
+    __tablename__ = 'signed_url_log'
+
+    token = db.Column(db.String, db.ForeignKey('token.value'), primary_key=True)
+    timestamp = db.Column(db.DateTime(timezone=True), primary_key=True, default=lambda: datetime.now(pytz.utc))
+    url_count = db.Column(db.Integer, nullable=False)
+
+    @classmethod
+    def create_record(cls, access_token, url_count):
+        new_record = cls(
+            token=access_token,
+            url_count=url_count,
+        )
+        db.session.add(new_record)
+        db.session.commit()
+        return new_record
@@ -22,6 +22,11 @@ class Tier(db.Model):
     # that lists all available tiers.
     primary = db.Column(db.Boolean, nullable=False, default=False)
 
+    # Limits for API requests made with tokens of supporters in this tier (see
+    # metabrainz.api.rate_limit). Defaults are used if they are not set.
+    api_rate_limit = db.Column(db.Integer)  # requests per minute
+    api_rate_limit_burst = db.Column(db.Integer)
+
     supporters = db.relationship("Supporter", backref='tier', lazy="dynamic")
 
     def __str__(self):
@@ -36,6 +41,8 @@ class Tier(db.Model):
             price=kwargs.pop('price'),
             available=kwargs.pop('available', False),
             primary=kwargs.pop('primary', False),
+            api_rate_limit=kwargs.pop('api_rate_limit', None),
+            api_rate_limit_burst=kwargs.pop('api_rate_limit_burst', None),
         )
         db.session.add(new_tier)
         db.session.commit()
@@ -68,15 +75,20 @@ class TierAdminView(AdminModelView):
         long_desc='Long description',
         price='Monthly price',
         primary='Primary',
+        api_rate_limit='API rate limit',
+        api_rate_limit_burst='API burst limit',
     )
     column_descriptions = dict(
         price='USD',
         primary="Primary tiers are displayed first on tier selection pages.",
         available="Indicates if supporters can sign up to that tier on their own. "
                   "Tier will be hidden from the website if it's not available.",
+        api_rate_limit="Number of API requests per minute. Default limit is used if empty.",
+        api_rate_limit_burst="Number of API requests that can be made at once. Default limit is used if empty.",
     )
     column_list = ('id', 'name', 'price', 'primary', 'available',)
-    form_columns = ('name', 'price', 'short_desc', 'long_desc', 'primary', 'available',)
+    form_columns = ('name', 'price', 'short_desc', 'long_desc', 'primary', 'available',
+                    'api_rate_limit', 'api_rate_limit_burst',)
 
     def __init__(self, session, **kwargs):
         super(TierAdminView, self).__init__(Tier, session, name='Tiers', **kwargs)
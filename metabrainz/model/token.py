@@ -2,10 +2,37 @@ from metabrainz.model import db
 from metabrainz.model import token_log
 from metabrainz.model.token_log import TokenLog
 from metabrainz.utils import generate_string
+from metabrainz.local_cache import LocalCache
+from brainzutils import cache
+from collections import Counter
 from datetime import datetime, timedelta
+import logging
+import redis
+import threading
 
 TOKEN_LENGTH = 40
 
+# Validity of tokens is cached in two tiers: a short-lived in-process LRU cache
+# in front of a Redis entry. Revoking a token caches it as invalid in Redis
+# right away (rather than removing the entry, which a concurrent lookup that
+# read the token before it was revoked could fill in as valid again), other
+# processes can keep using their local copy for up to LOCAL_CACHE_TTL.
+# Tokens that don't exist or have been revoked are cached as invalid for a
+# shorter time, so that requests with them don't reach the database either.
+# If Redis is unavailable, tokens are looked up in the database.
+CACHE_NAMESPACE = "token_valid"
+CACHE_TTL = 60 * 60  # 1 hour
+NEGATIVE_CACHE_TTL = 60 * 5  # 5 minutes
+LOCAL_CACHE_TTL = 10
+LOCAL_CACHE_SIZE = 10000
+
+CACHE_STATS_KEY = "token_cache_stats"
+CACHE_STATS_FLUSH_INTERVAL = 1000  # number of lookups
+
+_local_cache = LocalCache(max_size=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL)
+_cache_stats = Counter()
+_cache_stats_lock = threading.Lock()
+
 
 class Token(db.Model):
     __tablename__ = 'token'
@@ -73,15 +100,75 @@ class Token(db.Model):
 
     @classmethod
     def is_valid(cls, token_value):
-        """Checks if token exists and is active."""
+        """Checks if token exists and is active.
+
+        Results are cached (see `CACHE_NAMESPACE`), so in the steady state
+        this doesn't touch the database, whether the token is valid or not.
+        """
+        valid = _local_cache.get(token_value)
+        if valid is not None:
+            _count_cache_lookup("local_hits")
+            return valid
+        try:
+            valid = cache.get(token_value, namespace=CACHE_NAMESPACE)
+        except redis.RedisError as e:
+            logging.warning("Failed to read cached validity of a token: %s", e)
+            valid = None
+        if valid is not None:
+            _count_cache_lookup("redis_hits")
+            _local_cache.set(token_value, valid)
+            return valid
+        _count_cache_lookup("misses")
+
         token = cls.get(value=token_value)
-        return token and token.is_active
+        valid = bool(token and token.is_active)
+        try:
+            cache.set(token_value, valid, CACHE_TTL if valid else NEGATIVE_CACHE_TTL, namespace=CACHE_NAMESPACE)
+        except redis.RedisError as e:
+            logging.warning("Failed to cache validity of a token: %s", e)
+        _local_cache.set(token_value, valid)
+        return valid
+
+    @staticmethod
+    def invalidate_cache(token_value):
+        """Caches a token as invalid."""
+        cache.set(token_value, False, NEGATIVE_CACHE_TTL, namespace=CACHE_NAMESPACE)
+        _local_cache.delete(token_value)
 
     def revoke(self):
         self.is_active = False
         db.session.commit()
+        self.invalidate_cache(self.value)
         TokenLog.create_record(self.value, token_log.ACTION_DEACTIVATE)
 
 
+def _count_cache_lookup(result):
+    """Counts result of a token cache lookup and periodically adds collected
+    counts to totals shared by all processes in Redis."""
+    with _cache_stats_lock:
+        _cache_stats[result] += 1
+        if sum(_cache_stats.values()) < CACHE_STATS_FLUSH_INTERVAL:
+            return
+        counts = dict(_cache_stats)
+        _cache_stats.clear()
+    try:
+        for key, count in counts.items():
+            cache.hincrby(CACHE_STATS_KEY, key, count)
+    except redis.RedisError as e:
+        logging.warning("Failed to add token cache stats: %s", e)
+
+
+def get_cache_stats():
+    """Returns totals of token cache lookups as a dictionary with
+    `local_hits`, `redis_hits`, `misses` and `hit_ratio` items.
+    """
+    totals = {key.decode() if isinstance(key, bytes) else key: int(count)
+              for key, count in cache.hgetall(CACHE_STATS_KEY).items()}
+    stats = {key: totals.get(key, 0) for key in ("local_hits", "redis_hits", "misses")}
+    lookups = sum(stats.values())
+    stats["hit_ratio"] = (stats["local_hits"] + stats["redis_hits"]) / lookups if lookups else None
+    return stats
+
+
 class TokenGenerationLimitException(Exception):
     pass
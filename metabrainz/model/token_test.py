@@ -0,0 +1,57 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.model import token as token_module
+from metabrainz.model.token import Token
+from brainzutils import cache
+from unittest import mock
+import redis
+
+
+class TokenTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(TokenTestCase, self).setUp()
+        token_module._local_cache.clear()
+
+    def test_is_valid(self):
+        token = Token.generate_token(owner_id=None)
+        self.assertTrue(Token.is_valid(token))
+        self.assertFalse(Token.is_valid("fake"))
+
+    def test_is_valid_cached(self):
+        token = Token.generate_token(owner_id=None)
+        self.assertTrue(Token.is_valid(token))
+        self.assertTrue(cache.get(token, namespace=token_module.CACHE_NAMESPACE))
+
+        with mock.patch.object(Token, 'get') as get:
+            self.assertTrue(Token.is_valid(token))
+            token_module._local_cache.clear()
+            self.assertTrue(Token.is_valid(token))
+            get.assert_not_called()
+
+    def test_revoke_invalidates_cache(self):
+        token = Token.generate_token(owner_id=None)
+        self.assertTrue(Token.is_valid(token))
+        Token.get(value=token).revoke()
+        self.assertIs(cache.get(token, namespace=token_module.CACHE_NAMESPACE), False)
+        self.assertFalse(Token.is_valid(token))
+
+    def test_is_valid_without_redis(self):
+        token = Token.generate_token(owner_id=None)
+        with mock.patch.object(cache, 'get', side_effect=redis.ConnectionError("down")), \
+                mock.patch.object(cache, 'set', side_effect=redis.ConnectionError("down")):
+            self.assertTrue(Token.is_valid(token))
+            self.assertFalse(Token.is_valid("fake"))
+            # The local cache is still used.
+            with mock.patch.object(Token, 'get') as get:
+                self.assertTrue(Token.is_valid(token))
+                get.assert_not_called()
+
+    def test_is_valid_negative_cached(self):
+        self.assertFalse(Token.is_valid("fake"))
+        self.assertIs(cache.get("fake", namespace=token_module.CACHE_NAMESPACE), False)
+
+        with mock.patch.object(Token, 'get') as get:
+            self.assertFalse(Token.is_valid("fake"))
+            token_module._local_cache.clear()
+            self.assertFalse(Token.is_valid("fake"))
+            get.assert_not_called()
@@ -0,0 +1,18 @@
+"""Raw access to the Redis connection of `brainzutils.cache`.
+
+The cache only supports getting and setting serialized values. Rate limiting,
+IP blocks, metrics and a few other features need other Redis commands (hashes,
+sorted sets, pub/sub, scripts, atomic flags), so they use the connection of the
+cache directly, with keys prefixed in the same way as the keys of the cache.
+"""
+from brainzutils import cache
+
+
+def connection():
+    """Returns the Redis client of the cache, which must be initialized."""
+    return cache._r
+
+
+def key(name, namespace=None):
+    """Returns a Redis key prefixed like the keys of the cache."""
+    return cache._prep_key(name, namespace=namespace)
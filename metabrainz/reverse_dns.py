@@ -0,0 +1,107 @@
+"""Reverse DNS lookups of IP addresses for the admin interface.
+
+Lookups run in a bounded thread pool, so resolving a page of addresses takes
+about as long as the slowest lookup instead of the sum of all of them, and
+callers only wait for them up to a timeout. Lookups that finish after that
+still store their result in the cache, for the next time the addresses are
+shown.
+
+Resolved names are cached in Redis for `CACHE_TTL` seconds. Failed lookups are
+cached as well, as an empty name for `NEGATIVE_CACHE_TTL` seconds, so that
+addresses without a name aren't looked up again on every page view.
+"""
+from brainzutils import cache
+from concurrent import futures
+import socket
+import threading
+
+CACHE_NAMESPACE = "reverse_dns"
+CACHE_TTL = 60 * 60  # 1 hour
+NEGATIVE_CACHE_TTL = 60 * 10  # 10 minutes
+
+MAX_WORKERS = 16
+DEFAULT_TIMEOUT = 5
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="reverse-dns")
+        return _executor
+
+
+def lookup(ip_address):
+    """Looks up the name of an IP address, returns None if it doesn't have one."""
+    try:
+        return socket.gethostbyaddr(ip_address)[0]
+    except (OSError, UnicodeError, ValueError):
+        return None
+
+
+def _lookup_and_cache(ip_address):
+    try:
+        name = lookup(ip_address)
+        if name:
+            cache.set(ip_address, name, CACHE_TTL, namespace=CACHE_NAMESPACE)
+        else:
+            cache.set(ip_address, "", NEGATIVE_CACHE_TTL, namespace=CACHE_NAMESPACE)
+        return name
+    finally:
+        with _lock:
+            _pending.pop(ip_address, None)
+
+
+def _submit(ip_addresses):
+    """Starts lookups of addresses, reusing ones that are already running.
+
+    Returns:
+        Dictionary of futures by IP address.
+    """
+    executor = _get_executor()
+    submitted = {}
+    with _lock:
+        for ip_address in ip_addresses:
+            future = _pending.get(ip_address)
+            if future is None:
+                future = _pending[ip_address] = executor.submit(_lookup_and_cache, ip_address)
+            submitted[ip_address] = future
+    return submitted
+
+
+def resolve_many(ip_addresses, timeout=DEFAULT_TIMEOUT):
+    """Returns names of IP addresses, from the cache or looked up in parallel.
+
+    Args:
+        ip_addresses: Iterable of IP addresses.
+        timeout: Max number of seconds to wait for lookups, or None to wait
+            until all of them finish.
+
+    Returns:
+        Dictionary of names (or None if an address has no name or it couldn't
+        be looked up in time) by IP address.
+    """
+    ip_addresses = {ip_address for ip_address in ip_addresses if ip_address}
+    if not ip_addresses:
+        return {}
+    cached = cache.get_many(list(ip_addresses), namespace=CACHE_NAMESPACE)
+    names = {ip_address: name or None for ip_address, name in cached.items()}
+
+    submitted = _submit(ip_addresses - names.keys())
+    if submitted:
+        futures.wait(submitted.values(), timeout=timeout)
+    for ip_address, future in submitted.items():
+        names[ip_address] = future.result() if future.done() and not future.exception() else None
+    return names
+
+
+def prefetch(ip_addresses):
+    """Starts looking up addresses that aren't cached, without waiting for them."""
+    ip_addresses = {ip_address for ip_address in ip_addresses if ip_address}
+    if ip_addresses:
+        cached = cache.get_many(list(ip_addresses), namespace=CACHE_NAMESPACE)
+        _submit(ip_addresses - cached.keys())
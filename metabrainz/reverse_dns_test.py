@@ -0,0 +1,60 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz import reverse_dns
+from brainzutils import cache
+from unittest import mock
+import threading
+import socket
+import uuid
+
+
+def _random_ip():
+    return "10.%s.%s.%s" % tuple(uuid.uuid4().bytes[:3])
+
+
+class ReverseDNSTestCase(FlaskTestCase):
+
+    def test_resolve_many(self):
+        named, unnamed = _random_ip(), _random_ip()
+
+        def gethostbyaddr(ip_address):
+            if ip_address == named:
+                return "host.example.org", [], [ip_address]
+            raise socket.herror(1, "Unknown host")
+
+        with mock.patch.object(reverse_dns.socket, "gethostbyaddr", side_effect=gethostbyaddr) as lookup:
+            self.assertEqual(reverse_dns.resolve_many([named, unnamed, named, None]),
+                             {named: "host.example.org", unnamed: None})
+            self.assertEqual(lookup.call_count, 2)
+
+            # Both names and failures are cached.
+            self.assertEqual(reverse_dns.resolve_many([named, unnamed]),
+                             {named: "host.example.org", unnamed: None})
+            self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(cache.get(unnamed, namespace=reverse_dns.CACHE_NAMESPACE), "")
+
+    def test_resolve_many_timeout(self):
+        ip_address = _random_ip()
+        release = threading.Event()
+
+        def gethostbyaddr(ip_address):
+            release.wait(5)
+            return "slow.example.org", [], [ip_address]
+
+        with mock.patch.object(reverse_dns.socket, "gethostbyaddr", side_effect=gethostbyaddr) as lookup:
+            self.assertEqual(reverse_dns.resolve_many([ip_address], timeout=0.1), {ip_address: None})
+            # The running lookup is reused instead of starting another one.
+            future = reverse_dns._submit([ip_address])[ip_address]
+            release.set()
+            self.assertEqual(future.result(5), "slow.example.org")
+            self.assertEqual(lookup.call_count, 1)
+        # Late results are cached for the next time.
+        self.assertEqual(reverse_dns.resolve_many([ip_address]), {ip_address: "slow.example.org"})
+
+    def test_prefetch(self):
+        ip_address = _random_ip()
+        with mock.patch.object(reverse_dns.socket, "gethostbyaddr", return_value=("pre.example.org", [], [])):
+            reverse_dns.prefetch([ip_address])
+            future = reverse_dns._pending.get(ip_address)
+            if future is not None:
+                future.result(5)
+        self.assertEqual(cache.get(ip_address, namespace=reverse_dns.CACHE_NAMESPACE), "pre.example.org")
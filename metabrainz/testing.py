@@ -1,5 +1,6 @@
 import unittest
 
+from brainzutils import cache
 from flask import template_rendered, message_flashed
 
 from metabrainz import create_app as create_web_app
@@ -57,6 +58,7 @@ class FlaskTestCase(unittest.TestCase):
         self._ctx = self.app.test_request_context()
         self._ctx.push()
         self.reset_db()
+        self.reset_redis()
 
         FlaskTestCase.template = None
         FlaskTestCase.flashed_messages = []
@@ -87,6 +89,11 @@ class FlaskTestCase(unittest.TestCase):
         self.drop_tables()
         self.init_db()
 
+    def reset_redis(self):
+        # Counters like the invalid token counts of ip_block would otherwise
+        # accumulate across tests.
+        cache.flush_all()
+
     def init_db(self):
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_tables.sql'))
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_primary_keys.sql'))
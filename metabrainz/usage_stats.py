@@ -0,0 +1,105 @@
+"""Cached top IP addresses and tokens for the admin statistics pages.
+
+Lists of the most active IP addresses and tokens (see `AccessLog.top_ips` and
+`AccessLog.top_tokens`) aggregate days of the access log, so they are kept in
+Redis per number of days, with the time they were computed at. A list that is
+older than `REFRESH_AFTER` seconds is still served, and recomputed in a
+background thread, so that only the first visit for a number of days waits for
+the query. `manage.py update-usage-stats` recomputes the common ones ahead of
+time.
+
+Computing the top IP addresses also starts looking up their names (see
+`metabrainz.reverse_dns`), so that they're cached by the time the list is
+shown.
+"""
+from brainzutils import cache
+from datetime import datetime, timezone
+from flask import current_app
+from metabrainz.model.access_log import AccessLog
+from metabrainz import raw_cache, reverse_dns
+import logging
+import threading
+import time
+
+CACHE_NAMESPACE = "usage_stats"
+CACHE_TTL = 60 * 60 * 24  # 1 day
+REFRESH_AFTER = 60 * 10  # 10 minutes
+REFRESH_LOCK_TTL = 60 * 10
+
+LIMIT = 100
+DEFAULT_DAYS = (1, 7, 30)
+
+STATS = {
+    "top_ips": AccessLog.top_ips,
+    "top_tokens": AccessLog.top_tokens,
+}
+
+
+def _key(name, days):
+    return "%s:%s" % (name, days)
+
+
+def compute(name, days):
+    """Computes a list and stores it in the cache.
+
+    Returns:
+        Dictionary with `non_commercial` and `commercial` lists of rows and the
+        `computed_at` timestamp.
+    """
+    non_commercial, commercial = STATS[name](days=days, limit=LIMIT)
+    entry = {
+        "computed_at": time.time(),
+        "non_commercial": [list(row) for row in non_commercial],
+        "commercial": [list(row) for row in commercial],
+    }
+    cache.set(_key(name, days), entry, CACHE_TTL, namespace=CACHE_NAMESPACE)
+    if name == "top_ips":
+        reverse_dns.prefetch(row[0] for row in entry["non_commercial"] + entry["commercial"])
+    return entry
+
+
+def _refresh(app, name, days, lock_key):
+    try:
+        with app.app_context():
+            compute(name, days)
+    except Exception:
+        logging.exception("Failed to refresh %s for %s days", name, days)
+    finally:
+        raw_cache.connection().delete(lock_key)
+
+
+def refresh_in_background(name, days):
+    """Recomputes a list in a background thread, unless some process is
+    already doing that."""
+    lock_key = raw_cache.key("refresh:%s" % _key(name, days), namespace=CACHE_NAMESPACE)
+    if not raw_cache.connection().set(lock_key, 1, ex=REFRESH_LOCK_TTL, nx=True):
+        return
+    threading.Thread(
+        target=_refresh,
+        args=(current_app._get_current_object(), name, days, lock_key),
+        name="usage-stats-refresh",
+        daemon=True,
+    ).start()
+
+
+def get(name, days, now=None):
+    """Returns a list from the cache (see `compute`), with `computed_at`
+    converted to a datetime.
+
+    Lists that aren't cached are computed right away, outdated ones are
+    returned and refreshed in the background.
+    """
+    now = now if now is not None else time.time()
+    entry = cache.get(_key(name, days), namespace=CACHE_NAMESPACE)
+    if entry is None:
+        entry = compute(name, days)
+    elif now - entry["computed_at"] > REFRESH_AFTER:
+        refresh_in_background(name, days)
+    return dict(entry, computed_at=datetime.fromtimestamp(entry["computed_at"], timezone.utc))
+
+
+def update(days_values=DEFAULT_DAYS):
+    """Recomputes all lists for the given numbers of days."""
+    for name in STATS:
+        for days in days_values:
+            compute(name, days)
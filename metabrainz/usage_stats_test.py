@@ -0,0 +1,62 @@
+from metabrainz.testing import FlaskTestCase
+from metabrainz.model import AccessLog, Supporter
+from metabrainz.model.supporter import STATE_ACTIVE
+from metabrainz import usage_stats
+from brainzutils import cache
+from unittest import mock
+import time
+
+
+class UsageStatsTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(UsageStatsTestCase, self).setUp()
+        for name in usage_stats.STATS:
+            for days in (7, 30):
+                cache.delete(usage_stats._key(name, days), namespace=usage_stats.CACHE_NAMESPACE)
+        supporter = Supporter.add(is_commercial=True,
+                                  musicbrainz_id="mb_commercial",
+                                  musicbrainz_row_id=3,
+                                  contact_name="Mr. Commercial",
+                                  contact_email="testc@musicbrainz.org",
+                                  data_usage_desc="poop!",
+                                  org_desc="foo!"
+                                  )
+        supporter.set_state(STATE_ACTIVE)
+        self.token = supporter.generate_token()
+        AccessLog.create_record(self.token, "10.1.3.1")
+
+    def test_get_computes_and_caches(self):
+        stats = usage_stats.get("top_tokens", 7)
+        self.assertEqual(stats["non_commercial"], [])
+        self.assertEqual(len(stats["commercial"]), 1)
+        self.assertEqual(stats["commercial"][0][0], self.token)
+
+        with mock.patch.dict(usage_stats.STATS, {"top_tokens": mock.Mock()}) as stats_functions:
+            cached = usage_stats.get("top_tokens", 7)
+            stats_functions["top_tokens"].assert_not_called()
+        self.assertEqual(cached, stats)
+
+    def test_get_refreshes_outdated(self):
+        usage_stats.get("top_ips", 30)
+        with mock.patch.object(usage_stats, "refresh_in_background") as refresh:
+            usage_stats.get("top_ips", 30)
+            refresh.assert_not_called()
+            usage_stats.get("top_ips", 30, now=time.time() + usage_stats.REFRESH_AFTER + 1)
+            refresh.assert_called_once_with("top_ips", 30)
+
+    def test_refresh_in_background(self):
+        with mock.patch.object(usage_stats.threading, "Thread") as thread:
+            usage_stats.refresh_in_background("top_ips", 7)
+            usage_stats.refresh_in_background("top_ips", 7)
+            thread.assert_called_once()
+            target, args = thread.call_args[1]["target"], thread.call_args[1]["args"]
+
+        with mock.patch.object(usage_stats, "compute") as compute:
+            target(*args)
+            compute.assert_called_once_with("top_ips", 7)
+        # The lock is released once the list is refreshed.
+        with mock.patch.object(usage_stats.threading, "Thread") as thread:
+            usage_stats.refresh_in_background("top_ips", 7)
+            thread.assert_called_once()
+            target(*thread.call_args[1]["args"])
@@ -97,6 +97,13 @@ def create_app(debug=None, config_path=None):
     from oauth import model
     model.db.init_app(app)
 
+    # Redis (cache), used to aggregate metrics of all processes
+    from brainzutils import cache
+    cache.init(**app.config["REDIS"])
+
+    from metabrainz import metrics
+    metrics.init_app(app)
+
     # Templates
     from metabrainz.utils import reformat_datetime
     app.jinja_env.filters["datetime"] = reformat_datetime